@@ -0,0 +1,104 @@
+import asyncio, time
+
+# Just enough of discord.py's channels and messages for the bot to post lobbies to, every call is timed and recorded
+# (along with which game it was for, worked out from the embed's link) rather than going anywhere
+
+
+class DiscordSink:
+    """Records every Discord call made to the fake channels as (time, route, ChannelID, GameIDs), GameIDs being every
+    game with an embed in the call (one for a lobby message, all of a page's for a board)"""
+
+    def __init__(self, latency=0.0):
+
+        self.latency = latency
+        self.calls = []
+
+        self._next_message_id = 1
+
+    async def record(self, route, channel_id, embeds=()):
+
+        if self.latency:
+
+            await asyncio.sleep(self.latency)
+
+        game_ids = tuple(int(embed.url.rstrip("/").rsplit("/", 1)[1]) for embed in embeds if embed.url)
+
+        self.calls.append((time.perf_counter(), route, channel_id, game_ids))
+
+    def new_message_id(self):
+
+        message_id = self._next_message_id
+        self._next_message_id += 1
+
+        return message_id
+
+
+class FakeGuild:
+
+    def __init__(self, guild_id, name):
+
+        self.id = guild_id
+        self.name = name
+
+
+class FakeMessage:
+
+    def __init__(self, channel, message_id):
+
+        self.channel = channel
+        self.id = message_id
+
+    async def edit(self, embed=None, embeds=None, **kwargs):
+
+        await self.channel.sink.record("edit", self.channel.id, [embed] if embed is not None else embeds or [])
+
+    async def delete(self):
+
+        await self.channel.sink.record("delete", self.channel.id)
+
+    async def pin(self):
+
+        await self.channel.sink.record("pin", self.channel.id)
+
+
+class FakeChannel:
+
+    def __init__(self, channel_id, guild, sink):
+
+        self.id = channel_id
+        self.guild = guild
+        self.sink = sink
+        self.name = "mgo1-lobbies"
+
+    async def send(self, content=None, embed=None, embeds=None, **kwargs):
+
+        await self.sink.record("send", self.id, [embed] if embed is not None else embeds or [])
+
+        return FakeMessage(self, self.sink.new_message_id())
+
+    async def purge(self, limit=100):
+
+        await self.sink.record("purge", self.id)
+
+    async def edit(self, name=None, **kwargs):
+
+        await self.sink.record("channel_edit", self.id)
+
+        self.name = name if name is not None else self.name
+
+    def get_partial_message(self, message_id):
+
+        return FakeMessage(self, message_id)
+
+
+class FakeClient:
+    """Stands in for the bot when resolving channels, with one guild per channel"""
+
+    def __init__(self, channel_ids, sink):
+
+        self.channels = {channel_id: FakeChannel(channel_id, FakeGuild(channel_id, f"Guild {channel_id}"), sink)
+                         for channel_id in channel_ids}
+
+    def get_channel(self, channel_id):
+
+        return self.channels.get(channel_id)
@@ -0,0 +1,295 @@
+import asyncio, json, random, socket, time
+from collections import Counter
+
+from aiohttp import web
+
+# A stand-in for the SaveMGO API and websocket that runs locally, so the bot can be pointed at it (through
+# SAVEMGO_API_URL and SAVEMGO_WS_URL) and fed events at whatever rate we like. It keeps its own copy of the games so the
+# API answers match the events it has sent, and counts every API request it gets
+
+MAPS = ["Brown Town", "City Under Siege", "Ghost Factory", "Graniny Gorki Lab", "High Ice", "Killhouse A",
+        "Killhouse B", "Killhouse C", "Lost Forest", "Mountaintop", "Pillbox Purgatory", "Svyatogornyj East"]
+
+MODES = ["deathmatch", "team deathmatch", "capture mission", "sabotage mission", "rescue mission", "sneaking mission"]
+
+
+class FakeSaveMGO:
+
+    def __init__(self, lobbies, players_per_lobby=4, api_latency=0.0, seed=0):
+
+        self.target_lobbies = lobbies
+        self.api_latency = api_latency
+        self.random = random.Random(seed)
+
+        # GameID -> game, in the same shape games/list and games/{id} send them, and UserID -> display name
+
+        self.games = {}
+        self.users = {}
+
+        # Games that have been deleted can still be looked up by GameID, same as finished games on the real site
+
+        self.finished_games = {}
+
+        self.api_calls = Counter()
+        self.sent_events = []
+
+        self._next_game_id = 1
+        self._next_user_id = 1
+        self._subscribers = set()
+        self._subscribed = asyncio.Event()
+        self._runner = None
+
+        for _ in range(lobbies):
+
+            self._new_game(players=self.random.randint(1, players_per_lobby * 2 - 1))
+
+    def _new_user(self):
+
+        user_id = self._next_user_id
+        self._next_user_id += 1
+
+        self.users[user_id] = f"Player {user_id}"
+
+        return user_id
+
+    def _new_game(self, players=1):
+
+        game_id = self._next_game_id
+        self._next_game_id += 1
+
+        host = self._new_user()
+
+        self.games[game_id] = {"id": game_id, "user_id": host, "current_round": 0,
+                               "options": {"name": f"Lobby {game_id}", "description": "benchmark lobby",
+                                           "max_players": 16,
+                                           "rules": [{"map_string": self.random.choice(MAPS),
+                                                      "mode_string": self.random.choice(MODES)}]},
+                               "players": [{"user_id": host}] + [{"user_id": self._new_user()}
+                                                                 for _ in range(players - 1)]}
+
+        return self.games[game_id]
+
+    # Events
+
+    def synthetic_event(self):
+        """Makes up the next event, keeping the number of lobbies hovering around the target, and applies it to the
+        fake's own state so the API stays consistent with what's been sent"""
+
+        roll = self.random.random()
+
+        if not self.games or (roll < 0.08 and len(self.games) < self.target_lobbies * 1.1):
+
+            game = self._new_game()
+            rule = game["options"]["rules"][0]
+
+            return {"event": "game_created",
+                    "data": {"game_id": game["id"], "host": self.users[game["user_id"]],
+                             "name": game["options"]["name"],
+                             "rules": [{"Map": rule["map_string"], "Mode": rule["mode_string"]}]}}
+
+        game = self.games[self.random.choice(list(self.games))]
+
+        if roll < 0.16 and len(self.games) > self.target_lobbies * 0.9:
+
+            self.finished_games[game["id"]] = self.games.pop(game["id"])
+
+            return {"event": "game_deleted", "data": {"game_id": game["id"]}}
+
+        if roll < 0.30:
+
+            rule = {"map_string": self.random.choice(MAPS), "mode_string": self.random.choice(MODES)}
+
+            game["options"]["rules"].append(rule)
+            game["current_round"] = len(game["options"]["rules"]) - 1
+
+            return {"event": "game_new_round",
+                    "data": {"game_id": game["id"], "map": rule["map_string"], "mode": rule["mode_string"]}}
+
+        if roll < 0.65 and len(game["players"]) > 1:
+
+            player = game["players"].pop(self.random.randrange(1, len(game["players"])))
+
+            return {"event": "game_player_left", "data": {"game_id": game["id"], "user_id": player["user_id"]}}
+
+        user_id = self._new_user() if self.random.random() < 0.3 or len(self.users) < 2 else \
+            self.random.randint(1, len(self.users))
+
+        if user_id not in {player["user_id"] for player in game["players"]}:
+
+            game["players"].append({"user_id": user_id})
+
+        return {"event": "game_player_joined", "data": {"game_id": game["id"], "user_id": user_id}}
+
+    def apply_recorded_event(self, event):
+        """Brings the fake's state in line with an event from a recording, so games/{id} etc. can answer for it"""
+
+        data = event["data"]
+        game_id = data["game_id"]
+
+        if event["event"] == "game_created":
+
+            self._next_game_id = max(self._next_game_id, game_id + 1)
+
+            host = self._new_user()
+
+            self.games[game_id] = {"id": game_id, "user_id": host, "current_round": 0,
+                                   "options": {"name": data.get("name", f"Lobby {game_id}"), "description": "",
+                                               "max_players": 16,
+                                               "rules": [{"map_string": rule["Map"], "mode_string": rule["Mode"]}
+                                                         for rule in data.get("rules", [])]},
+                                   "players": [{"user_id": host}]}
+
+        elif event["event"] == "game_deleted" and game_id in self.games:
+
+            self.finished_games[game_id] = self.games.pop(game_id)
+
+        elif game_id in self.games and event["event"] == "game_player_joined":
+
+            self.users.setdefault(data["user_id"], f"Player {data['user_id']}")
+
+            self.games[game_id]["players"].append({"user_id": data["user_id"]})
+
+        elif game_id in self.games and event["event"] == "game_player_left":
+
+            self.games[game_id]["players"] = [player for player in self.games[game_id]["players"]
+                                              if player["user_id"] != data["user_id"]]
+
+    async def replay(self, events, rate):
+        """Sends every event in "events" to the subscribed bot, "rate" events a second (0 for as fast as possible),
+        and records when each one went out. "events" can be a generator, synthetic events should be made as they're
+        sent so the API only knows about what the bot could have heard about"""
+
+        interval = 1 / rate if rate else 0
+        start = time.perf_counter()
+
+        for count, event in enumerate(events):
+
+            if interval:
+
+                delay = start + count * interval - time.perf_counter()
+
+                if delay > 0:
+
+                    await asyncio.sleep(delay)
+
+            message = json.dumps(event)
+
+            self.sent_events.append((time.perf_counter(), event["data"]["game_id"], event["event"]))
+
+            for subscriber in list(self._subscribers):
+
+                await subscriber.send_str(message)
+
+            if not interval:
+
+                # Still let the bot get a look in, otherwise the whole burst is queued before it reads a thing
+
+                await asyncio.sleep(0)
+
+    # HTTP and websocket server
+
+    async def _delay(self, route):
+
+        self.api_calls[route] += 1
+
+        if self.api_latency:
+
+            await asyncio.sleep(self.api_latency)
+
+    async def _games_list(self, request):
+
+        await self._delay("games/list")
+
+        return web.json_response({"data": list(self.games.values())})
+
+    async def _game(self, request):
+
+        await self._delay("games/{id}")
+
+        game_id = int(request.match_info["game_id"])
+
+        game = self.games.get(game_id) or self.finished_games.get(game_id)
+
+        if game is None:
+
+            return web.json_response({"data": None}, status=404)
+
+        return web.json_response({"data": game})
+
+    async def _user(self, request):
+
+        await self._delay("user/{id}")
+
+        user_id = int(request.match_info["user_id"])
+
+        return web.json_response({"data": {"id": user_id, "display_name": self.users.get(user_id, "")}})
+
+    async def _lobby_list(self, request):
+
+        await self._delay("lobby/list")
+
+        players = sum(len(game["players"]) for game in self.games.values())
+
+        return web.json_response({"data": [{"name": "Benchmark", "players": players}]})
+
+    async def _stream(self, request):
+
+        websocket = web.WebSocketResponse()
+
+        await websocket.prepare(request)
+
+        # The bot sends its subscription query first, after that it's just listening
+
+        await websocket.receive()
+
+        self._subscribers.add(websocket)
+        self._subscribed.set()
+
+        try:
+
+            async for _ in websocket:
+
+                pass
+
+        finally:
+
+            self._subscribers.discard(websocket)
+
+        return websocket
+
+    async def wait_for_subscriber(self, timeout=10):
+
+        await asyncio.wait_for(self._subscribed.wait(), timeout)
+
+    async def start(self):
+        """Starts serving on a free local port, returns the API base URL and the websocket URL to point the bot at"""
+
+        app = web.Application()
+        app.router.add_get("/api/v1/games/list", self._games_list)
+        app.router.add_get("/api/v1/games/{game_id}", self._game)
+        app.router.add_get("/api/v1/user/{user_id}", self._user)
+        app.router.add_get("/api/v1/lobby/list", self._lobby_list)
+        app.router.add_get("/api/v1/stream/events", self._stream)
+
+        self._runner = web.AppRunner(app, access_log=None)
+
+        await self._runner.setup()
+
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+
+        await web.SockSite(self._runner, sock).start()
+
+        port = sock.getsockname()[1]
+
+        return f"http://127.0.0.1:{port}/api/v1", f"ws://127.0.0.1:{port}/api/v1/stream/events"
+
+    async def stop(self):
+
+        for subscriber in list(self._subscribers):
+
+            await subscriber.close()
+
+        if self._runner is not None:
+
+            await self._runner.cleanup()
@@ -0,0 +1,341 @@
+"""Offline load benchmark for the bot.
+
+Runs the real event handling in main.py against a local fake SaveMGO (API and websocket) and a fake Discord that just
+counts and times calls, then reports events/sec, SaveMGO API calls per event, Discord calls per event and end-to-end
+latency (from an event leaving the fake websocket to the first Discord call for that game after it) for each scenario,
+along with how long the bot took to start and how much memory it used.
+
+    python benchmarks/run_benchmark.py                      # 5, 50 and 500 lobbies, synthetic events
+    python benchmarks/run_benchmark.py --lobbies 50 --rate 0 --events 5000
+    python benchmarks/run_benchmark.py --replay recorded_events.jsonl
+    python benchmarks/run_benchmark.py --low-memory
+
+A recording is one websocket message (as SaveMGO sends it) per line. Every scenario runs in its own process, since
+main.py keeps its state in module globals."""
+
+import argparse, asyncio, bisect, contextlib, io, json, os, subprocess, sys, tempfile, time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+
+def percentile(values, fraction):
+
+    if not values:
+
+        return None
+
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def peak_rss_mb():
+    """The most resident memory this process has used so far in MB, or None where that can't be told"""
+
+    try:
+
+        import resource
+
+    except ImportError:
+
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # macOS reports it in bytes, everything else in KB
+
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def rss_mb():
+    """This process's resident memory in MB right now, from /proc where there is one, otherwise the peak so far"""
+
+    try:
+
+        with open("/proc/self/statm") as file:
+
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+    except (OSError, ValueError):
+
+        return peak_rss_mb()
+
+
+def latencies(sent_events, discord_calls):
+    """For every event sent, how long until the next Discord call about the same game"""
+
+    calls_by_game = {}
+
+    for call_time, _, _, game_ids in discord_calls:
+
+        for game_id in game_ids:
+
+            calls_by_game.setdefault(game_id, []).append(call_time)
+
+    results = []
+    undelivered = 0
+
+    for sent_time, game_id, _ in sent_events:
+
+        times = calls_by_game.get(game_id, [])
+        index = bisect.bisect_left(times, sent_time)
+
+        if index < len(times):
+
+            results.append(times[index] - sent_time)
+
+        else:
+
+            # Deleted games whose messages were never posted, or updates that changed nothing, land here
+
+            undelivered += 1
+
+    return results, undelivered
+
+
+async def wait_until_idle(main, timeout):
+    """Waits until the bot has no renders waiting and nothing queued or in flight to Discord"""
+
+    deadline = time.perf_counter() + timeout
+
+    while time.perf_counter() < deadline:
+
+        renders = main.render_scheduler.stats()
+        outbound = main.outbound.stats()
+
+        if not renders["pending"] and not outbound["queued"] and not outbound["running"]:
+
+            return True
+
+        await asyncio.sleep(0.005)
+
+    return False
+
+
+async def run_scenario(args, lobbies):
+
+    sys.path.insert(0, BENCHMARK_DIR)
+    sys.path.insert(0, REPO_DIR)
+
+    from fake_savemgo import FakeSaveMGO
+    from fake_discord import DiscordSink, FakeClient
+
+    server = FakeSaveMGO(lobbies, players_per_lobby=args.players, api_latency=args.api_latency / 1000,
+                         seed=args.seed)
+
+    api_url, ws_url = await server.start()
+
+    state_dir = tempfile.mkdtemp(prefix="mgo1-bench-")
+    channel_ids = [1000 + number for number in range(args.channels)]
+
+    os.environ.update({"BOT_TOKEN": "benchmark",
+                       "CHANNEL_IDS": json.dumps({f"Guild {channel_id}": channel_id for channel_id in channel_ids}),
+                       "SAVEMGO_API_URL": api_url,
+                       "SAVEMGO_WS_URL": ws_url,
+                       "RENDER_DEBOUNCE": str(args.debounce),
+                       "DISPLAY_MODE": "board" if args.board else "messages",
+                       "LOW_MEMORY": "1" if args.low_memory else "",
+                       "NAME_CACHE_PATH": os.path.join(state_dir, "name_cache.json"),
+                       "STATE_SNAPSHOT_PATH": os.path.join(state_dir, "state_snapshot.json"),
+                       "HISTORY_PATH": os.path.join(state_dir, "event_history.sqlite3")})
+
+    # main.py prints a line for nearly every event, which would drown out the results
+
+    with contextlib.redirect_stdout(sys.stderr if os.environ.get("BENCH_DEBUG") else io.StringIO()):
+
+        memory_before = rss_mb()
+        started = time.perf_counter()
+
+        import main
+
+        import_seconds = time.perf_counter() - started
+
+        sink = DiscordSink(latency=args.discord_latency / 1000)
+
+        if not args.real_rate_limits:
+
+            main.outbound.route_limits = {route: (10 ** 9, 1.0) for route in main.outbound.route_limits}
+
+        main.channel_registry.refresh(FakeClient(channel_ids, sink))
+
+        started = time.perf_counter()
+
+        await main.cold_start()
+        await wait_until_idle(main, args.timeout)
+
+        startup = time.perf_counter() - started
+        startup_api_calls = sum(server.api_calls.values())
+        startup_discord_calls = len(sink.calls)
+        memory_after_startup = rss_mb()
+
+        main.event_history.start()
+        main.event_queue.start()
+        main.websocket_supervisor.start()
+
+        await server.wait_for_subscriber()
+
+        if args.replay:
+
+            with open(args.replay, encoding="utf-8") as file:
+
+                events = [json.loads(line) for line in file if line.strip()]
+
+            events = (server.apply_recorded_event(event) or event for event in events)
+
+        else:
+
+            events = (server.synthetic_event() for _ in range(args.events))
+
+        first_call = len(sink.calls)
+        started = time.perf_counter()
+
+        await server.replay(events, args.rate)
+
+        sent = len(server.sent_events)
+
+        # The bot has caught up with the stream once every event has been read off the socket and the queue has
+        # nothing left in it or being handled (some may have been coalesced away if it overflowed)
+
+        deadline = time.perf_counter() + args.timeout
+
+        while (main.event_queue.received < sent or len(main.event_queue) or main.event_queue.busy) and \
+                time.perf_counter() < deadline:
+
+            await asyncio.sleep(0.002)
+
+        handled = time.perf_counter() - started
+
+        await wait_until_idle(main, args.timeout)
+
+        # Steady state being everything handled and sent, with the bot still holding all its lobbies
+
+        memory_steady = rss_mb()
+
+        await main.websocket_supervisor.stop()
+        await main.event_queue.stop()
+        await main.event_history.stop()
+        await main.outbound.stop()
+        await main.api_client.close()
+        await server.stop()
+
+    stream_calls = sink.calls[first_call:]
+    stream_api_calls = sum(server.api_calls.values()) - startup_api_calls
+    results, undelivered = latencies(server.sent_events, stream_calls)
+
+    return {"lobbies": lobbies,
+            "channels": args.channels,
+            "events": sent,
+            "low_memory": args.low_memory,
+            "import_seconds": import_seconds,
+            "startup_seconds": startup,
+            "startup_api_calls": startup_api_calls,
+            "startup_discord_calls": startup_discord_calls,
+            "events_per_second": sent / handled if handled else None,
+            "api_calls_per_event": stream_api_calls / sent if sent else 0,
+            "discord_calls_per_event": len(stream_calls) / sent if sent else 0,
+            "discord_calls_by_route": {route: sum(1 for call in stream_calls if call[1] == route)
+                                       for route in sorted({call[1] for call in stream_calls})},
+            "latency_ms": {name: None if value is None else value * 1000
+                           for name, value in (("p50", percentile(results, 0.50)), ("p90", percentile(results, 0.90)),
+                                               ("p99", percentile(results, 0.99)),
+                                               ("max", max(results) if results else None))},
+            "undelivered_events": undelivered,
+            "memory_mb": {"before_import": memory_before, "after_startup": memory_after_startup,
+                          "steady": memory_steady, "peak": peak_rss_mb()}}
+
+
+def format_result(result):
+
+    latency = result["latency_ms"]
+
+    def ms(value):
+
+        return "-" if value is None else f"{value:.1f}"
+
+    return (f"{result['lobbies']:>7} lobbies  {result['events']:>6} events  "
+            f"{result['events_per_second']:>9.1f} events/s  "
+            f"{result['api_calls_per_event']:>5.2f} API/event  "
+            f"{result['discord_calls_per_event']:>6.2f} Discord/event  "
+            f"latency ms p50 {ms(latency['p50'])} p90 {ms(latency['p90'])} p99 {ms(latency['p99'])} "
+            f"max {ms(latency['max'])}  startup {result['startup_seconds']:.2f}s "
+            f"({result['startup_api_calls']} API, {result['startup_discord_calls']} Discord)  "
+            f"memory {result['memory_mb']['steady']:.1f} MB (startup {result['memory_mb']['after_startup']:.1f}, "
+            f"peak {ms(result['memory_mb']['peak'])})")
+
+
+def parse_args(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--lobbies", type=int, nargs="+", default=[5, 50, 500],
+                        help="concurrent lobbies per scenario (default: 5 50 500)")
+    parser.add_argument("--players", type=int, default=4, help="average players per lobby at the start")
+    parser.add_argument("--channels", type=int, default=3, help="lobby channels (one guild each) to post to")
+    parser.add_argument("--events", type=int, default=1000, help="synthetic events to send per scenario")
+    parser.add_argument("--rate", type=float, default=200, help="events per second to send, 0 for as fast as possible")
+    parser.add_argument("--replay", help="replay a recorded stream (one websocket message per line) instead")
+    parser.add_argument("--debounce", type=float, default=0.05, help="RENDER_DEBOUNCE for the bot, in seconds")
+    parser.add_argument("--api-latency", type=float, default=5, help="fake SaveMGO latency per request, in ms")
+    parser.add_argument("--discord-latency", type=float, default=20, help="fake Discord latency per call, in ms")
+    parser.add_argument("--board", action="store_true", help="run the bot in \"board\" display mode")
+    parser.add_argument("--low-memory", action="store_true", help="run the bot with LOW_MEMORY set")
+    parser.add_argument("--real-rate-limits", action="store_true",
+                        help="keep Discord's real rate limits in the outbound dispatcher (slow with many lobbies)")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds to wait for the bot to catch up")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--scenario", type=int, help=argparse.SUPPRESS)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+
+    args = parse_args(argv)
+
+    # Child process, runs one scenario and hands the result back as JSON
+
+    if args.scenario is not None:
+
+        print(json.dumps(asyncio.run(run_scenario(args, args.scenario))))
+
+        return
+
+    passthrough = [argument for argument in (argv if argv is not None else sys.argv[1:])]
+
+    # Drop "--lobbies ..." from what's passed on, every child gets "--scenario N" instead
+
+    if "--lobbies" in passthrough:
+
+        start = passthrough.index("--lobbies")
+        end = start + 1
+
+        while end < len(passthrough) and not passthrough[end].startswith("--"):
+
+            end += 1
+
+        del passthrough[start:end]
+
+    results = []
+
+    for lobbies in args.lobbies:
+
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), *passthrough, "--scenario", str(lobbies)],
+                                check=True, capture_output=True, text=True, cwd=REPO_DIR).stdout
+
+        result = json.loads(output.strip().splitlines()[-1])
+
+        results.append(result)
+
+        if not args.json:
+
+            print(format_result(result), flush=True)
+
+    if args.json:
+
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,125 @@
+import asyncio
+
+import metrics
+
+# Keeps the lobby channels' names showing the current player count. Discord only allows each channel to be renamed
+# twice every ten minutes, so a rename is only sent when the name would actually change, and only when the channel's
+# rename budget has room for it. When it doesn't, the rename waits until it does, and whatever the count is at that
+# point is what gets shown. Changes are also given a short while to settle first, so a burst of joins at the start of
+# a round doesn't use the whole budget up on numbers that are out of date a second later
+
+RENAMES_SKIPPED = metrics.counter("mgo1_channel_renames_skipped_total",
+                                  "Channel renames not sent, because the name wouldn't change or there was no budget",
+                                  ["reason"])
+
+
+class ChannelNamer:
+    """Renames every channel in "channels" (iterating it gives the channel objects) to "name(count)" whenever the count
+    changes, through the outbound dispatcher's "channel_edit" buckets"""
+
+    def __init__(self, channels, outbound, name, settle=30.0):
+
+        self.channels = channels
+        self.outbound = outbound
+        self.name = name
+        self.settle = settle
+
+        self.count = None
+
+        # ChannelID -> the name the bot last gave it, the channel objects themselves only catch up once Discord sends
+        # the update event
+
+        self._shown = {}
+        self._task = None
+
+        self.renames = 0
+
+    def update(self, count):
+        """Takes in the latest count, the channels get renamed to match once it has settled"""
+
+        self.count = count
+
+        self._schedule(self.settle)
+
+    def _schedule(self, delay):
+
+        if self._task is None or self._task.done():
+
+            self._task = asyncio.ensure_future(self._rename_later(delay))
+
+    async def _rename_later(self, delay):
+
+        await asyncio.sleep(delay)
+
+        retry = None
+
+        for channel in list(self.channels):
+
+            wanted = self.name(self.count)
+
+            if self._shown.get(channel.id, channel.name) == wanted:
+
+                RENAMES_SKIPPED.inc(reason="unchanged")
+
+                continue
+
+            wait = self.outbound.delay(("channel_edit", channel.id))
+
+            if wait > 0:
+
+                # No budget left in this channel, so come back once there is
+
+                RENAMES_SKIPPED.inc(reason="budget")
+
+                retry = wait if retry is None else min(retry, wait)
+
+                continue
+
+            self.renames += 1
+
+            future = self.outbound.submit(lambda channel=channel: self._rename(channel), ("channel_edit", channel.id),
+                                          key=("channel name", channel.id), action="rename")
+
+            future.add_done_callback(lambda future, channel=channel: self._renamed(future, channel))
+
+        if retry is not None:
+
+            self._task = asyncio.ensure_future(self._rename_later(retry))
+
+    async def _rename(self, channel):
+
+        # The count may well have moved on since this was queued, so the name is worked out at the last moment
+
+        wanted = self.name(self.count)
+
+        if self._shown.get(channel.id, channel.name) == wanted:
+
+            return
+
+        await channel.edit(name=wanted)
+
+        self._shown[channel.id] = wanted
+
+    def _renamed(self, future, channel):
+
+        if not future.cancelled() and future.exception() is not None:
+
+            print(f"Couldn't rename the channel in {channel.guild.name}, error:{future.exception()}")
+
+    def channel_updated(self, channel):
+        """Called when Discord says a channel changed, if someone else renamed it, it's put back once the budget
+        allows"""
+
+        shown = self._shown.get(channel.id)
+
+        if shown is not None and shown != channel.name:
+
+            del self._shown[channel.id]
+
+            if self.count is not None:
+
+                self._schedule(self.settle)
+
+    def stats(self):
+
+        return {"count": self.count, "renames": self.renames}
@@ -0,0 +1,72 @@
+# The channels the lobbies get posted to are looked up once when the bot starts and kept here, keyed by the ID of the
+# guild they're in, rather than searching every guild by name for every single message. Since it goes by IDs, a guild
+# being renamed doesn't break anything, and the bot's Discord events keep it up to date when channels change or the bot
+# gets removed from a guild
+
+
+class ChannelRegistry:
+    """Guild ID -> the lobby channel in that guild, for every channel ID the bot is set up to post to"""
+
+    def __init__(self, channel_ids):
+
+        self.channel_ids = set(channel_ids)
+
+        self._channels = {}
+
+    def __len__(self):
+
+        return len(self._channels)
+
+    def __iter__(self):
+
+        return iter(self._channels.values())
+
+    def items(self):
+
+        return self._channels.items()
+
+    def get(self, guild_id):
+
+        return self._channels.get(guild_id)
+
+    def refresh(self, client):
+        """Resolves every configured channel ID to its channel object, anything the bot can't see gets reported and
+        left out"""
+
+        self._channels = {}
+
+        for channel_id in self.channel_ids:
+
+            channel = client.get_channel(channel_id)
+
+            if channel is None:
+
+                print(f"Couldn't find channel {channel_id}, is the bot still in that guild?")
+
+                continue
+
+            self._channels[channel.guild.id] = channel
+
+        print(f"Posting lobbies to {len(self._channels)} channels")
+
+    def update_channel(self, channel):
+
+        if channel.id in self.channel_ids:
+
+            self._channels[channel.guild.id] = channel
+
+    def remove_channel(self, channel):
+
+        if self._channels.get(channel.guild.id) is channel or channel.id in self.channel_ids:
+
+            self._channels.pop(channel.guild.id, None)
+
+    def add_guild(self, guild):
+
+        for channel in guild.channels:
+
+            self.update_channel(channel)
+
+    def remove_guild(self, guild):
+
+        self._channels.pop(guild.id, None)
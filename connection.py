@@ -0,0 +1,104 @@
+import asyncio, random
+
+# Keeps the bot connected to the SaveMGO websocket. Whenever the connection drops (or anything goes wrong while
+# listening), it connects again straight away, backing off exponentially (with some randomness so a SaveMGO outage
+# doesn't have every client reconnecting in lockstep) if it keeps failing. Once a reconnect succeeds, "on_reconnect" is
+# called so whatever was missed while disconnected can be caught up on
+
+
+class ConnectionSupervisor:
+    """Runs "listen" forever, reconnecting with jittered exponential backoff.
+
+    "listen" is a coroutine function that connects, calls the "on_connected" coroutine it is given once the connection
+    is up, then handles messages until the connection ends. "on_reconnect" is a coroutine function called after every
+    successful connection except the first, it can be None if there's nothing to catch up on. "name" is just what the
+    connection is called in the console"""
+
+    def __init__(self, listen, on_reconnect, base_delay=1.0, max_delay=60.0, name="Websocket"):
+
+        self.listen = listen
+        self.on_reconnect = on_reconnect
+        self.name = name
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.connected = False
+        self.connects = 0
+        self.failures = 0
+        self._attempt = 0
+        self._task = None
+
+    def start(self):
+        """Starts the supervisor in the background, calling it again while it's running does nothing"""
+
+        if self._task is None or self._task.done():
+
+            self._task = asyncio.ensure_future(self.run())
+
+        return self._task
+
+    async def stop(self):
+
+        if self._task is not None:
+
+            self._task.cancel()
+
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def backoff(self):
+        """How long to wait before the next attempt, "full jitter", anywhere between nothing and the exponential
+        delay"""
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** self._attempt)))
+
+    async def _on_connected(self):
+
+        self.connected = True
+        self.connects += 1
+        self._attempt = 0
+
+        if self.connects > 1 and self.on_reconnect is not None:
+
+            print(f"{self.name} back up, catching up on anything that was missed")
+
+            try:
+
+                await self.on_reconnect()
+
+            except Exception as e:
+
+                # The connection itself is fine, so carry on listening, the next reconnect will try again
+
+                print(f"Catching up after reconnecting failed, error:{e}")
+
+    async def run(self):
+
+        while True:
+
+            try:
+
+                await self.listen(self._on_connected)
+
+                print(f"{self.name} closed, reconnecting")
+
+            except asyncio.CancelledError:
+
+                raise
+
+            except Exception as e:
+
+                self.failures += 1
+
+                print(f"{self.name} went down, reconnecting, error:{e}")
+
+            self.connected = False
+
+            delay = self.backoff()
+
+            self._attempt += 1
+
+            await asyncio.sleep(delay)
+
+    def stats(self):
+
+        return {"connected": self.connected, "connects": self.connects, "failures": self.failures}
@@ -0,0 +1,71 @@
+# Building an embed for a lobby is only worth doing when the lobby has actually changed, so this keeps the last embed
+# built for every game along with the lobby's version at the time, and only calls "build" again once the version has
+# moved on. It also remembers what was last sent to each channel, so if a render ends up with exactly what's already
+# showing (e.g. a player left and came back within the debounce window), the Discord edit can be skipped entirely
+
+
+class EmbedRenderer:
+    """Memoizes lobby embeds by lobby version and tracks the last payload sent per (GameID, ChannelID)"""
+
+    def __init__(self, build):
+
+        # "build" takes a Lobby and returns a discord.Embed
+
+        self.build = build
+
+        # GameID -> (version, embed, payload) and (GameID, ChannelID) -> payload
+
+        self._built = {}
+        self._sent = {}
+
+        self.builds = 0
+        self.cache_hits = 0
+        self.skipped = 0
+
+    def render(self, lobby):
+        """Returns (embed, payload) for the lobby, the payload being the embed as a plain dictionary for comparing"""
+
+        cached = self._built.get(lobby.game_id)
+
+        if cached is not None and cached[0] == lobby.version:
+
+            self.cache_hits += 1
+
+            return cached[1], cached[2]
+
+        self.builds += 1
+
+        embed = self.build(lobby)
+        payload = embed.to_dict()
+
+        self._built[lobby.game_id] = (lobby.version, embed, payload)
+
+        return embed, payload
+
+    def is_current(self, game_id, channel_id, payload):
+        """True if the payload is exactly what was last sent to the channel for this game, so there's nothing to do"""
+
+        if self._sent.get((game_id, channel_id)) == payload:
+
+            self.skipped += 1
+
+            return True
+
+        return False
+
+    def mark_sent(self, game_id, channel_id, payload):
+
+        self._sent[(game_id, channel_id)] = payload
+
+    def forget(self, game_id):
+        """Drops everything remembered about a game, for when it's been deleted"""
+
+        self._built.pop(game_id, None)
+
+        for key in [key for key in self._sent if key[0] == game_id]:
+
+            del self._sent[key]
+
+    def stats(self):
+
+        return {"builds": self.builds, "cache_hits": self.cache_hits, "skipped_edits": self.skipped}
@@ -0,0 +1,175 @@
+import contextlib, json, time
+
+import metrics
+
+# Websocket messages are handed to the "EventDispatcher", which decodes them, checks they have everything their
+# handler needs and then calls the handler registered for that event name. Messages that are broken or missing fields
+# are dropped (and counted) rather than taking the connection down with them
+
+# orjson is a lot quicker at decoding than the standard library, so it gets used if it's installed, it's not required
+# though
+
+try:
+
+    import orjson
+
+    decode = orjson.loads
+
+    JSON_BACKEND = "orjson"
+
+except ImportError:
+
+    decode = json.loads
+
+    JSON_BACKEND = "json"
+
+# The fields each event's "data" has to have, and what type they need to be, for its handler to be able to do its job
+
+EVENT_SCHEMAS = {
+    "game_created": {"game_id": int, "host": str, "name": str, "rules": list},
+    "game_player_joined": {"game_id": int, "user_id": int},
+    "game_player_left": {"game_id": int, "user_id": int},
+    "game_new_round": {"game_id": int, "map": str, "mode": str},
+    "game_deleted": {"game_id": int},
+}
+
+MESSAGES_DROPPED = metrics.counter("mgo1_websocket_messages_dropped_total",
+                                   "Websocket messages thrown away without being handled", ["reason"])
+HANDLER_LATENCY = metrics.histogram("mgo1_event_handler_seconds", "How long each websocket event's handler took",
+                                    ["event"])
+
+
+class MalformedEvent(Exception):
+    """Raised when a websocket message isn't valid JSON or doesn't match its event's schema"""
+
+
+def validate(event, data, schema):
+
+    if not isinstance(data, dict):
+
+        raise MalformedEvent(f"{event} has no data")
+
+    for field, field_type in schema.items():
+
+        value = data.get(field)
+
+        # bool is a subclass of int, but a True/False GameID is definitely wrong
+
+        if not isinstance(value, field_type) or isinstance(value, bool):
+
+            raise MalformedEvent(f"{event} is missing {field} or it isn't a {field_type.__name__}")
+
+    if event == "game_created" and (not data["rules"] or not isinstance(data["rules"][0], dict)
+                                    or "Map" not in data["rules"][0] or "Mode" not in data["rules"][0]):
+
+        raise MalformedEvent("game_created has no usable rules")
+
+
+class EventDispatcher:
+    """Maps websocket event names to the coroutine functions that handle them.
+
+    "guard" is optional, an "EventGuard" (see "event_guard.py") deciding whether each event gets handled at all, and
+    so is "watch", a function taking the event's name and data and returning a context manager to handle it in (i.e.
+    "LoopWatchdog.watch()")"""
+
+    def __init__(self, schemas=EVENT_SCHEMAS, guard=None, watch=None):
+
+        self.schemas = schemas
+        self.guard = guard
+        self.watch = watch
+        self.handlers = {}
+
+    def handler(self, event):
+        """Decorator registering a coroutine function "handler(data, received_at)" for the event name"""
+
+        def register(function):
+
+            self.handlers[event] = function
+
+            return function
+
+        return register
+
+    def parse(self, message):
+        """Decodes a raw websocket message and checks it, returning (event name, data)"""
+
+        try:
+
+            payload = decode(message)
+
+        except ValueError as e:
+
+            raise MalformedEvent(f"not valid JSON: {e}") from e
+
+        if not isinstance(payload, dict) or not isinstance(payload.get("event"), str):
+
+            raise MalformedEvent("message has no event name")
+
+        event = payload["event"]
+        data = payload.get("data")
+
+        schema = self.schemas.get(event)
+
+        if schema is not None:
+
+            validate(event, data, schema)
+
+        return event, data
+
+    async def dispatch(self, message, received_at=None):
+        """Decodes, checks and handles one websocket message, returns the event name, or None if it was dropped"""
+
+        received_at = received_at if received_at is not None else time.perf_counter()
+
+        try:
+
+            event, data = self.parse(message)
+
+        except MalformedEvent as e:
+
+            MESSAGES_DROPPED.inc(reason="malformed")
+
+            print(f"Dropping a broken websocket message, {e}")
+
+            return None
+
+        handler = self.handlers.get(event)
+
+        if handler is None:
+
+            MESSAGES_DROPPED.inc(reason="unhandled")
+
+            return None
+
+        if self.guard is not None and not self.guard.admit(event, data, received_at):
+
+            return None
+
+        await self._handle(handler, event, data, received_at)
+
+        # Anything that was waiting on this event (i.e. joins that came in before their game was created) goes next
+
+        if self.guard is not None:
+
+            for parked_event, parked_data, parked_at in self.guard.released(event, data):
+
+                await self._handle(self.handlers[parked_event], parked_event, parked_data, parked_at)
+
+        return event
+
+    async def _handle(self, handler, event, data, received_at):
+
+        started = time.perf_counter()
+
+        try:
+
+            # The data is passed as it is, turning it into text for every event would cost more than handling most of
+            # them does, and it's only needed for the odd one that ends up in a report
+
+            with self.watch(event, data) if self.watch is not None else contextlib.nullcontext():
+
+                await handler(data, received_at)
+
+        finally:
+
+            HANDLER_LATENCY.observe(time.perf_counter() - started, event=event)
@@ -0,0 +1,241 @@
+import asyncio, collections, time
+
+import metrics
+
+# Sits between decoding a websocket message and handling it, and deals with the websocket repeating itself or getting
+# things out of order, rather than letting either reach the handlers:
+#
+#   - Duplicates. Each event is about a "subject" (a game, a game's round, or a player in a game) and the last event
+#     seen for every subject is remembered for "window" seconds. An event identical to the last one for its subject
+#     within that time is a repeat and is thrown away. A player joining, leaving and joining again is three different
+#     events in a row for the subject, so none of those are lost
+#
+#   - Events for games the bot doesn't know about. A join, leave or new round can turn up before the game's
+#     "game_created", so they're parked for "park_for" seconds. If the game gets created in that time, they're handled
+#     straight after it, in the order they came in. If not, that one game is fetched from SaveMGO instead, which covers
+#     everything that was parked, rather than fetching every game again
+#
+#   - Events for games that have already been deleted, which are just late and get thrown away
+
+# Which subject each event is about, and the fields that tell two events about the same subject apart
+
+SUBJECTS = {
+    "game_created": ("game", ()),
+    "game_deleted": ("game", ()),
+    "game_new_round": ("round", ("map", "mode")),
+    "game_player_joined": ("player", ()),
+    "game_player_left": ("player", ()),
+}
+
+EVENTS_GUARDED = metrics.counter("mgo1_event_guard_total",
+                                 "Websocket events the event guard threw away, parked, released or fetched for",
+                                 ["action"])
+
+
+def subject_and_fingerprint(event, data):
+    """Returns (subject, fingerprint) for an event the guard knows about, (None, None) for anything else"""
+
+    if event not in SUBJECTS:
+
+        return None, None
+
+    kind, fields = SUBJECTS[event]
+
+    subject = (kind, data["game_id"], data["user_id"] if kind == "player" else None)
+
+    return subject, (event, *(data[field] for field in fields))
+
+
+class EventGuard:
+    """Decides whether each decoded event should be handled now, parked for later or thrown away.
+
+    "known" is what holds the games the bot knows about (anything supporting "in", i.e. "lobby_info"), "refresh" is a
+    coroutine function taking a GameID that fetches that one game and brings the lobbies in line with it, and
+    "schedule" takes a coroutine function taking no arguments and runs it, by default straight away, but it should be
+    something that runs it in turn with the event handlers (i.e. "EventQueue.put_call()")"""
+
+    def __init__(self, known, refresh, schedule=None, window=10.0, park_for=2.0, max_size=10000, max_parked=50):
+
+        self.known = known
+        self.refresh = refresh
+        self.schedule = schedule or (lambda call: asyncio.ensure_future(call()))
+        self.window = window
+        self.park_for = park_for
+        self.max_size = max_size
+        self.max_parked = max_parked
+
+        # subject -> (fingerprint, when it was seen), oldest first, so the oldest can be dropped once it's too big
+
+        self._last_seen = collections.OrderedDict()
+
+        # GameIDs deleted recently, oldest first
+
+        self._deleted = collections.OrderedDict()
+
+        # GameID -> [(event, data, received_at)] waiting on the game to turn up
+
+        self._parked = {}
+
+        # GameIDs with a fetch on the way, anything for them in the meantime is covered by it
+
+        self._refreshing = set()
+
+        self.counts = collections.Counter()
+
+    def _count(self, action, amount=1):
+
+        self.counts[action] += amount
+
+        EVENTS_GUARDED.inc(amount, action=action)
+
+    @staticmethod
+    def _remember(ordered, key, value, max_size):
+
+        ordered[key] = value
+
+        ordered.move_to_end(key)
+
+        if len(ordered) > max_size:
+
+            ordered.popitem(last=False)
+
+    def admit(self, event, data, received_at=None):
+        """Takes in a decoded event, then returns True if it should be handled now, or False if it has been thrown away
+        or parked"""
+
+        subject, fingerprint = subject_and_fingerprint(event, data)
+
+        if subject is None:
+
+            return True
+
+        now = received_at if received_at is not None else time.perf_counter()
+
+        game_id = data["game_id"]
+
+        last = self._last_seen.get(subject)
+
+        if last is not None and last[0] == fingerprint and now - last[1] <= self.window:
+
+            self._count("duplicate")
+
+            return False
+
+        self._remember(self._last_seen, subject, (fingerprint, now), self.max_size)
+
+        # A reconcile could have found the game still up after all, in which case it's not late
+
+        if game_id in self._deleted and game_id not in self.known:
+
+            self._count("late")
+
+            return False
+
+        if event == "game_deleted":
+
+            self._remember(self._deleted, game_id, True, self.max_size)
+
+            # Anything parked for it no longer matters
+
+            parked = self._parked.pop(game_id, ())
+
+            self._count("discarded", len(parked))
+
+            if game_id not in self.known:
+
+                self._count("unknown")
+
+                return False
+
+            return True
+
+        if game_id in self._refreshing:
+
+            self._count("covered")
+
+            return False
+
+        if event == "game_created":
+
+            if game_id in self.known:
+
+                self._count("duplicate")
+
+                return False
+
+            return True
+
+        if game_id in self.known:
+
+            return True
+
+        # Only joins, leaves and new rounds for a game the bot doesn't have yet get this far
+
+        parked = self._parked.get(game_id)
+
+        if parked is None:
+
+            parked = self._parked[game_id] = []
+
+            asyncio.get_running_loop().call_later(self.park_for, self._expire, game_id)
+
+        # The fetch covers everything anyway, so there's no point keeping more than a handful
+
+        if len(parked) < self.max_parked:
+
+            parked.append((event, data, now))
+
+        self._count("parked")
+
+        return False
+
+    def released(self, event, data):
+        """Called once an event has been handled, returns [(event, data, received_at)] parked for its game that can be
+        handled now"""
+
+        if event != "game_created":
+
+            return []
+
+        parked = self._parked.pop(data["game_id"], [])
+
+        self._count("released", len(parked))
+
+        return parked
+
+    def _expire(self, game_id):
+
+        parked = self._parked.pop(game_id, None)
+
+        # Either the game turned up and everything was released, or it was deleted, or a reconcile found it
+
+        if parked is None or game_id in self._deleted:
+
+            return
+
+        if game_id in self.known:
+
+            self._count("discarded", len(parked))
+
+            return
+
+        self._count("refreshed")
+
+        self._refreshing.add(game_id)
+
+        self.schedule(lambda: self._refresh(game_id))
+
+    async def _refresh(self, game_id):
+
+        try:
+
+            await self.refresh(game_id)
+
+        finally:
+
+            self._refreshing.discard(game_id)
+
+    def stats(self):
+
+        return {"waiting": sum(len(parked) for parked in self._parked.values()), "refreshing": len(self._refreshing),
+                **self.counts}
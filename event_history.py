@@ -0,0 +1,337 @@
+import asyncio, contextlib, sqlite3, time
+
+import metrics
+
+# Keeps a history of everything that happens in the lobbies, for looking back at when MGO1 is busiest, which maps and
+# modes get played and how long people stick around in a game. Every event is appended to an SQLite database (in WAL
+# mode, so reading it while the bot writes is fine), along with hourly and daily totals that are kept up to date as
+# events are written, so questions like "players by hour for the last 30 days" are just a read of a few hundred rows.
+#
+# Recording an event only adds it to a list in memory, the list is written out every few seconds in one transaction on
+# a separate thread, so the event handlers never wait on the disk
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    at REAL NOT NULL,
+    event TEXT NOT NULL,
+    game_id INTEGER NOT NULL,
+    user_id INTEGER,
+    map TEXT,
+    mode TEXT,
+    players INTEGER NOT NULL,
+    lobbies INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    user_id INTEGER NOT NULL,
+    game_id INTEGER NOT NULL,
+    joined_at REAL NOT NULL,
+    left_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS activity (
+    period TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    peak_players INTEGER NOT NULL DEFAULT 0,
+    peak_lobbies INTEGER NOT NULL DEFAULT 0,
+    games_created INTEGER NOT NULL DEFAULT 0,
+    joins INTEGER NOT NULL DEFAULT 0,
+    leaves INTEGER NOT NULL DEFAULT 0,
+    rounds INTEGER NOT NULL DEFAULT 0,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    session_seconds REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (period, start)
+);
+
+CREATE TABLE IF NOT EXISTS rounds (
+    period TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    map TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    rounds INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (period, start, map, mode)
+);
+"""
+
+# (name, length in seconds) of each rollup period, every event goes towards the hour and the day (UTC) it happened in
+
+PERIODS = (("hour", 60 * 60), ("day", 24 * 60 * 60))
+
+HISTORY_EVENTS = metrics.counter("mgo1_history_events_total", "Events written to the event history")
+HISTORY_FLUSH_LATENCY = metrics.histogram("mgo1_history_flush_seconds", "How long writing a batch to the history took")
+
+
+def period_start(at, length):
+
+    return int(at // length * length)
+
+
+class EventHistory:
+    """Append-only event log with hourly and daily rollups in an SQLite database at "path".
+
+    Call "record()" from the event handlers, "start()" once the event loop is running and the query methods whenever.
+    The query methods read the database directly, so they're best run in a thread (see "query()")"""
+
+    def __init__(self, path, flush_interval=5.0):
+
+        self.path = path
+        self.flush_interval = flush_interval
+
+        self._pending = []
+        self._task = None
+
+        # (GameID, UserID) -> when they joined, for working out how long they stayed. Only touched by the writer
+
+        self._open_sessions = {}
+
+        self.written = 0
+
+        with self._connect() as connection:
+
+            connection.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """A connection to the database for one transaction, closed again afterwards"""
+
+        connection = sqlite3.connect(self.path)
+
+        try:
+
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+
+            with connection:
+
+                yield connection
+
+        finally:
+
+            connection.close()
+
+    def record(self, event, game_id, players, lobbies, user_id=None, map=None, mode=None):
+        """Takes in an event that has just been applied to the lobbies, along with the number of players in games and
+        lobbies now it has, then queues it to be written"""
+
+        self._pending.append((time.time(), event, game_id, user_id, map, mode, players, lobbies))
+
+    async def flush(self):
+        """Writes everything recorded so far, on a separate thread"""
+
+        if not self._pending:
+
+            return
+
+        batch, self._pending = self._pending, []
+
+        started = time.perf_counter()
+
+        await asyncio.to_thread(self._write, batch)
+
+        HISTORY_FLUSH_LATENCY.observe(time.perf_counter() - started)
+
+    def _write(self, batch):
+
+        # Every total touched by the batch is worked out here first, so each one is a single upsert however many
+        # events went towards it
+
+        activity = {}
+        rounds = {}
+        sessions = []
+
+        def totals(at):
+
+            for period, length in PERIODS:
+
+                key = (period, period_start(at, length))
+
+                yield activity.setdefault(key, {"peak_players": 0, "peak_lobbies": 0, "games_created": 0, "joins": 0,
+                                                "leaves": 0, "rounds": 0, "sessions": 0, "session_seconds": 0.0})
+
+        def close_session(game_id, user_id, at):
+
+            joined_at = self._open_sessions.pop((game_id, user_id), None)
+
+            # Players who were already in a game when the bot started have no join time, so they're left out
+
+            if joined_at is not None:
+
+                sessions.append((user_id, game_id, joined_at, at))
+
+                for total in totals(joined_at):
+
+                    total["sessions"] += 1
+                    total["session_seconds"] += at - joined_at
+
+        for at, event, game_id, user_id, map, mode, players, lobbies in batch:
+
+            for total in totals(at):
+
+                total["peak_players"] = max(total["peak_players"], players)
+                total["peak_lobbies"] = max(total["peak_lobbies"], lobbies)
+
+                if event == "game_created":
+
+                    total["games_created"] += 1
+
+                elif event == "game_player_joined":
+
+                    total["joins"] += 1
+
+                elif event == "game_player_left":
+
+                    total["leaves"] += 1
+
+                # A game being created starts its first round
+
+                if event in ("game_new_round", "game_created") and map is not None:
+
+                    total["rounds"] += 1
+
+            if event in ("game_new_round", "game_created") and map is not None:
+
+                for period, length in PERIODS:
+
+                    key = (period, period_start(at, length), map, mode)
+
+                    rounds[key] = rounds.get(key, 0) + 1
+
+            if event in ("game_created", "game_player_joined") and user_id is not None:
+
+                self._open_sessions.setdefault((game_id, user_id), at)
+
+            elif event == "game_player_left":
+
+                close_session(game_id, user_id, at)
+
+            elif event == "game_deleted":
+
+                for key in [key for key in self._open_sessions if key[0] == game_id]:
+
+                    close_session(game_id, key[1], at)
+
+        with self._connect() as connection:
+
+            connection.executemany("INSERT INTO events (at, event, game_id, user_id, map, mode, players, lobbies) "
+                                   "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+
+            connection.executemany("INSERT INTO sessions (user_id, game_id, joined_at, left_at) VALUES (?, ?, ?, ?)",
+                                   sessions)
+
+            connection.executemany(
+                "INSERT INTO activity (period, start, peak_players, peak_lobbies, games_created, joins, leaves, "
+                "rounds, sessions, session_seconds) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (period, start) DO UPDATE SET "
+                "peak_players = MAX(peak_players, excluded.peak_players), "
+                "peak_lobbies = MAX(peak_lobbies, excluded.peak_lobbies), "
+                "games_created = games_created + excluded.games_created, joins = joins + excluded.joins, "
+                "leaves = leaves + excluded.leaves, rounds = rounds + excluded.rounds, "
+                "sessions = sessions + excluded.sessions, session_seconds = session_seconds + excluded.session_seconds",
+                [(period, start, total["peak_players"], total["peak_lobbies"], total["games_created"], total["joins"],
+                  total["leaves"], total["rounds"], total["sessions"], total["session_seconds"])
+                 for (period, start), total in activity.items()])
+
+            connection.executemany(
+                "INSERT INTO rounds (period, start, map, mode, rounds) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (period, start, map, mode) DO UPDATE SET rounds = rounds + excluded.rounds",
+                [(*key, count) for key, count in rounds.items()])
+
+        self.written += len(batch)
+
+        HISTORY_EVENTS.inc(len(batch))
+
+    async def _flush_forever(self):
+
+        while True:
+
+            await asyncio.sleep(self.flush_interval)
+
+            try:
+
+                await self.flush()
+
+            except sqlite3.Error as e:
+
+                # The batch is lost, but the bot carries on, history is nice to have rather than essential
+
+                print(f"Couldn't write to the event history, error:{e}")
+
+    def start(self):
+        """Starts writing in the background, calling it again while it's running does nothing"""
+
+        if self._task is None or self._task.done():
+
+            self._task = asyncio.ensure_future(self._flush_forever())
+
+        return self._task
+
+    async def stop(self):
+
+        if self._task is not None:
+
+            self._task.cancel()
+
+            await asyncio.gather(self._task, return_exceptions=True)
+
+        await self.flush()
+
+    # Queries, all answered from the rollups
+
+    async def query(self, method, *args, **kwargs):
+        """Runs one of the query methods below on a separate thread, for use from inside the bot"""
+
+        return await asyncio.to_thread(method, *args, **kwargs)
+
+    def activity(self, period="hour", days=30):
+        """Returns a row per hour (or day) over the last "days" days, oldest first, as dictionaries"""
+
+        since = time.time() - days * 24 * 60 * 60
+
+        with self._connect() as connection:
+
+            connection.row_factory = sqlite3.Row
+
+            rows = connection.execute("SELECT * FROM activity WHERE period = ? AND start >= ? ORDER BY start",
+                                      (period, period_start(since, dict(PERIODS)[period]))).fetchall()
+
+        return [dict(row) for row in rows]
+
+    def popular_rounds(self, days=30, limit=10):
+        """Returns the most played (map, mode, rounds) over the last "days" days"""
+
+        since = period_start(time.time() - days * 24 * 60 * 60, dict(PERIODS)["day"])
+
+        with self._connect() as connection:
+
+            return connection.execute("SELECT map, mode, SUM(rounds) AS total FROM rounds "
+                                      "WHERE period = 'day' AND start >= ? GROUP BY map, mode "
+                                      "ORDER BY total DESC LIMIT ?", (since, limit)).fetchall()
+
+    def busiest_hours(self, days=30):
+        """Returns (hour of the day in UTC, average peak players) for every hour of the day over the last "days" days,
+        busiest first"""
+
+        since = time.time() - days * 24 * 60 * 60
+
+        with self._connect() as connection:
+
+            return connection.execute("SELECT (start / 3600) % 24 AS hour, AVG(peak_players) AS players FROM activity "
+                                      "WHERE period = 'hour' AND start >= ? GROUP BY hour ORDER BY players DESC",
+                                      (period_start(since, 3600),)).fetchall()
+
+    def average_session(self, days=30):
+        """Returns how long, in seconds, a player stays in a game on average over the last "days" days"""
+
+        since = period_start(time.time() - days * 24 * 60 * 60, dict(PERIODS)["day"])
+
+        with self._connect() as connection:
+
+            sessions, seconds = connection.execute("SELECT SUM(sessions), SUM(session_seconds) FROM activity "
+                                                   "WHERE period = 'day' AND start >= ?", (since,)).fetchone()
+
+        return seconds / sessions if sessions else None
+
+    def stats(self):
+
+        return {"pending": len(self._pending), "written": self.written, "open_sessions": len(self._open_sessions)}
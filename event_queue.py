@@ -0,0 +1,345 @@
+import asyncio, collections, time
+
+import metrics
+
+# Sits between the websocket and the event handlers. The websocket reader only timestamps each message and drops it in
+# here, never waiting on anything, and a separate consumer task takes them out one at a time and handles them, so a
+# slow Discord call or API lookup never stops the bot reading from the socket (which is how SaveMGO ends up dropping
+# us). The queue is bounded, if handling falls that far behind, "overflow" decides what happens:
+#
+#   "coalesce"  - squash what's queued down per game (repeat rounds, players who joined then left, games that were
+#                 created and deleted again before being handled) and only if that doesn't free up at least half the
+#                 queue, fall back to...
+#   "reconcile" - throw away everything queued and fetch the game list once instead, same as after a reconnect
+
+OVERFLOW_POLICIES = ("coalesce", "reconcile")
+
+# Put in the queue in place of messages to have the consumer run "reconcile" at that point. Coroutine functions can be
+# queued too (see "put_call()"), for anything else that changes the lobbies and so has to take its turn with the
+# handlers
+
+RECONCILE = object()
+
+# The events "coalesce" knows how to squash, anything else is left as it is
+
+COALESCED_EVENTS = ("game_created", "game_player_joined", "game_player_left", "game_new_round", "game_deleted")
+
+QUEUE_OVERFLOWS = metrics.counter("mgo1_event_queue_overflows_total",
+                                  "Times the event queue filled up, by what was done about it", ["action"])
+QUEUE_DISCARDED = metrics.counter("mgo1_event_queue_discarded_total",
+                                  "Queued websocket messages thrown away by coalescing or a reconcile", ["reason"])
+QUEUE_WAIT = metrics.histogram("mgo1_event_queue_wait_seconds",
+                               "Time a websocket message spent queued before being handled")
+
+
+def summarise(message, parse):
+    """Returns (event, GameID, UserID) for a raw message, or None if it can't be parsed"""
+
+    try:
+
+        event, data = parse(message)
+
+    except Exception:
+
+        return None
+
+    if not isinstance(data, dict):
+
+        return event, None, None
+
+    return event, data.get("game_id"), data.get("user_id")
+
+
+def coalesce(items, parse):
+    """Takes in the queued items and a "parse(message) -> (event, data)" function, then returns the items with
+    everything redundant taken out, in the same order. Messages that can't be parsed are dropped here too, the
+    dispatcher would have thrown them away anyway.
+
+    Each message is only ever parsed once, what it's about is kept with it in the queue afterwards, and each item is
+    looked at once here, so coalescing a full queue costs about as much as reading it"""
+
+    kept = []
+
+    # GameID -> indexes in "kept" of everything about that game, and of its last new round, and (GameID, UserID) ->
+    # index of that player's last join or leave. Entries in "kept" that get dropped are set to None
+
+    by_game = {}
+    last_round = {}
+    last_player = {}
+
+    for item in items:
+
+        if not isinstance(item, tuple):
+
+            kept.append(item)
+
+            continue
+
+        summary = item[2] if item[2] is not None else summarise(item[1], parse)
+
+        if summary is None:
+
+            continue
+
+        event, game_id, user_id = summary
+
+        if event not in COALESCED_EVENTS:
+
+            kept.append((item[0], item[1], summary))
+
+            continue
+
+        if event == "game_deleted":
+
+            # Nothing that happened to a game matters once it's gone
+
+            drop = by_game.pop(game_id, [])
+
+        elif event == "game_new_round":
+
+            drop = [last_round[game_id]] if game_id in last_round else []
+
+        elif event in ("game_player_joined", "game_player_left"):
+
+            # Only the last join or leave for a player counts
+
+            drop = [last_player[game_id, user_id]] if (game_id, user_id) in last_player else []
+
+        else:
+
+            drop = []
+
+        created = False
+
+        for index in drop:
+
+            if kept[index] is not None:
+
+                created = created or kept[index][2][0] == "game_created"
+
+                kept[index] = None
+
+        # And if a deleted game was created since the last thing the bot handled, it never has to know it existed
+
+        if created:
+
+            continue
+
+        index = len(kept)
+
+        kept.append((item[0], item[1], summary))
+
+        # A deletion itself is always kept, whatever comes after it
+
+        if event != "game_deleted":
+
+            by_game.setdefault(game_id, []).append(index)
+
+        if event == "game_new_round":
+
+            last_round[game_id] = index
+
+        elif event in ("game_player_joined", "game_player_left"):
+
+            last_player[game_id, user_id] = index
+
+    return [entry for entry in kept if entry is not None]
+
+
+class EventQueue:
+    """A bounded queue of raw websocket messages, with a consumer that passes each to "handle(message, received_at)".
+
+    "reconcile" is a coroutine function run by the consumer whenever a RECONCILE marker comes out of the queue, and
+    "parse" is what "coalesce" uses to work out which game each message is about"""
+
+    def __init__(self, handle, reconcile, parse, max_size=1000, overflow="coalesce"):
+
+        if overflow not in OVERFLOW_POLICIES:
+
+            raise ValueError(f"Unknown event queue overflow policy {overflow}, expected one of {OVERFLOW_POLICIES}")
+
+        self.handle = handle
+        self.reconcile = reconcile
+        self.parse = parse
+        self.max_size = max_size
+        self.overflow = overflow
+
+        self.received = 0
+        self.handled = 0
+        self.failures = 0
+        self.overflows = 0
+        self.busy = False
+
+        self._items = collections.deque()
+        self._ready = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+
+        return len(self._items)
+
+    def put(self, message, received_at=None):
+        """Queues a message, this never waits, if the queue is full the overflow policy makes room"""
+
+        self.received += 1
+
+        if len(self._items) >= self.max_size:
+
+            self._make_room()
+
+        # The last part is what the message is about, only filled in if it ever needs coalescing
+
+        self._items.append((received_at if received_at is not None else time.perf_counter(), message, None))
+        self._ready.set()
+
+    def request_reconcile(self):
+        """Has the consumer reconcile once it has handled everything already queued"""
+
+        if not self._items or self._items[-1] is not RECONCILE:
+
+            self._items.append(RECONCILE)
+
+        self._ready.set()
+
+    def put_call(self, call):
+        """Has the consumer run "call" (a coroutine function taking no arguments) once it has handled everything already
+        queued"""
+
+        self._items.append(call)
+        self._ready.set()
+
+    def _make_room(self):
+
+        self.overflows += 1
+
+        if self.overflow == "coalesce":
+
+            before = len(self._items)
+
+            self._items = collections.deque(coalesce(self._items, self.parse))
+
+            QUEUE_DISCARDED.inc(before - len(self._items), reason="coalesced")
+
+            # Freeing up just a slot or two would only mean coalescing everything again a message or two later, so it
+            # has to have made a real dent in the queue to count
+
+            if len(self._items) <= self.max_size // 2:
+
+                QUEUE_OVERFLOWS.inc(action="coalesced")
+
+                print(f"Event queue full, coalesced {before} queued messages down to {len(self._items)}")
+
+                return
+
+        # Everything queued is about to be covered by the reconcile anyway
+
+        QUEUE_DISCARDED.inc(sum(1 for item in self._items if isinstance(item, tuple)), reason="reconcile")
+        QUEUE_OVERFLOWS.inc(action="reconcile")
+
+        print(f"Event queue full, dropping {len(self._items)} queued messages and reconciling instead")
+
+        # Queued calls are kept though, whatever queued them is waiting on them to run
+
+        self._items = collections.deque(item for item in self._items if callable(item))
+        self._items.append(RECONCILE)
+
+    async def _consume(self):
+
+        while True:
+
+            while not self._items:
+
+                self._ready.clear()
+
+                await self._ready.wait()
+
+            item = self._items.popleft()
+
+            self.busy = True
+
+            try:
+
+                await self._process(item)
+
+            finally:
+
+                self.busy = False
+
+    async def _process(self, item):
+
+        if item is RECONCILE:
+
+            try:
+
+                await self.reconcile()
+
+            except Exception as e:
+
+                # Nothing to do but carry on, the next reconnect or failed event will try again
+
+                print(f"Reconciling lobbies failed, error:{e}")
+
+            return
+
+        if callable(item):
+
+            try:
+
+                await item()
+
+            except asyncio.CancelledError:
+
+                raise
+
+            except Exception as e:
+
+                print(f"A queued call failed, error:{e}")
+
+            return
+
+        try:
+
+            received_at, message, _ = item
+
+            QUEUE_WAIT.observe(time.perf_counter() - received_at)
+
+            await self.handle(message, received_at)
+
+            self.handled += 1
+
+        except asyncio.CancelledError:
+
+            raise
+
+        except Exception as e:
+
+            # Whatever the handler was doing is now only half done, so the lobbies get checked against SaveMGO
+            # rather than trusting them from here on
+
+            self.failures += 1
+
+            print(f"Handling a websocket event failed, reconciling, error:{e}")
+
+            self.request_reconcile()
+
+    def start(self):
+        """Starts the consumer in the background, calling it again while it's running does nothing"""
+
+        if self._task is None or self._task.done():
+
+            self._task = asyncio.ensure_future(self._consume())
+
+        return self._task
+
+    async def stop(self):
+
+        if self._task is not None:
+
+            self._task.cancel()
+
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def stats(self):
+
+        return {"queued": len(self._items), "busy": self.busy, "received": self.received, "handled": self.handled,
+                "failures": self.failures, "overflows": self.overflows}
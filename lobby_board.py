@@ -0,0 +1,127 @@
+# In "board" display mode, rather than one message per lobby, each channel gets a board, a handful of messages that
+# between them show every lobby, one compact embed each. Discord allows at most 10 embeds and 6000 characters across
+# the embeds of a single message, so the lobbies are split into pages that fit, and each page is its own message. A
+# render then costs at most one edit per page that actually changed in each channel, however many lobbies there are
+
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_CHARACTERS_PER_MESSAGE = 6000
+
+
+def paginate(embeds, max_embeds=MAX_EMBEDS_PER_MESSAGE, max_characters=MAX_CHARACTERS_PER_MESSAGE):
+    """Takes in a list of embeds, then splits them into pages (lists of embeds) that each fit in one Discord message,
+    keeping them in the same order"""
+
+    pages = []
+    page = []
+    characters = 0
+
+    for embed in embeds:
+
+        # len() of a discord.Embed is the number of characters Discord counts towards the limit
+
+        size = len(embed)
+
+        if page and (len(page) >= max_embeds or characters + size > max_characters):
+
+            pages.append(page)
+
+            page = []
+            characters = 0
+
+        page.append(embed)
+        characters += size
+
+    if page:
+
+        pages.append(page)
+
+    return pages
+
+
+class LobbyBoard:
+    """Keeps track of the messages making up the board in each channel (ChannelID -> [MessageID per page]) and what
+    each page last showed, so pages that haven't changed aren't edited"""
+
+    def __init__(self):
+
+        self._pages = {}
+        self._sent = {}
+
+        self.skipped = 0
+
+        # Goes up whenever a page's message is added, replaced or forgotten, see "MessageRegistry.changes"
+
+        self.changes = 0
+
+    def __len__(self):
+
+        return sum(len(pages) for pages in self._pages.values())
+
+    def pages(self, channel_id):
+
+        return list(self._pages.get(channel_id, []))
+
+    def set_page(self, channel_id, page, message_id, payload):
+        """Records that page number "page" in the channel is the message "message_id", showing "payload" """
+
+        pages = self._pages.setdefault(channel_id, [])
+
+        if page < len(pages):
+
+            if pages[page] != message_id:
+
+                pages[page] = message_id
+
+                self.changes += 1
+
+        else:
+
+            pages.append(message_id)
+
+            self.changes += 1
+
+        self._sent[(channel_id, page)] = payload
+
+    def is_current(self, channel_id, page, payload):
+
+        if self._sent.get((channel_id, page)) == payload:
+
+            self.skipped += 1
+
+            return True
+
+        return False
+
+    def truncate(self, channel_id, count):
+        """Forgets every page after the first "count" in the channel, returning the MessageIDs of the ones dropped"""
+
+        pages = self._pages.get(channel_id, [])
+
+        dropped = pages[count:]
+
+        del pages[count:]
+
+        if dropped:
+
+            self.changes += 1
+
+        for page in range(count, count + len(dropped)):
+
+            self._sent.pop((channel_id, page), None)
+
+        return dropped
+
+    def to_snapshot(self):
+        """Returns the board as a JSON-friendly list of [ChannelID, [MessageID, ...]]"""
+
+        return [[channel_id, list(pages)] for channel_id, pages in self._pages.items()]
+
+    def load_snapshot(self, snapshot):
+
+        for channel_id, pages in snapshot:
+
+            self._pages[channel_id] = list(pages)
+
+    def stats(self):
+
+        return {"pages": len(self), "skipped_edits": self.skipped}
@@ -0,0 +1,147 @@
+# Lookups over the lobbies for the slash commands, so "which games are on Killhouse A" or "what game is this player in"
+# never has to go through every lobby, let alone ask SaveMGO. Whenever a lobby changes, "update()" is given it and
+# only moves the entries that actually changed (a player joining is one entry added, a new round moves the game from
+# one map and mode to another), and "remove()" takes a deleted game out
+
+
+class LobbyIndex:
+    """Secondary indexes over "lobby_info": map -> GameIDs, mode -> GameIDs, UserID -> GameIDs and lowercased player
+    name -> (UserID, GameID)s.
+
+    Players map to a set of games rather than just the one, since events for different games can arrive in any order
+    and someone can briefly show up in the game they've just joined before the one they've left lets go of them"""
+
+    def __init__(self):
+
+        self.by_map = {}
+        self.by_mode = {}
+        self.by_user = {}
+        self.by_name = {}
+
+        # GameID -> (map, mode, {UserID: lowercased name}) as it was last indexed, to tell what changed
+
+        self._indexed = {}
+
+    def __len__(self):
+
+        return len(self._indexed)
+
+    @staticmethod
+    def _add(index, key, value):
+
+        index.setdefault(key, set()).add(value)
+
+    @staticmethod
+    def _discard(index, key, value):
+
+        values = index.get(key)
+
+        if values is not None:
+
+            values.discard(value)
+
+            if not values:
+
+                del index[key]
+
+    def update(self, lobby):
+        """Brings the indexes in line with the lobby, whether it's new or has changed"""
+
+        game_id = lobby.game_id
+
+        old_map, old_mode, old_players = self._indexed.get(game_id, (None, None, {}))
+
+        players = {player.user_id: (player.name or "").strip().lower() for player in lobby.players.values()}
+
+        if lobby.map != old_map:
+
+            self._discard(self.by_map, old_map, game_id)
+            self._add(self.by_map, lobby.map, game_id)
+
+        if lobby.mode != old_mode:
+
+            self._discard(self.by_mode, old_mode, game_id)
+            self._add(self.by_mode, lobby.mode, game_id)
+
+        for user_id, name in old_players.items():
+
+            if players.get(user_id) != name:
+
+                self._remove_player(game_id, user_id, name)
+
+        for user_id, name in players.items():
+
+            if old_players.get(user_id) != name:
+
+                self._add(self.by_user, user_id, game_id)
+
+                if name:
+
+                    self._add(self.by_name, name, (user_id, game_id))
+
+        self._indexed[game_id] = (lobby.map, lobby.mode, players)
+
+    def _remove_player(self, game_id, user_id, name):
+
+        self._discard(self.by_user, user_id, game_id)
+
+        if name:
+
+            self._discard(self.by_name, name, (user_id, game_id))
+
+    def remove(self, game_id):
+
+        indexed = self._indexed.pop(game_id, None)
+
+        if indexed is None:
+
+            return
+
+        map, mode, players = indexed
+
+        self._discard(self.by_map, map, game_id)
+        self._discard(self.by_mode, mode, game_id)
+
+        for user_id, name in players.items():
+
+            self._remove_player(game_id, user_id, name)
+
+    def rebuild(self, lobby_info):
+        """Indexes every lobby from scratch, for after "lobby_info" has been filled in all at once"""
+
+        self.by_map.clear()
+        self.by_mode.clear()
+        self.by_user.clear()
+        self.by_name.clear()
+        self._indexed.clear()
+
+        for lobby in lobby_info.values():
+
+            self.update(lobby)
+
+    def find_games(self, map=None, mode=None):
+        """GameIDs on the map and in the mode (either can be left out), or None if neither was given"""
+
+        matches = None
+
+        for index, key in ((self.by_map, map), (self.by_mode, mode)):
+
+            if key is not None:
+
+                games = index.get(key, set())
+
+                matches = set(games) if matches is None else matches & games
+
+        return matches
+
+    def find_players(self, name):
+        """(UserID, GameID) of every player in a game whose name matches, exactly (ignoring case) if anyone's does,
+        otherwise anyone whose name contains it"""
+
+        name = name.strip().lower()
+
+        if name in self.by_name:
+
+            return set(self.by_name[name])
+
+        return {match for player_name, matches in self.by_name.items() if name in player_name for match in matches}
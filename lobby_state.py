@@ -0,0 +1,130 @@
+import itertools
+
+# This is how the bot keeps track of every game being hosted, one "Lobby" per game in the "lobby_info" dictionary (by
+# GameID), each holding its players by UserID. Players are stored as just their UserID and name, the Discord markup
+# for them is only made when the embed is built, so when someone leaves they can be taken out by their UserID alone
+# without needing to look their name up again
+
+# Every change to any lobby gets the next number from here as the lobby's version, since the numbers are never reused,
+# a version alone is enough to tell whether an embed built earlier is still accurate, even across lobbies being
+# replaced by a rebuild
+
+_versions = itertools.count(1)
+
+
+def fingerprint(name, description, map, mode, max_players, user_ids):
+    """A hash of everything about a game that SaveMGO's game list has too, so a Lobby and the same game fresh from the
+    API can be compared in one go rather than field by field"""
+
+    return hash((name, description, map, mode, max_players, frozenset(user_ids)))
+
+
+class Player:
+
+    __slots__ = ("user_id", "name")
+
+    def __init__(self, user_id, name):
+
+        self.user_id = user_id
+
+        # None if the name couldn't be found
+
+        self.name = name
+
+    def __repr__(self):
+
+        return f"Player({self.user_id!r}, {self.name!r})"
+
+
+class Lobby:
+
+    __slots__ = ("game_id", "name", "description", "map", "mode", "max_players", "players", "version", "_fingerprint")
+
+    def __init__(self, game_id, name, description, map, mode, max_players, players=()):
+
+        self.game_id = game_id
+        self.name = name
+        self.description = description
+        self.map = map
+        self.mode = mode
+        self.max_players = max_players
+
+        # UserID -> Player, in the order they joined (dictionaries keep insertion order)
+
+        self.players = {player.user_id: player for player in players}
+
+        self.version = next(_versions)
+
+        # (version, fingerprint), so it's only worked out again once the lobby has changed
+
+        self._fingerprint = None
+
+    def __repr__(self):
+
+        return f"Lobby({self.game_id!r}, {self.name!r}, {self.map!r}, {self.mode!r}, {self.player_count} players)"
+
+    @property
+    def player_count(self):
+
+        return len(self.players)
+
+    def fingerprint(self):
+        """See "fingerprint()" above, player names aren't part of it since the game list doesn't have them"""
+
+        if self._fingerprint is None or self._fingerprint[0] != self.version:
+
+            self._fingerprint = (self.version, fingerprint(self.name, self.description, self.map, self.mode,
+                                                           self.max_players, self.players))
+
+        return self._fingerprint[1]
+
+    def touch(self):
+        """Moves the lobby on to a new version, anything that changes a lobby has to call this (the methods below
+        already do)"""
+
+        self.version = next(_versions)
+
+    def add_player(self, player):
+        """Adds the player to the end of the list, if they're somehow already in, their name just gets updated"""
+
+        existing = self.players.get(player.user_id)
+
+        if existing is None or existing.name != player.name:
+
+            self.players[player.user_id] = player
+
+            self.touch()
+
+    def remove_player(self, user_id):
+        """Takes the player out and returns them, or None if they weren't in the lobby"""
+
+        player = self.players.pop(user_id, None)
+
+        if player is not None:
+
+            self.touch()
+
+        return player
+
+    def set_round(self, map, mode):
+
+        if (map, mode) != (self.map, self.mode):
+
+            self.map = map
+            self.mode = mode
+
+            self.touch()
+
+    def to_snapshot(self):
+        """Returns the lobby as a compact JSON-friendly list, for saving to disk"""
+
+        return [self.game_id, self.name, self.description, self.map, self.mode, self.max_players,
+                [[player.user_id, player.name] for player in self.players.values()]]
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+
+        game_id, name, description, map, mode, max_players, players = snapshot
+
+        return cls(game_id, name, description, map, mode, max_players,
+                   [Player(user_id, player_name) for user_id, player_name in players])
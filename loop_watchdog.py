@@ -0,0 +1,315 @@
+import asyncio, collections, contextlib, io, json, os, queue, sys, threading, time, traceback
+
+import metrics
+
+# Works out what is making lobby updates late. The event loop only does one thing at a time, so there are two ways
+# something can hold everything else up:
+#
+#   - Blocking the loop outright (a synchronous HTTP call, a big JSON dump, a long loop over every lobby). The loop
+#     keeps a heartbeat, and a separate thread checks it, if the loop hasn't ticked for "threshold" seconds, the thread
+#     grabs the loop thread's stack at that moment, which is exactly the code doing the blocking
+#
+#   - Awaiting something slow (an API call that takes ages, Discord rate limits) inside a websocket event's handler,
+#     which holds up every event queued behind it. Handlers are run inside "watch()", and one still going after
+#     "slow_handler" seconds has its task's stack taken, showing what it's waiting on
+#
+# Either way, what's found is written to "path" as one JSON object per line, along with the event being handled at the
+# time. Writing happens on the watchdog's thread, so the event loop never waits on the disk for it.
+#
+# "profile()" also samples the loop thread's stack every few milliseconds for a while, and writes how often each stack
+# came up in the "folded" format flame graph tools read (one "outermost;...;innermost count" line per stack)
+
+WATCHDOG_REPORTS = metrics.counter("mgo1_watchdog_reports_total",
+                                   "Times the event loop was blocked or a handler ran slow, by which", ["kind"])
+
+
+def format_frame(frame):
+
+    return f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+
+
+class LoopWatchdog:
+    """Watches the event loop it's started on for stalls and slow handlers, see above"""
+
+    def __init__(self, path="slow_calls.jsonl", threshold=0.25, slow_handler=2.0, interval=0.05, max_reports=100):
+
+        self.path = path
+        self.threshold = threshold
+        self.slow_handler = slow_handler
+        self.interval = interval
+
+        self.reports = collections.deque(maxlen=max_reports)
+        self.counts = collections.Counter()
+        self.profiling = False
+
+        self._loop = None
+        self._loop_thread = None
+        self._last_tick = time.monotonic()
+        self._labels = {}
+        self._writes = queue.SimpleQueue()
+        self._task = None
+        self._thread = None
+
+    def start(self):
+        """Starts the heartbeat and the watching thread, call it from the loop that is to be watched"""
+
+        if self._task is not None:
+
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+
+        self._task = asyncio.ensure_future(self._heartbeat())
+
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+
+        # The thread is a daemon and only ever reads, so it's left to go when the process does
+
+        if self._task is not None:
+
+            self._task.cancel()
+
+            await asyncio.gather(self._task, return_exceptions=True)
+
+            self._task = None
+
+    async def _heartbeat(self):
+
+        while True:
+
+            self._last_tick = time.monotonic()
+
+            await asyncio.sleep(self.interval)
+
+    @staticmethod
+    def _describe(label, data):
+
+        return label if data is None else f"{label} {data}"
+
+    def _current_label(self):
+        """What the loop is working on right now, as far as "watch()" was told"""
+
+        task = asyncio.current_task(self._loop)
+
+        # This runs on the watchdog's thread while the loop's thread adds and removes labels, so it's looked up in one
+        # go rather than checked for first
+
+        label = self._labels.get(task)
+
+        if label is not None:
+
+            return self._describe(*label)
+
+        return None if task is None else task.get_name()
+
+    def _watch(self):
+
+        stall = None
+
+        while True:
+
+            time.sleep(self.interval)
+
+            # If anything here goes wrong, the thread carries on, since if it died nothing would be watching the loop
+
+            try:
+
+                stall = self._check(stall)
+
+            except Exception as e:
+
+                print(f"Event loop watchdog had a problem, error:{e}")
+
+                stall = None
+
+    def _check(self, stall):
+        """One look at the loop, takes in the stall being followed (if there is one) and returns it as it is now"""
+
+        stalled_for = time.monotonic() - self._last_tick
+
+        if stalled_for > self.threshold + self.interval:
+
+            # Only the first look at a stall needs the stack, the loop is stuck in the same place until it ends
+
+            if stall is None:
+
+                frame = sys._current_frames().get(self._loop_thread)
+
+                stall = {"kind": "blocked", "at": time.time(), "label": self._current_label(),
+                         "stack": "".join(traceback.format_stack(frame)) if frame is not None else None}
+
+            stall["seconds"] = round(stalled_for, 3)
+
+        elif stall is not None:
+
+            self._report(stall)
+
+            stall = None
+
+        while True:
+
+            try:
+
+                report = self._writes.get_nowait()
+
+            except queue.Empty:
+
+                break
+
+            self._write(report)
+
+        return stall
+
+    def _report(self, report):
+
+        self.reports.append(report)
+        self.counts[report["kind"]] += 1
+
+        WATCHDOG_REPORTS.inc(kind=report["kind"])
+
+        print(f"Event loop watchdog: {report['kind']} for {report['seconds']}s in {report['label']}")
+
+        if threading.get_ident() == self._loop_thread:
+
+            self._writes.put(report)
+
+        else:
+
+            self._write(report)
+
+    def _write(self, report):
+
+        if not self.path:
+
+            return
+
+        try:
+
+            with open(self.path, "a", encoding="utf-8") as file:
+
+                file.write(json.dumps(report, ensure_ascii=False) + "\n")
+
+        except OSError as e:
+
+            print(f"Couldn't write to {self.path}, error:{e}")
+
+    @contextlib.contextmanager
+    def watch(self, label, data=None):
+        """Runs the body as "label" (i.e. the websocket event being handled), if it's still going after "slow_handler"
+        seconds what it's waiting on gets reported, and if it blocks the loop the stall is put down to it. "data" is
+        added to the label in reports, it's only turned into text if there is one"""
+
+        task = asyncio.current_task()
+        started = time.monotonic()
+
+        report = {}
+
+        def still_going():
+
+            stack = io.StringIO()
+
+            task.print_stack(file=stack)
+
+            report.update(kind="slow", at=time.time(), label=self._describe(label, data), stack=stack.getvalue())
+
+        self._labels[task] = (label, data)
+
+        timer = self._loop.call_later(self.slow_handler, still_going) if self._loop is not None else None
+
+        try:
+
+            yield
+
+        finally:
+
+            self._labels.pop(task, None)
+
+            if timer is not None:
+
+                timer.cancel()
+
+            if report:
+
+                report["seconds"] = round(time.monotonic() - started, 3)
+
+                self._report(report)
+
+    async def profile(self, seconds, path, interval=0.005):
+        """Samples the loop thread's stack every "interval" seconds for "seconds", writes the folded stacks to "path"
+        and returns (number of samples, [(function, share of samples it was the innermost frame in)] for the top 10).
+        The loop sitting in "select" is it waiting with nothing to do"""
+
+        if self.profiling:
+
+            raise RuntimeError("Already profiling")
+
+        self.profiling = True
+
+        # The thread this is called from is the loop's, whether or not the watchdog has been started
+
+        loop_thread = threading.get_ident()
+
+        try:
+
+            stacks = await asyncio.to_thread(self._sample, loop_thread, seconds, interval)
+
+        finally:
+
+            self.profiling = False
+
+        samples = sum(stacks.values())
+
+        # The run loop's own frames are at the bottom of every stack, so what matters is the function actually running
+
+        functions = collections.Counter()
+
+        for stack, count in stacks.items():
+
+            if stack:
+
+                functions[stack[-1]] += count
+
+        def write():
+
+            with open(path, "w", encoding="utf-8") as file:
+
+                for stack, count in stacks.most_common():
+
+                    file.write(f"{';'.join(stack)} {count}\n")
+
+        await asyncio.to_thread(write)
+
+        return samples, [(function, count / samples) for function, count in functions.most_common(10)]
+
+    @staticmethod
+    def _sample(loop_thread, seconds, interval):
+
+        stacks = collections.Counter()
+
+        deadline = time.monotonic() + seconds
+
+        while time.monotonic() < deadline:
+
+            frame = sys._current_frames().get(loop_thread)
+
+            stack = []
+
+            while frame is not None:
+
+                stack.append(format_frame(frame))
+
+                frame = frame.f_back
+
+            stacks[tuple(reversed(stack))] += 1
+
+            time.sleep(interval)
+
+        return stacks
+
+    def stats(self):
+
+        return {"blocked": self.counts["blocked"], "slow": self.counts["slow"], "profiling": self.profiling}
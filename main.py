@@ -1,6 +1,27 @@
+from discord import app_commands
 from discord.ext import commands, tasks
 from dotenv import load_dotenv
-import discord, requests, websockets, json, os
+from savemgo_api import SaveMGOClient, SaveMGOError, DEFAULT_API_URL
+from name_cache import NameCache
+from message_registry import MessageRegistry
+from render_scheduler import RenderScheduler
+from outbound import OutboundDispatcher
+from channel_registry import ChannelRegistry
+from lobby_state import Lobby, Player, fingerprint
+from connection import ConnectionSupervisor
+from snapshot import save_snapshot, load_snapshot
+from embed_renderer import EmbedRenderer
+from event_dispatcher import EventDispatcher
+from event_guard import EventGuard
+from loop_watchdog import LoopWatchdog
+from event_queue import EventQueue
+from lobby_board import LobbyBoard, paginate
+from channel_namer import ChannelNamer
+from state_bus import StateBroker, follow
+from event_history import EventHistory
+from lobby_index import LobbyIndex
+from watchlist import Watchlist, NotificationBatcher
+import discord, websockets, json, os, asyncio, signal, time, metrics
 
 # Loading in the bot token from the .env file, in the future, it may be worth adding the Channel IDs in there too, but
 # not super important in the short term
@@ -9,20 +30,165 @@ load_dotenv()
 
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
 
-CHANNEL_IDS = json.loads(os.environ.get("CHANNEL_IDS"))
+CHANNEL_IDS = json.loads(os.environ.get("CHANNEL_IDS", "{}"))
 
-bot = commands.Bot(command_prefix="&", intents=discord.Intents.all())
+# What this process does, "standalone" is the whole bot in one process. For spreading the Discord side over several
+# processes, one "ingest" process listens to SaveMGO and publishes the lobbies on STATE_BUS_PATH (a Unix socket), and
+# each "presenter" process takes them from there and posts them to the channels in its own CHANNEL_IDS, see
+# "state_bus.py"
 
-player_count = 0
+ROLE = os.environ.get("ROLE", "standalone")
+
+if ROLE not in ("standalone", "ingest", "presenter"):
+
+    raise ValueError(f"ROLE has to be standalone, ingest or presenter, not {ROLE}")
+
+STATE_BUS_PATH = os.environ.get("STATE_BUS_PATH", "mgo1_state.sock")
+
+# Where the lobbies and their messages get saved so a restart can pick up where it left off, and how old (in seconds)
+# that save can be before it's not worth trusting anymore
+
+STATE_SNAPSHOT_PATH = os.environ.get("STATE_SNAPSHOT_PATH", "state_snapshot.json")
+
+STATE_SNAPSHOT_MAX_AGE = int(os.environ.get("STATE_SNAPSHOT_MAX_AGE", 24 * 60 * 60))
+
+# How the lobbies are shown, "messages" gives every lobby its own message in each channel, "board" puts all of them
+# together into one board per channel (split over a few messages if there are too many for one)
+
+DISPLAY_MODE = os.environ.get("DISPLAY_MODE", "messages")
+
+if DISPLAY_MODE not in ("messages", "board"):
+
+    raise ValueError(f"DISPLAY_MODE has to be either messages or board, not {DISPLAY_MODE}")
+
+WEBSOCKET_URL = os.environ.get("SAVEMGO_WS_URL", "wss://api.mgo1.savemgo.com/api/v1/stream/events")
+
+# The one shared SaveMGO API client, every API lookup in the bot goes through this so they all share the same pool of
+# connections rather than each opening their own
+
+api_client = SaveMGOClient(base_url=os.environ.get("SAVEMGO_API_URL", DEFAULT_API_URL))
+
+
+async def fetch_display_name(user_id):
+    """Does the actual API lookup of a player's display name, only ever called by the name cache when it misses"""
+
+    return (await api_client.get_user(user_id)).display_name
+
+
+# Player names are looked up through this cache rather than straight from the API, the TTL (in seconds), size and the
+# file it's saved to between restarts can all be changed in the .env file
+
+name_cache = NameCache(fetch=fetch_display_name,
+                       max_size=int(os.environ.get("NAME_CACHE_SIZE", 5000)),
+                       ttl=int(os.environ.get("NAME_CACHE_TTL", 6 * 60 * 60)),
+                       negative_ttl=int(os.environ.get("NAME_CACHE_NEGATIVE_TTL", 60)),
+                       snapshot_path=os.environ.get("NAME_CACHE_PATH", "name_cache.json"))
+
+name_cache.load()
+
+# Everything the bot measures is served in Prometheus' format on this address, see "metrics.py"
+
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9108))
+
+WEBSOCKET_MESSAGES = metrics.counter("mgo1_websocket_messages_total", "Messages received from the SaveMGO websocket",
+                                     ["event"])
+
+metrics.gauge("mgo1_lobbies", "Lobbies currently being shown", function=lambda: len(lobby_info))
+metrics.gauge("mgo1_players_in_games", "Players currently in a game", function=lambda: player_count)
+metrics.counter("mgo1_name_cache_hits_total", "Player names answered from the cache",
+                function=lambda: name_cache.hits)
+metrics.counter("mgo1_name_cache_misses_total", "Player names that had to be fetched from the API",
+                function=lambda: name_cache.misses)
+metrics.counter("mgo1_name_cache_coalesced_total", "Player name lookups that shared another lookup's API call",
+                function=lambda: name_cache.coalesced)
+metrics.gauge("mgo1_name_cache_hit_ratio", "Share of player name lookups that didn't need their own API call",
+              function=lambda: name_cache.stats()["hit_rate"])
+metrics.gauge("mgo1_name_cache_size", "Player names currently cached", function=lambda: len(name_cache))
+
+# The lobby channels are looked up once "on_ready" and kept in here by guild ID, this is the only way the rest of the
+# bot gets hold of a channel
+
+channel_registry = ChannelRegistry(CHANNEL_IDS.values())
+
+# LOW_MEMORY only asks Discord for what the lobbies actually need. The bot only ever looks at its own lobby channels
+# (the "guilds" intent covers those, and renames to them) and edits its messages by ID, and slash commands come through
+# whatever the intents are, so there's no need to have Discord send every member, presence and message in every guild,
+# or to keep them all. Without it, the bot asks for everything like it always has
+
+LOW_MEMORY = bool(os.environ.get("LOW_MEMORY"))
+
+
+def bot_options():
+    """The intents and cache settings for the bot, depending on LOW_MEMORY"""
 
-# This variable is related to the "subscribe_to_game_events()" method, where it may at some point crash due to
-# connection issues to the websocket, every five minutes, the method "websocket_restarter" will check if it's still true
-# if not, it will bring the bot back to life
+    if not LOW_MEMORY:
 
-websocket_live = True
+        return {"intents": discord.Intents.all()}
+
+    # MESSAGE_CACHE_SIZE is how many messages to keep, nothing reads them so the default is none at all
+
+    return {"intents": discord.Intents(guilds=True),
+            "chunk_guilds_at_startup": False,
+            "member_cache_flags": discord.MemberCacheFlags.none(),
+            "max_messages": int(os.environ.get("MESSAGE_CACHE_SIZE", 0)) or None}
+
+
+# A presenter with a lot of guilds can also run just some of the bot's shards, SHARD_COUNT being how many there are in
+# total and SHARD_IDS (a JSON list) which of them this process runs
+
+if os.environ.get("SHARD_COUNT"):
+
+    bot = commands.AutoShardedBot(command_prefix="&", shard_count=int(os.environ["SHARD_COUNT"]),
+                                  shard_ids=json.loads(os.environ.get("SHARD_IDS", "null")), **bot_options())
+
+else:
+
+    bot = commands.Bot(command_prefix="&", **bot_options())
+
+# The SaveMGO session is closed along with the bot, while the bot's event loop is still around to close it on
+
+close_bot = bot.close
+
+
+async def close():
+
+    await api_client.close()
+
+    await close_bot()
+
+
+bot.close = close
+
+# How many players are in a game right now, kept up to date by the websocket events as they come in rather than by
+# asking the API, see "change_player_count()"
+
+player_count = 0
+
+# GameID -> Lobby, see "lobby_state.py"
 
 lobby_info = {}
 
+# Remembers which message is showing which lobby in which channel, so an event in a game only has to edit that game's
+# message rather than purging the channel and reposting every lobby
+
+lobby_messages = MessageRegistry()
+
+# Which games are on which map and in which mode, and which game each player is in, kept up to date as the lobbies
+# change so the slash commands can answer straight from memory, see "lobby_index.py"
+
+lobby_index = LobbyIndex()
+
+# The messages making up the board in each channel, only used in "board" display mode
+
+lobby_board = LobbyBoard()
+
+# Every call to Discord goes through this, so all the channels get updated at the same time (up to the number set in
+# the .env file at once) while each channel's rate limit is kept track of separately
+
+outbound = OutboundDispatcher(concurrency=int(os.environ.get("OUTBOUND_CONCURRENCY", 8)))
+
 
 def map_photo_generator(map_name):
     """Returns the appropriate photo of the relevant map picture for use in discord embed"""
@@ -76,627 +242,1992 @@ def map_photo_generator(map_name):
         return "https://i.imgur.com/DOsu6dy.jpg"
 
 
-def id_and_name_converter(userid_or_name, id_or_name):
+async def id_and_name_converter(userid_or_name, id_or_name):
     """Takes in either a UserID or Username, then does an API search to find either a UserID if Username was
     provided or a Username if a UserID was provided, then the information is returned"""
 
     if id_or_name == "name":
 
-        user_info = requests.get(url=f"https://api.mgo1.savemgo.com/api/v1/user/{userid_or_name}").json()["data"]
+        # Goes through the name cache, if the lookup failed it comes back as None rather than an empty name, so a
+        # blip on SaveMGO's end isn't mistaken for someone with a blank name, and the next reconcile tries it again
 
-        name = user_info["display_name"]
-
-        return name
+        return await name_cache.get(userid_or_name)
 
     elif id_or_name == "id":
 
-        user_info = requests.get(url=f"https://api.mgo1.savemgo.com/api/v1/user/search/{userid_or_name}").json()
+        user_info = await api_client.search_user(userid_or_name)
 
-        user_id = user_info["data"][0]["id"]
+        return user_info.id
 
-        return user_id
 
+def player_markup(player):
+    """Makes a markup of the player's name that links to the player's profile when clicked on"""
 
-@tasks.loop(minutes=10)
-async def api_player_count():
-    """Every ten minutes, will do an API Search for the current amount of players connected to MGO1, then returns the
-    player count for use in the number used in the Discord channels where the bot posts the lobbies to"""
+    # This was in reference to how MGO1 would accept usernames consisting of only spaces, causing the bot to
+    # freak out and mess up the markup to the user's profile on the site due to having no characters to
+    # display, so it just strips the spaces out of the name and makes sure it isn't 0 characters long
 
-    print("Gathering Player Count")
+    # If the name couldn't be looked up, the UserID is shown instead until a reconcile manages to get it
 
-    global player_count
+    if player.name is None:
 
-    response = requests.get(url="https://api.mgo1.savemgo.com/api/v1/lobby/list")
-    response.raise_for_status()
-    player_count = response.json()["data"][0]["players"]
+        return f"[{player.user_id}](https://mgo1.savemgo.com/users/{player.user_id})"
 
-    print("Updating lobby name")
+    if len(player.name.strip()) == 0:
 
-    for guild_name, channel_id in CHANNEL_IDS.items():
-        guild = discord.utils.get(bot.guilds, name=guild_name)
-        channel = guild.get_channel(channel_id)
+        # In the event that the user has no visible name, instead of marking up their username so while it
+        # looks like just the player name but links to their profile, the bot instead remarks on this,
+        # marks the players userID for moderation purposes and marks it up
 
-        await channel.edit(name=f"🌐mgo1-lobbies【{player_count}】")
+        return f"[(No Username Was Found: {player.user_id})](https://mgo1.savemgo.com/users/{player.user_id})"
 
+    return f"[{player.name}](https://mgo1.savemgo.com/users/{player.user_id})"
 
-@bot.event
-async def on_ready():
-    # Purges all messages from all channels the bot posts to, in order to get rid of outdated lobbies
 
-    for guild_name, channel_id in CHANNEL_IDS.items():
-        guild = discord.utils.get(bot.guilds, name=guild_name)
-        channel = guild.get_channel(channel_id)
+def lobby_embed(lobby):
+    """Builds the Discord embed for a lobby, this shouldn't be called directly, go through "embed_renderer" instead so
+    lobbies that haven't changed aren't built again"""
 
-        await channel.purge(limit=100)
+    # This is my new way of handling the player names on the bot, I used to just allocate the vacant player
+    # spots as "" so the messages would all be the same size, but I decided this was kinda janky, so I've
+    # removed it and replaced it with this method of putting all names in one string with \n so the message will
+    # scale to player size and the jank is cut down on
 
-    print("Start Up Successful")
+    display_player_list = "".join(f"{player_markup(player)}\n" for player in lobby.players.values())
 
-    # Does a quick API search to check if there are currently online lobbies, if the search doesn't return null,
-    # it will retrieve host results and both send lobbies to Discord channels and store the data within the lobby_info
-    # dictionary for future reference
+    embed = discord.Embed(title=lobby.name,
+                          description=lobby.description,
+                          colour=discord.Colour.green(),
+                          url=f"https://mgo1.savemgo.com/games/{lobby.game_id}")
+    embed.add_field(name="Map", value=f"{lobby.map}", inline=True)
+    embed.add_field(name="Mode", value=f"{lobby.mode}", inline=True)
+    embed.add_field(name="", value="", inline=True)
+    embed.add_field(name=f"Players {lobby.player_count}/{lobby.max_players}",
+                    value=f"{display_player_list}", inline=True)
 
-    current_lobbies = requests.get(url="https://api.mgo1.savemgo.com/api/v1/games/list").json()["data"]
+    # Making use of the "map_photo_generator()" method to retrieve a photo of the current game map
 
-    if not current_lobbies:
+    embed.set_image(url=map_photo_generator(lobby.map))
+    embed.set_footer(text="Thank you for playing MGO1!")
 
-        print("No active lobbies")
+    return embed
+
+
+# Only builds an embed again once the lobby has changed, and remembers what every channel is currently showing so edits
+# that wouldn't change anything don't get sent
+
+embed_renderer = EmbedRenderer(build=lobby_embed)
+
+
+def board_embed(lobby):
+    """Builds the much smaller embed a lobby gets on the board, go through "board_renderer" rather than calling this"""
+
+    # Names are left as plain text here rather than linking to profiles, the links take up a lot of the 6000
+    # characters a board message is allowed
+
+    names = [str(player.user_id) if player.name is None
+             else discord.utils.escape_markdown(player.name) if player.name.strip()
+             else f"(No Username Was Found: {player.user_id})" for player in lobby.players.values()]
+
+    display_player_list = ", ".join(names) or "Nobody"
+
+    # A field can only hold 1024 characters, not that a 16 player lobby should ever get near that
+
+    if len(display_player_list) > 1024:
+
+        display_player_list = display_player_list[:1020].rsplit(", ", 1)[0] + ", ..."
+
+    embed = discord.Embed(title=lobby.name,
+                          description=f"{lobby.map} - {lobby.mode}",
+                          colour=discord.Colour.green(),
+                          url=f"https://mgo1.savemgo.com/games/{lobby.game_id}")
+    embed.add_field(name=f"Players {lobby.player_count}/{lobby.max_players}", value=display_player_list, inline=False)
+    embed.set_thumbnail(url=map_photo_generator(lobby.map))
+
+    return embed
+
+
+board_renderer = EmbedRenderer(build=board_embed)
+
+
+async def resolve_player_names(user_ids):
+    """Looks up the names of a whole batch of players at once, each UserID only once however many times it appears,
+    and all at the same time (up to the number set in the .env file) rather than one after another"""
+
+    return await name_cache.get_many(user_ids, concurrency=int(os.environ.get("NAME_LOOKUP_CONCURRENCY", 10)))
+
+
+def game_fingerprint(game):
+    """The same as "Lobby.fingerprint()", for a game from the API (a GameInfo)"""
+
+    return fingerprint(game.name, game.description.capitalize(), game.current_rule.map_string.title(),
+                       game.current_rule.mode_string.title(), game.max_players,
+                       (player.user_id for player in game.players))
+
+
+def lobby_from_game(game, names):
+    """Takes in a game from the API (a GameInfo) and turns it into a Lobby, "names" being UserID -> name for its
+    players, from "resolve_player_names()" """
+
+    # Since only the original hosting event from the websocket contains a player name (that of the host), every
+    # player's name has to be looked up from the API beforehand, this is done for every game at once
+
+    players = [Player(player.user_id, names.get(player.user_id)) for player in game.players]
+
+    return Lobby(game_id=game.id,
+                 name=game.name,
+                 description=game.description.capitalize(),
+                 map=game.current_rule.map_string.title(),
+                 mode=game.current_rule.mode_string.title(),
+                 max_players=game.max_players,
+                 players=players)
+
+
+async def fan_out(action, route="messages", key=None):
+    """Runs "action(channel)" for every lobby channel at the same time through the outbound
+    dispatcher, rather than one channel after another, so the last guild in the list isn't always the last to know.
+
+    "route" is the Discord rate limit bucket the action uses, and "key" names what is being updated, if an update with
+    the same key is still waiting for its turn in a channel, it gets replaced by this newer one"""
+
+    futures = []
+
+    channels = list(channel_registry)
+
+    for channel in channels:
+
+        async def call(channel=channel):
+
+            return await action(channel)
+
+        futures.append(outbound.submit(call, (route, channel.id), key=None if key is None else (key, channel.id),
+                                       action=action.__name__))
+
+    results = await asyncio.gather(*futures, return_exceptions=True)
+
+    # One guild failing shouldn't stop the others, so errors are just printed
+
+    for channel, result in zip(channels, results):
+
+        if isinstance(result, Exception):
+
+            print(f"Discord call to {channel.guild.name} failed, error:{result}")
+
+    return results
+
+
+async def post_lobby(game_id):
+    """Sends a brand new lobby to every channel, then remembers the messages so they can be edited later on"""
+
+    embed, payload = embed_renderer.render(lobby_info[game_id])
+
+    async def send(channel):
+
+        message = await channel.send(embed=embed)
+
+        lobby_messages.set(game_id, channel.id, message.id)
+
+        embed_renderer.mark_sent(game_id, channel.id, payload)
+
+    await fan_out(send, key=("lobby", game_id))
+
+
+async def update_lobby(game_id):
+    """Edits the existing message of a lobby in every channel to match what is in "lobby_info", if the message has gone
+    missing (someone deleted it, or it was never sent), a new one is sent in its place"""
+
+    embed, payload = embed_renderer.render(lobby_info[game_id])
+
+    async def edit(channel):
+
+        message_id = lobby_messages.get(game_id, channel.id)
+
+        if message_id is not None:
+
+            # If the channel is already showing exactly this, there's no point editing it
+
+            if embed_renderer.is_current(game_id, channel.id, payload):
+
+                return
+
+            try:
+
+                await channel.get_partial_message(message_id).edit(embed=embed)
+
+                embed_renderer.mark_sent(game_id, channel.id, payload)
+
+                return
+
+            except discord.NotFound:
+
+                print(f"Message for {game_id} in {channel.guild.name} has disappeared, sending a new one")
+
+        message = await channel.send(embed=embed)
+
+        lobby_messages.set(game_id, channel.id, message.id)
+
+        embed_renderer.mark_sent(game_id, channel.id, payload)
+
+    await fan_out(edit, key=("lobby", game_id))
+
+
+async def remove_lobby(game_id):
+    """Deletes the message of a lobby from every channel"""
+
+    messages = lobby_messages.pop_game(game_id)
+
+    embed_renderer.forget(game_id)
+
+    async def delete(channel):
+
+        message_id = messages.get(channel.id)
+
+        if message_id is None:
+
+            return
+
+        try:
+
+            await channel.get_partial_message(message_id).delete()
+
+        except discord.NotFound:
+
+            # Already gone, which is what we wanted anyway
+
+            pass
+
+    # Shares the key with the sends and edits, so a deletion also cancels any update to the game still waiting to go
+
+    await fan_out(delete, key=("lobby", game_id))
+
+
+BOARD = "board"
+
+
+async def render_board(key=BOARD):
+    """Brings the board in every channel in line with "lobby_info", only editing the pages that have changed, sending
+    new pages if the lobbies no longer fit on the ones there are and deleting pages that aren't needed anymore"""
+
+    lobbies = [board_renderer.render(lobby_info[game_id]) for game_id in sorted(lobby_info)]
+
+    pages = paginate([embed for embed, _ in lobbies]) or [[]]
+
+    # What each page shows as a plain value, for checking whether it's already showing it
+
+    payloads = []
+
+    start = 0
+
+    for number, page in enumerate(pages):
+
+        if lobby_info:
+
+            content = f"**MGO1 Lobbies** - {len(lobby_info)} up, page {number + 1}/{len(pages)}"
+
+        else:
+
+            content = "**MGO1 Lobbies** - No lobbies up right now"
+
+        payloads.append((content, [payload for _, payload in lobbies[start:start + len(page)]]))
+
+        start += len(page)
+
+    async def delete_pages(channel, message_ids):
+
+        for message_id in message_ids:
+
+            try:
+
+                await channel.get_partial_message(message_id).delete()
+
+            except discord.NotFound:
+
+                pass
+
+    async def edit_board(channel):
+
+        message_ids = lobby_board.pages(channel.id)
+
+        for number, (page, payload) in enumerate(zip(pages, payloads)):
+
+            if number < len(message_ids):
+
+                if lobby_board.is_current(channel.id, number, payload):
+
+                    continue
+
+                try:
+
+                    await channel.get_partial_message(message_ids[number]).edit(content=payload[0], embeds=page)
+
+                    lobby_board.set_page(channel.id, number, message_ids[number], payload)
+
+                    continue
+
+                except discord.NotFound:
+
+                    # A new page would end up below the ones after it, so those are cleared out and sent again too
+
+                    print(f"Board page {number + 1} in {channel.guild.name} has disappeared, sending it again")
+
+                    await delete_pages(channel, lobby_board.truncate(channel.id, number))
+
+                    message_ids = message_ids[:number]
+
+            message = await channel.send(content=payload[0], embeds=page)
+
+            lobby_board.set_page(channel.id, number, message.id, payload)
+
+            # The first page gets pinned so it's easy to get back to in a busy channel
+
+            if number == 0:
+
+                try:
+
+                    await message.pin()
+
+                except discord.HTTPException as e:
+
+                    print(f"Couldn't pin the board in {channel.guild.name}, error:{e}")
+
+        await delete_pages(channel, lobby_board.truncate(channel.id, len(pages)))
+
+    await fan_out(edit_board, key=BOARD)
+
+
+async def render_lobby(game_id):
+    """Brings a lobby's messages in line with "lobby_info", whatever happened to it, if the game still exists its
+    messages are edited (or sent, if it's new), if it doesn't they're deleted"""
+
+    if game_id in lobby_info:
+
+        await update_lobby(game_id)
 
     else:
 
-        print("Active lobbies found")
+        await remove_lobby(game_id)
 
-        for game in current_lobbies:
 
-            game_id = game["id"]
+# Websocket events change "lobby_info" straight away, but hand the Discord side of things over to this, which waits
+# for a short window (in seconds, set in the .env file) so a burst of events for one game becomes a single update
 
-            current_match = game["current_round"]
+def state_snapshot():
+    """Everything a presenter needs to start from, sent to each one as it connects"""
 
-            player_cap = game["options"]["max_players"]
-            description = game["options"]["description"].capitalize()
+    return {"lobbies": [lobby.to_snapshot() for lobby in lobby_info.values()], "players": shown_player_count()}
 
-            player_list = []
 
-            for player in game["players"]:
+# Only set up in the "ingest" role, every presenter connected to it is sent the lobbies as they change
 
-                # Since only the original hosting event from the websocket contains a player name (that of the host)
-                # I made this method to search the API with the provided userID to get their name
+state_broker = StateBroker(STATE_BUS_PATH, snapshot=state_snapshot) if ROLE == "ingest" else None
 
-                player_name = id_and_name_converter(player["user_id"], "name")
 
-                # This was in reference to how MGO1 would accept usernames consisting of only spaces, causing the bot to
-                # freak out and mess up the markup to the user's profile on the site due to having no characters to
-                # display, so it just strips the spaces out of the name and makes sure it isn't 0 characters long
+async def publish_lobby(game_id):
+    """Takes the place of "render_lobby()" in the "ingest" role, sending the lobby's current state (or that it's gone)
+    to the presenters rather than to Discord"""
 
-                if len(player_name.strip()) == 0:
+    if game_id in lobby_info:
 
-                    print("Well boss, we seem to have detected a no name person, giving them safe name now")
+        state_broker.publish({"type": "lobby", "lobby": lobby_info[game_id].to_snapshot()})
 
-                    # In the event that the user has no visible name, instead of marking up their username so while it
-                    # looks like just the player name but links to their profile, the bot instead remarks on this,
-                    # marks the players userID for moderation purposes and marks it up, then adds
-                    # it to the "player_list"
+    else:
 
-                    player_name = f"[(No Username Was Found: {player['user_id']})]" \
-                                  f"(https://mgo1.savemgo.com/users/{player['user_id']})"
+        state_broker.publish({"type": "removed", "game_id": game_id})
 
-                    player_list.append(player_name)
 
-                else:
+# The ingest process "renders" by publishing to the presenters, the debounce still helps there since a flurry of events
+# for one game goes out as a single change. In "board" mode every game's events go towards the one render of the
+# whole board, so there's a single edit per page per window however many games changed
 
-                    # Makes a markup of the player's name that links to the player's profile when clicked on
+if ROLE == "ingest":
 
-                    player_name = f"[{player_name}](https://mgo1.savemgo.com/users/{player['user_id']})"
+    render_scheduler = RenderScheduler(render=publish_lobby, window=float(os.environ.get("RENDER_DEBOUNCE", 1.0)))
 
-                    player_list.append(player_name)
+elif DISPLAY_MODE == "board":
 
-            player_number = len(player_list)
+    render_scheduler = RenderScheduler(render=render_board, window=float(os.environ.get("RENDER_DEBOUNCE", 1.0)),
+                                       key=lambda game_id: BOARD)
 
-            # This is my new way of handling the player names on the bot, I used to just allocate the vacant player
-            # spots as "" so the messages would all be the same size, but I decided this was kinda janky, so I've
-            # removed it and replaced it with this method of putting all names in one string with \n so the message will
-            # scale to player size and the jank is cut down on
+else:
 
-            display_player_list = ""
+    render_scheduler = RenderScheduler(render=render_lobby, window=float(os.environ.get("RENDER_DEBOUNCE", 1.0)))
 
-            for player in player_list:
 
-                display_player_list += f"{player}\n"
+# GameID -> when an event last changed it, the background reconcile leaves these games alone for RECONCILE_GRACE
+# seconds, since SaveMGO's game list can be a little behind the websocket and would otherwise undo the change
 
-            # This is the format of saving information relating to a game, it is saved to the global "lobby_info"
-            # dictionary and can be accessed by the using the game id in question the key
+last_event_at = {}
 
-            lobby_info[game_id] = {"name": game["options"]["name"],
-                                   "map": game["options"]["rules"][current_match]["map_string"].title(),
-                                   "mode": game["options"]["rules"][current_match]["mode_string"].title(),
-                                   "players": player_list,
-                                   "max players": player_cap, "description": description, "player count": player_number}
 
-            # This sets up the embeds for publishing the lobbies to the set discord channels in the .env file
+def lobby_changed(game_id, received_at=None):
+    """Has to be called whenever a lobby in "lobby_info" is added, changed or deleted, it updates "lobby_index" and
+    schedules the lobby to be rendered. "received_at" is when the event behind the change arrived, if there was one"""
 
-            embed = discord.Embed(title=lobby_info[game_id]["name"],
-                                  description=lobby_info[game_id]["description"],
-                                  colour=discord.Colour.green(),
-                                  url=f"https://mgo1.savemgo.com/games/{game_id}")
-            embed.add_field(name="Map", value=f"{lobby_info[game_id]['map']}", inline=True)
-            embed.add_field(name="Mode", value=f"{lobby_info[game_id]['mode']}", inline=True)
-            embed.add_field(name="", value="", inline=True)
-            embed.add_field(name=f"Players {lobby_info[game_id]['player count']}/"
-                                 f"{lobby_info[game_id]['max players']}",
-                            value=f"{display_player_list}", inline=True)
+    # Presenters never reconcile, so there's no need to keep track there
 
-            # Making use of the "map_photo_generator()" method to retrieve a photo of the current game map
+    if received_at is not None and ROLE != "presenter":
 
-            embed.set_image(url=map_photo_generator(lobby_info[game_id]['map']))
-            embed.set_footer(text="Thank you for playing MGO1!")
+        last_event_at[game_id] = received_at
 
-            # Sends the message to all lobby channels
+    if game_id in lobby_info:
 
-            for guild_name, channel_id in CHANNEL_IDS.items():
-                guild = discord.utils.get(bot.guilds, name=guild_name)
+        lobby_index.update(lobby_info[game_id])
 
-                channel = guild.get_channel(channel_id)
+    else:
 
-                await channel.send(embed=embed)
+        lobby_index.remove(game_id)
 
-    # Sends the message "Kept you waiting huh?" to show it has successfully completed main start up
+        # The board's embeds (also used by "/lobbies" and "/player") are only ever dropped here, whichever way the game
+        # went, otherwise one would be kept for every game ever shown
 
-    for guild_name, channel_id in CHANNEL_IDS.items():
-        guild = discord.utils.get(bot.guilds, name=guild_name)
+        board_renderer.forget(game_id)
 
-        channel = guild.get_channel(channel_id)
+    render_scheduler.schedule(game_id, received_at)
 
-        await channel.send("Kept you waiting huh?")
 
-    api_player_count.start()
+# The channel names show the player count, but Discord only allows two renames per channel every ten minutes, so
+# "channel_namer" only renames a channel when the number in its name would actually change and there's budget left,
+# after waiting PLAYER_COUNT_SETTLE seconds for the count to stop moving
 
-    bot.loop.create_task(subscribe_to_game_events())
+channel_namer = ChannelNamer(channels=channel_registry, outbound=outbound,
+                             name=lambda count: f"🌐mgo1-lobbies【{count}】",
+                             settle=float(os.environ.get("PLAYER_COUNT_SETTLE", 30)))
 
-    websocket_restarter.start()
 
+def change_player_count(change):
+    """Takes in how much the number of players in games has just gone up (or down) by, then passes the new count on
+    to "channel_namer" """
 
-async def subscribe_to_game_events():
-    """Connects to the MGO1 websocket and listens for 5 events, a game being created, a player joining a game,
-    a player leaving a game, a game moving on to a new round and a game being deleted.
+    global player_count
 
-    This information will then be
-    used to send messages to Discord channels listed in the .env file for near live game updates"""
+    if change:
 
-    global websocket_live
+        player_count += change
 
-    try:
+        show_player_count()
 
-        # This connects to MGO1's websocket sends an initial query to it, requesting to be informed about the events
-        # specified in "initial_query['events']"
 
-        async with websockets.connect("wss://api.mgo1.savemgo.com/api/v1/stream/events") as websocket:
-            initial_query = {
-                "type": "mgo1_bot",
-                "events": ["EventGameCreated", "EventGamePlayerJoined", "EventGameNewRound", "EventGamePlayerLeft",
-                           "EventGameDeleted"]
-            }
-            await websocket.send(json.dumps(initial_query))
+def recount_players():
+    """Counts every player in "lobby_info" from scratch, for after the lobbies have been rebuilt or checked against the
+    API, and says so if the running count had drifted"""
 
-            # After sending initial query to websocket, it will now listen for any messages from the websocket forever
-            # (or until it crashes, whichever comes first lol)
-            async for message in websocket:
-                print("Received message:", message)
-                # Prints a message to the console for future reference
-                data = json.loads(message)
+    global player_count
+
+    counted = sum(lobby.player_count for lobby in lobby_info.values())
+
+    # Nothing to correct the very first time round
+
+    if counted != player_count and channel_namer.count is not None:
 
-                # immediately stores gameID in a variable, due to being needed in every event response
+        print(f"Player count corrected from {player_count} to {counted}")
 
-                game_id = data["data"]["game_id"]
+    player_count = counted
 
-                if data["event"] == "game_created":
-                    if game_id not in lobby_info:
-                        print("New Game Created")
+    show_player_count()
 
-                        # Does a quick API search to gain vital information not provided in the websocket event
-                        # message, such as the game's player limit or the game's description
 
-                        response = requests.get(url=f"https://api.mgo1.savemgo.com/api/v1/games/{game_id}").json()[
-                            "data"]
-                        player_cap = response["options"]["max_players"]
-                        description = response["options"]["description"].capitalize()
+# The number in the channel names is how many players are connected to MGO1's lobby servers, which only SaveMGO's lobby
+# list knows, so that's still asked for every PLAYER_COUNT_INTERVAL minutes. Everyone in a game is connected, so in
+# between, the number shown goes up with "player_count" if that passes it
 
-                        # this is to address that the websocket's message doesn't properly display unicode characters
-                        # therefore we convert it to UTF-8 to get the true name of the user (NOTE: Do NOT try this on
-                        # API searches, since the API is already UTF-8 and the double conversion has adverse affects)
+PLAYER_COUNT_INTERVAL = float(os.environ.get("PLAYER_COUNT_INTERVAL", 10))
 
-                        try:
+connected_players = None
 
-                            host_name = bytes(data["data"]["host"], 'utf-8').decode('unicode_escape')
 
-                        except UnicodeDecodeError:
+def shown_player_count():
 
-                            host_name = data["data"]["host"]
+    return max(player_count, connected_players or 0)
 
-                        if len(host_name.strip()) == 0:
 
-                            print("Well boss, we seem to have detected a unnamed person, giving them safe name now")
+def show_player_count():
 
-                            host_name = f"[(No Username Was Found: {response['user_id']})]" \
-                                        f"(https://mgo1.savemgo.com/users/{response['user_id']})"
+    if state_broker is not None:
 
-                        else:
+        state_broker.publish({"type": "players", "count": shown_player_count()})
 
-                            host_name = data["data"]["host"]
+    else:
 
-                            host_name = f"[{host_name}](https://mgo1.savemgo.com/users/{response['user_id']})"
+        channel_namer.update(shown_player_count())
 
-                        lobby_info[game_id] = {"name": data["data"]["name"],
-                                               "map": data["data"]["rules"][0]["Map"].title(),
-                                               "mode": data["data"]["rules"][0]["Mode"].title(),
-                                               "players": [host_name],
-                                               "max players": player_cap, "description": description, "player count": 1}
 
-                        display_player_list = f"{host_name}\n"
+@tasks.loop(minutes=PLAYER_COUNT_INTERVAL)
+async def connected_player_check():
+    """Every so often, will do an API search for the current amount of players connected to MGO1, for the number used
+    in the Discord channels where the bot posts the lobbies to"""
 
-                        embed = discord.Embed(title=lobby_info[game_id]["name"],
-                                              description=lobby_info[game_id]["description"],
-                                              colour=discord.Colour.green(),
-                                              url=f"https://mgo1.savemgo.com/games/{game_id}")
-                        embed.add_field(name="Map", value=f"{lobby_info[game_id]['map']}", inline=True)
-                        embed.add_field(name="Mode", value=f"{lobby_info[game_id]['mode']}", inline=True)
-                        embed.add_field(name="", value="", inline=True)
-                        embed.add_field(name=f"Players {lobby_info[game_id]['player count']}/"
-                                             f"{lobby_info[game_id]['max players']}",
-                                        value=f"{display_player_list}", inline=True)
-                        embed.set_image(url=map_photo_generator(lobby_info[game_id]['map']))
-                        embed.set_footer(text="Thank you for playing MGO1!")
+    global connected_players
 
-                        for guild_name, channel_id in CHANNEL_IDS.items():
-                            guild = discord.utils.get(bot.guilds, name=guild_name)
-                            channel = guild.get_channel(channel_id)
+    try:
 
-                            await channel.send(embed=embed)
+        lobby_servers = await api_client.list_lobbies()
 
-                    else:
+    except SaveMGOError as e:
 
-                        # Again, more a paranoia measure than an actual risk, but I added this if else because I
-                        # worried that if the websocket's connection to the bot weakens, it could send the event more
-                        # than once, causing issues, so now, if the GameID is already present in the "lobby_info"
-                        # dictionary, it will just ignore it and wait for the next event
+        print(f"Couldn't get the number of players connected, error:{e}")
 
-                        print(f"Oh shit lol, websocket having a stroke because {game_id}, just endure it")
+        return
 
-                elif data["event"] == "game_player_joined":
+    if lobby_servers:
 
-                    print("Player Joined")
+        connected_players = lobby_servers[0].players
 
-                    # Player name is not provided in websocket response, so using the "id_and_name_converter()" method,
-                    # the bot will do a quick API search using the userID to quickly find the associated username and
-                    # do the same verification procedures mentioned above
+        show_player_count()
 
-                    player_id = data["data"]["user_id"]
 
-                    player_name = id_and_name_converter(player_id, "name")
+# The lobbies (and so the player count worked out from them) get checked against SaveMGO's game list every
+# RECONCILE_INTERVAL seconds, in case an event was missed somewhere along the way. It's one API call, and only the games
+# that turn out to be different get looked at any further, so it can run a lot more often than a full rebuild could
 
-                    if len(player_name.strip()) == 0:
+RECONCILE_INTERVAL = float(os.environ.get("RECONCILE_INTERVAL", 30))
+RECONCILE_GRACE = float(os.environ.get("RECONCILE_GRACE", 10))
 
-                        print("Well boss, we seem to have detected a unnamed, giving them safe name now")
+background_reconcile_pending = False
 
-                        player_name = f"[(No Username Was Found: {'player_id'})]" \
-                                      f"(https://mgo1.savemgo.com/users/{player_id})"
 
-                        # Adding name to the list of players
+@tasks.loop(seconds=RECONCILE_INTERVAL)
+async def background_reconcile():
+    """Queues a reconcile to run in turn with the event handlers, unless the last one hasn't got its turn yet"""
 
-                        lobby_info[game_id]["players"].append(player_name)
+    global background_reconcile_pending
 
-                    else:
+    if background_reconcile_pending:
 
-                        player_name = f"[{player_name}](https://mgo1.savemgo.com/users/{player_id})"
+        return
 
-                        lobby_info[game_id]["players"].append(player_name)
+    background_reconcile_pending = True
 
-                    lobby_info[game_id]["player count"] += 1
+    async def reconcile():
 
-                    for guild_name, channel_id in CHANNEL_IDS.items():
-                        guild = discord.utils.get(bot.guilds, name=guild_name)
-                        channel = guild.get_channel(channel_id)
+        global background_reconcile_pending
 
-                        await channel.purge(limit=100)
+        try:
 
-                    # Cycles through every single gameID
+            await reconcile_lobbies(grace=RECONCILE_GRACE)
 
-                    for key in lobby_info.keys():
+        finally:
 
-                        player_list = lobby_info[key]["players"]
+            background_reconcile_pending = False
 
-                        display_player_list = ""
+    event_queue.put_call(reconcile)
 
-                        for player in player_list:
 
-                            display_player_list += f"{player}\n"
+def save_state():
+    """Saves the lobbies, the messages showing them and the name cache to disk, so a restart can carry on from where
+    the bot left off rather than rebuilding everything and looking every player up again"""
 
-                        embed = discord.Embed(title=lobby_info[key]["name"],
-                                              description=lobby_info[key]["description"],
-                                              colour=discord.Colour.green(),
-                                              url=f"https://mgo1.savemgo.com/games/{key}")
-                        embed.add_field(name="Map", value=f"{lobby_info[key]['map']}", inline=True)
-                        embed.add_field(name="Mode", value=f"{lobby_info[key]['mode']}", inline=True)
-                        embed.add_field(name="", value="", inline=True)
-                        embed.add_field(name=f"Players {lobby_info[key]['player count']}/"
-                                             f"{lobby_info[key]['max players']}",
-                                        value=f"{display_player_list}", inline=True)
-                        embed.set_image(url=map_photo_generator(lobby_info[key]['map']))
-                        embed.set_footer(text="Thank you for playing MGO1!")
+    global saved_at, saved_changes
 
-                        for guild_name, channel_id in CHANNEL_IDS.items():
-                            guild = discord.utils.get(bot.guilds, name=guild_name)
-                            channel = guild.get_channel(channel_id)
+    try:
 
-                            await channel.send(embed=embed)
+        save_snapshot(STATE_SNAPSHOT_PATH, lobby_info, lobby_messages, lobby_board, DISPLAY_MODE)
 
-                elif data["event"] == "game_player_left":
+        name_cache.save()
 
-                    print("Player Left")
+    except OSError as e:
 
-                    player_id = data["data"]["user_id"]
+        print(f"Couldn't save the bot's state, error:{e}")
 
-                    player_name = id_and_name_converter(player_id, "name")
+        return
 
-                    if len(player_name.strip()) == 0:
+    saved_at = time.monotonic()
+    saved_changes = (lobby_messages.changes, lobby_board.changes)
 
-                        print("Player who is leaving is one of the unnamed, fixing immediately")
 
-                        player_name = f"[(No Username Was Found: {player_id})]" \
-                                      f"(https://mgo1.savemgo.com/users/{player_id})"
+saved_at = 0.0
+saved_changes = None
 
-                        # Removing player name from player list
 
-                        lobby_info[game_id]["players"].remove(player_name)
+@tasks.loop(seconds=5)
+async def state_saver():
+    """Saves the state every minute, or within a few seconds of a message being posted or deleted, since a message
+    missing from the snapshot would be posted again after a restart with the old one left behind in the channel"""
 
-                    else:
+    if (lobby_messages.changes, lobby_board.changes) != saved_changes or time.monotonic() - saved_at >= 60:
 
-                        player_name = f"[{player_name}](https://mgo1.savemgo.com/users/{player_id})"
+        save_state()
 
-                        lobby_info[game_id]["players"].remove(player_name)
 
-                    lobby_info[game_id]["player count"] -= 1
+def restore_snapshot(snapshot):
+    """Fills "lobby_info" and the message registry back in from a saved snapshot, the embeds are assumed to be showing
+    what was saved, so only lobbies that turn out to have changed since then get edited"""
 
-                    for guild_name, channel_id in CHANNEL_IDS.items():
-                        guild = discord.utils.get(bot.guilds, name=guild_name)
-                        channel = guild.get_channel(channel_id)
+    for lobby_snapshot in snapshot["lobbies"]:
 
-                        await channel.purge(limit=100)
+        lobby = Lobby.from_snapshot(lobby_snapshot)
 
-                    for key in lobby_info.keys():
-                        player_list = lobby_info[key]["players"]
+        lobby_info[lobby.game_id] = lobby
 
-                        display_player_list = ""
+    lobby_messages.load_snapshot(snapshot["messages"])
 
-                        for player in player_list:
+    lobby_board.load_snapshot(snapshot.get("board", []))
 
-                            display_player_list += f"{player}\n"
+    lobby_index.rebuild(lobby_info)
 
-                        embed = discord.Embed(title=lobby_info[key]["name"],
-                                              description=lobby_info[key]["description"],
-                                              colour=discord.Colour.green(),
-                                              url=f"https://mgo1.savemgo.com/games/{key}")
-                        embed.add_field(name="Map", value=f"{lobby_info[key]['map']}", inline=True)
-                        embed.add_field(name="Mode", value=f"{lobby_info[key]['mode']}", inline=True)
-                        embed.add_field(name="", value="", inline=True)
-                        embed.add_field(name=f"Players {lobby_info[key]['player count']}/"
-                                             f"{lobby_info[key]['max players']}",
-                                        value=f"{display_player_list}", inline=True)
-                        embed.set_image(url=map_photo_generator(lobby_info[key]['map']))
-                        embed.set_footer(text="Thank you for playing MGO1!")
+    recount_players()
 
-                        for guild_name, channel_id in CHANNEL_IDS.items():
-                            guild = discord.utils.get(bot.guilds, name=guild_name)
-                            channel = guild.get_channel(channel_id)
+    # What the board pages were showing isn't saved, so the board is rendered once to check it over, which only costs
+    # an edit per page
 
-                            await channel.send(embed=embed)
+    if DISPLAY_MODE == "board" and ROLE != "ingest":
 
-                elif data["event"] == "game_new_round":
+        render_scheduler.schedule(BOARD)
 
-                    print("New Round")
+    for game_id, lobby in lobby_info.items():
 
-                    # Updating game mode and map to the current settings
+        _, payload = embed_renderer.render(lobby)
 
-                    lobby_info[game_id]["map"] = data["data"]["map"].title()
-                    lobby_info[game_id]["mode"] = data["data"]["mode"].title()
+        for channel in channel_registry:
 
-                    for guild_name, channel_id in CHANNEL_IDS.items():
-                        guild = discord.utils.get(bot.guilds, name=guild_name)
-                        channel = guild.get_channel(channel_id)
+            if lobby_messages.get(game_id, channel.id) is not None:
 
-                        await channel.purge(limit=100)
+                embed_renderer.mark_sent(game_id, channel.id, payload)
 
-                    for key in lobby_info.keys():
+    print(f"Restored {len(lobby_info)} lobbies, {len(lobby_messages)} messages and {len(lobby_board)} board pages from "
+          f"the last run")
 
-                        player_list = lobby_info[key]["players"]
 
-                        display_player_list = ""
+async def purge_channel(channel):
 
-                        for player in player_list:
+    await channel.purge(limit=100)
 
-                            display_player_list += f"{player}\n"
 
-                        embed = discord.Embed(title=lobby_info[key]["name"],
-                                              description=lobby_info[key]["description"],
-                                              colour=discord.Colour.green(),
-                                              url=f"https://mgo1.savemgo.com/games/{key}")
-                        embed.add_field(name="Map", value=f"{lobby_info[key]['map']}", inline=True)
-                        embed.add_field(name="Mode", value=f"{lobby_info[key]['mode']}", inline=True)
-                        embed.add_field(name="", value="", inline=True)
-                        embed.add_field(name=f"Players {lobby_info[key]['player count']}/"
-                                             f"{lobby_info[key]['max players']}",
-                                        value=f"{display_player_list}", inline=True)
-                        embed.set_image(url=map_photo_generator(lobby_info[key]['map']))
-                        embed.set_footer(text="Thank you for playing MGO1!")
+# People can ask to be DMed when a player hosts or joins a game, or a lobby starts a round on a map or in a mode they're
+# after, see "watchlist.py". Their DMs are held for WATCHLIST_DELAY seconds so everything in that time goes in one
+# message. This needs the websocket and Discord in the same process, so it's only on in the "standalone" role
 
-                        for guild_name, channel_id in CHANNEL_IDS.items():
-                            guild = discord.utils.get(bot.guilds, name=guild_name)
-                            channel = guild.get_channel(channel_id)
+watchlist = Watchlist(os.environ.get("WATCHLIST_PATH", "watchlist.json")) if ROLE == "standalone" else None
 
-                            await channel.send(embed=embed)
+if watchlist is not None:
 
-                elif data["event"] == "game_deleted":
+    watchlist.load()
 
-                    print("Game Deleted")
 
-                    # Removes all information regarding deleted host
+def send_watchlist_dm(subscriber, lines):
+    """Takes in a Discord UserID and their notifications, then DMs them all in one message through the outbound
+    dispatcher"""
 
-                    del lobby_info[game_id]
+    content = ""
 
-                    for guild_name, channel_id in CHANNEL_IDS.items():
-                        guild = discord.utils.get(bot.guilds, name=guild_name)
-                        channel = guild.get_channel(channel_id)
+    for number, line in enumerate(lines):
 
-                        await channel.purge(limit=100)
+        # A DM can only be 2000 characters long
 
-                    for key in lobby_info.keys():
+        if len(content) + len(line) > 1900:
 
-                        player_list = lobby_info[key]["players"]
+            content += f"...and {len(lines) - number} more"
 
-                        display_player_list = ""
+            break
 
-                        for player in player_list:
+        content += line + "\n"
 
-                            display_player_list += f"{player}\n"
+    async def dm():
 
-                        embed = discord.Embed(title=lobby_info[key]["name"],
-                                              description=lobby_info[key]["description"],
-                                              colour=discord.Colour.green(),
-                                              url=f"https://mgo1.savemgo.com/games/{key}")
-                        embed.add_field(name="Map", value=f"{lobby_info[key]['map']}", inline=True)
-                        embed.add_field(name="Mode", value=f"{lobby_info[key]['mode']}", inline=True)
-                        embed.add_field(name="", value="", inline=True)
-                        embed.add_field(name=f"Players {lobby_info[key]['player count']}/"
-                                             f"{lobby_info[key]['max players']}",
-                                        value=f"{display_player_list}", inline=True)
-                        embed.set_image(url=map_photo_generator(lobby_info[key]['map']))
-                        embed.set_footer(text="Thank you for playing MGO1!")
+        user = bot.get_user(subscriber) or await bot.fetch_user(subscriber)
 
-                        for guild_name, channel_id in CHANNEL_IDS.items():
-                            guild = discord.utils.get(bot.guilds, name=guild_name)
-                            channel = guild.get_channel(channel_id)
+        await user.send(content)
 
-                            await channel.send(embed=embed)
+    def sent(future):
 
-    # If anything goes wrong, the try except will catch it, print out a message about the exception, updates the
-    # "websocket_live" variable to False, so that it can be restarted by the "websocket_restarter" method later on,
-    # while this will catch any exception for stability reasons, the main thing this is designed for is the inevitable
-    # disconnection from the websocket, used to be handled by just restarting the bot every 30 minutes, but this is
-    # preferable if it works
+        if not future.cancelled() and future.exception() is not None:
 
-    except Exception as e:
+            print(f"Couldn't DM watchlist notifications to {subscriber}, error:{future.exception()}")
 
-        print(f"Something went wrong error:{e}")
+    outbound.submit(dm, ("dm", 0), action="watchlist_dm").add_done_callback(sent)
 
-        websocket_live = False
 
+notification_batcher = NotificationBatcher(deliver=send_watchlist_dm,
+                                           window=float(os.environ.get("WATCHLIST_DELAY", 10)))
 
-@tasks.loop(minutes=5)
-async def websocket_restarter():
-    """In the event that the 'subscribe_to_game_events()' method crashes, this method will restart everything"""
-    global websocket_live, lobby_info
 
-    if not websocket_live:
+def notify_watchers(lobby, kind, key, line):
+    """Queues "line" for everyone watching (kind, key) who hasn't already heard about it in this lobby"""
 
-        # Reset lobby info back to nothing to prevent dead hosts from showing up
+    if watchlist is None:
 
-        lobby_info = {}
+        return
 
-        for guild_name, channel_id in CHANNEL_IDS.items():
-            guild = discord.utils.get(bot.guilds, name=guild_name)
+    for subscriber in watchlist.match(lobby.game_id, kind, key):
 
-            channel = guild.get_channel(channel_id)
+        notification_batcher.add(subscriber, line)
 
-            await channel.purge(limit=100)
 
-        current_lobbies = requests.get(url="https://api.mgo1.savemgo.com/api/v1/games/list").json()["data"]
+def lobby_link(lobby):
 
-        if not current_lobbies:
+    return f"[{discord.utils.escape_markdown(lobby.name)}](https://mgo1.savemgo.com/games/{lobby.game_id})"
 
-            print("No active lobbies")
 
-        else:
+def notify_round(lobby):
+    """Lets anyone watching the lobby's map or mode know it's started a round on it"""
+
+    notify_watchers(lobby, "map", lobby.map, f"{lobby_link(lobby)} is playing **{lobby.map}** ({lobby.mode})")
+    notify_watchers(lobby, "mode", lobby.mode, f"{lobby_link(lobby)} is playing **{lobby.mode}** on {lobby.map}")
+
+
+# The slash commands only ever look at "lobby_info" and "lobby_index", never the SaveMGO API, so it doesn't matter how
+# many guilds are using them at once. The results use the same compact embeds as the board, as many as fit in one
+# message, and only the person who used the command sees them
+
+
+def match_key(index, value):
+    """Finds the key in "index" that "value" is, ignoring case, so "killhouse a" still finds "Killhouse A" """
+
+    if value is None:
+
+        return None
+
+    value = value.strip().lower()
+
+    return next((key for key in index if key.lower() == value), value)
+
 
-            print("Active lobbies found")
+def autocomplete_from(index):
+    """Makes an autocomplete for a slash command option that suggests the keys of "index" (maps or modes being played
+    right now)"""
 
-            for game in current_lobbies:
+    async def autocomplete(interaction, current):
 
-                game_id = game["id"]
+        return [app_commands.Choice(name=key, value=key) for key in sorted(index)
+                if current.lower() in key.lower()][:25]
 
-                current_match = game["current_round"]
+    return autocomplete
 
-                player_cap = game["options"]["max_players"]
-                description = game["options"]["description"].capitalize()
 
-                player_list = []
+async def send_lobbies(interaction, lobbies, content):
 
-                for player in game["players"]:
+    if not lobbies:
 
-                    player_name = id_and_name_converter(player["user_id"], "name")
+        await interaction.response.send_message(content, ephemeral=True)
 
-                    if len(player_name.strip()) == 0:
+        return
 
-                        print("Well boss, we seem to have detected a no name person, giving them safe name now")
+    page = paginate([board_renderer.render(lobby)[0] for lobby in lobbies])[0]
 
-                        player_name = f"[(No Username Was Found: {player['user_id']})](https://mgo1.savemgo.com/users/{player['user_id']})"
+    if len(page) < len(lobbies):
 
-                        player_list.append(player_name)
+        content += f" (showing the first {len(page)})"
 
-                    else:
+    await interaction.response.send_message(content, embeds=page, ephemeral=True)
 
-                        player_name = f"[{player_name}](https://mgo1.savemgo.com/users/{player['user_id']})"
 
-                        player_list.append(player_name)
+@bot.tree.command(name="lobbies", description="Shows the MGO1 lobbies up right now, or just the ones you're after")
+@app_commands.rename(map_name="map", mode_name="mode")
+@app_commands.describe(map_name="Only lobbies on this map", mode_name="Only lobbies playing this mode",
+                       free_slots="Only lobbies with room for more players", player="Only the lobby this player is in")
+@app_commands.autocomplete(map_name=autocomplete_from(lobby_index.by_map),
+                           mode_name=autocomplete_from(lobby_index.by_mode))
+async def lobbies_command(interaction, map_name: str = None, mode_name: str = None, free_slots: bool = False,
+                          player: str = None):
 
-                player_number = len(player_list)
+    game_ids = lobby_index.find_games(map=match_key(lobby_index.by_map, map_name),
+                                      mode=match_key(lobby_index.by_mode, mode_name))
 
-                display_player_list = ""
+    if game_ids is None:
 
-                for player in player_list:
+        game_ids = set(lobby_info)
 
-                    display_player_list += f"{player}\n"
+    if player:
 
-                lobby_info[game_id] = {"name": game["options"]["name"],
-                                       "map": game["options"]["rules"][current_match]["map_string"].title(),
-                                       "mode": game["options"]["rules"][current_match]["mode_string"].title(),
-                                       "players": player_list,
-                                       "max players": player_cap, "description": description,
-                                       "player count": player_number}
+        game_ids &= {game_id for _, game_id in lobby_index.find_players(player)}
 
-                embed = discord.Embed(title=lobby_info[game_id]["name"],
-                                      description=lobby_info[game_id]["description"],
-                                      colour=discord.Colour.green(),
-                                      url=f"https://mgo1.savemgo.com/games/{game_id}")
-                embed.add_field(name="Map", value=f"{lobby_info[game_id]['map']}", inline=True)
-                embed.add_field(name="Mode", value=f"{lobby_info[game_id]['mode']}", inline=True)
-                embed.add_field(name="", value="", inline=True)
-                embed.add_field(name=f"Players {lobby_info[game_id]['player count']}/"
-                                     f"{lobby_info[game_id]['max players']}",
-                                value=f"{display_player_list}", inline=True)
-                embed.set_image(url=map_photo_generator(lobby_info[game_id]['map']))
-                embed.set_footer(text="Thank you for playing MGO1!")
+    lobbies = [lobby_info[game_id] for game_id in sorted(game_ids) if game_id in lobby_info]
 
-                for guild_name, channel_id in CHANNEL_IDS.items():
-                    guild = discord.utils.get(bot.guilds, name=guild_name)
+    if free_slots:
 
-                    channel = guild.get_channel(channel_id)
+        lobbies = [lobby for lobby in lobbies if lobby.player_count < lobby.max_players]
 
-                    await channel.send(embed=embed)
+    await send_lobbies(interaction, lobbies, f"{len(lobbies)} lobbies found" if lobbies else "No lobbies found")
 
-            for guild_name, channel_id in CHANNEL_IDS.items():
-                guild = discord.utils.get(bot.guilds, name=guild_name)
 
-                channel = guild.get_channel(channel_id)
+@bot.tree.command(name="player", description="Finds which MGO1 lobby a player is in")
+@app_commands.describe(name="The player's name, or part of it")
+async def player_command(interaction, name: str):
 
-                await channel.send("Loyalty to the end!")
+    found = [(lobby_info[game_id], user_id) for user_id, game_id in lobby_index.find_players(name)
+             if game_id in lobby_info]
 
-            bot.loop.create_task(subscribe_to_game_events())
+    if not found:
 
-            websocket_live = True
+        await interaction.response.send_message(f"Nobody called {discord.utils.escape_markdown(name)} is in a game "
+                                                f"right now", ephemeral=True)
 
-            print("Websocket down, reconnecting")
+        return
+
+    found.sort(key=lambda match: match[0].game_id)
+
+    content = "\n".join(f"{player_markup(lobby.players[user_id])} is in **{discord.utils.escape_markdown(lobby.name)}**"
+                         for lobby, user_id in found[:10])
+
+    lobbies = list({lobby.game_id: lobby for lobby, _ in found}.values())
+
+    await send_lobbies(interaction, lobbies, content)
+
+
+# "/watch ..." for managing watchlist subscriptions, only added to the bot when the watchlist is on
+
+watch_commands = app_commands.Group(name="watch", description="Get a DM when a player or a map or mode is in a game")
+
+
+async def add_watch(interaction, kind, key, label):
+
+    if watchlist.add(interaction.user.id, kind, key, label):
+
+        await interaction.response.send_message(f"Watching {label}, you'll get a DM when it comes up", ephemeral=True)
 
     else:
 
-        print("Everything is ok")
+        await interaction.response.send_message(f"You're already watching {label}", ephemeral=True)
+
+
+@watch_commands.command(name="player", description="Get a DM when this player hosts or joins a game")
+@app_commands.describe(name="The player's name")
+async def watch_player_command(interaction, name: str):
+
+    # Someone in a game right now can be found without asking SaveMGO, anyone else has to be searched for
+
+    in_game = lobby_index.by_name.get(name.strip().lower())
+
+    if in_game:
+
+        user_id = next(iter(in_game))[0]
+
+    else:
+
+        try:
+
+            user_id = await id_and_name_converter(name, "id")
+
+        except SaveMGOError:
+
+            await interaction.response.send_message(f"Couldn't find a player called "
+                                                    f"{discord.utils.escape_markdown(name)}", ephemeral=True)
+
+            return
+
+    await add_watch(interaction, "player", user_id, f"player {discord.utils.escape_markdown(name)}")
+
+
+@watch_commands.command(name="map", description="Get a DM when a lobby starts a round on this map")
+@app_commands.rename(map_name="map")
+@app_commands.autocomplete(map_name=autocomplete_from(lobby_index.by_map))
+async def watch_map_command(interaction, map_name: str):
+
+    await add_watch(interaction, "map", map_name, f"map {discord.utils.escape_markdown(map_name.strip().title())}")
+
+
+@watch_commands.command(name="mode", description="Get a DM when a lobby starts a round in this mode")
+@app_commands.rename(mode_name="mode")
+@app_commands.autocomplete(mode_name=autocomplete_from(lobby_index.by_mode))
+async def watch_mode_command(interaction, mode_name: str):
+
+    await add_watch(interaction, "mode", mode_name, f"mode {discord.utils.escape_markdown(mode_name.strip().title())}")
+
+
+@watch_commands.command(name="list", description="Shows everything you're watching")
+async def watch_list_command(interaction):
+
+    subscriptions = watchlist.subscriptions(interaction.user.id)
+
+    if not subscriptions:
+
+        await interaction.response.send_message("You're not watching anything", ephemeral=True)
+
+        return
+
+    await interaction.response.send_message("You're watching:\n" + "\n".join(label for _, _, label in subscriptions),
+                                            ephemeral=True)
+
+
+async def autocomplete_subscriptions(interaction, current):
+
+    return [app_commands.Choice(name=label[:100], value=f"{kind}:{key}")
+            for kind, key, label in watchlist.subscriptions(interaction.user.id)
+            if current.lower() in label.lower()][:25]
+
+
+@watch_commands.command(name="stop", description="Stop watching something")
+@app_commands.describe(subscription="What to stop watching")
+@app_commands.autocomplete(subscription=autocomplete_subscriptions)
+async def watch_stop_command(interaction, subscription: str):
+
+    kind, _, key = subscription.partition(":")
+
+    if kind == "player" and key.isdigit():
+
+        key = int(key)
+
+    if kind in ("player", "map", "mode") and watchlist.remove(interaction.user.id, kind, key):
+
+        await interaction.response.send_message("Stopped watching that", ephemeral=True)
+
+    else:
+
+        await interaction.response.send_message("You weren't watching that, pick one from the list", ephemeral=True)
+
+
+if watchlist is not None:
+
+    bot.tree.add_command(watch_commands)
+
+
+# "/profile" samples what the event loop is doing for a while and saves it to a file in PROFILE_DIR, for finding out
+# where the time goes when lobby updates are running late. The stacks include file paths from the server, so only the
+# bot's owner (whoever owns the application on Discord) gets to run it, and only the newest PROFILE_KEEP files are kept
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 10))
+
+
+def prune_profiles():
+    """Deletes all but the newest PROFILE_KEEP profiles in PROFILE_DIR"""
+
+    paths = sorted(os.path.join(PROFILE_DIR, file_name) for file_name in os.listdir(PROFILE_DIR)
+                   if file_name.startswith("profile-") and file_name.endswith(".folded"))
+
+    # The timestamp in the name sorts them oldest first
+
+    for path in paths[:max(0, len(paths) - PROFILE_KEEP)]:
+
+        try:
+
+            os.remove(path)
+
+        except OSError as e:
+
+            print(f"Couldn't delete old profile {path}, error:{e}")
+
+
+@bot.tree.command(name="profile", description="Profile what the bot is doing for a number of seconds")
+@app_commands.describe(seconds="How long to profile for")
+@app_commands.default_permissions(administrator=True)
+@app_commands.guild_only()
+async def profile_command(interaction, seconds: app_commands.Range[int, 1, 300] = 30):
+
+    # Server admins can see the command, but that's any admin of any server the bot is in, so it's checked here too
+
+    if not await bot.is_owner(interaction.user):
+
+        await interaction.response.send_message("Only the bot's owner can do that", ephemeral=True)
+
+        return
+
+    if loop_watchdog.profiling:
+
+        await interaction.response.send_message("Already profiling, try again once that's done", ephemeral=True)
+
+        return
+
+    await interaction.response.defer(ephemeral=True, thinking=True)
+
+    try:
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+
+        path = os.path.join(PROFILE_DIR, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+
+        samples, top = await loop_watchdog.profile(seconds, path)
+
+        prune_profiles()
+
+        print(f"Profiled for {seconds}s, {samples} samples written to {path}")
+
+        lines = [f"`{share:6.1%}` {discord.utils.escape_markdown(function)}" for function, share in top]
+
+        await interaction.followup.send(f"{samples} samples over {seconds}s, saved to `{path}`. Most time spent in:\n"
+                                        + "\n".join(lines), file=discord.File(path), ephemeral=True)
+
+    except Exception as e:
+
+        # Otherwise the reply would be stuck on "thinking..." for good
+
+        print(f"Profiling failed, error:{e}")
+
+        await interaction.followup.send(f"Profiling failed, error:{e}", ephemeral=True)
+
+
+# The slash commands only need sending to Discord once per run, not every time "on_ready" happens
+
+commands_synced = False
+
+
+async def sync_commands():
+
+    global commands_synced
+
+    if commands_synced:
+
+        return
+
+    try:
+
+        await bot.tree.sync()
+
+        commands_synced = True
+
+    except discord.HTTPException as e:
+
+        print(f"Couldn't register the slash commands, error:{e}")
+
+
+@bot.event
+async def on_guild_channel_update(before, after):
+
+    channel_registry.update_channel(after)
+
+    channel_namer.channel_updated(after)
+
+
+@bot.event
+async def on_guild_channel_delete(channel):
+
+    channel_registry.remove_channel(channel)
+
+
+@bot.event
+async def on_guild_join(guild):
+
+    channel_registry.add_guild(guild)
+
+
+@bot.event
+async def on_guild_remove(guild):
+
+    channel_registry.remove_guild(guild)
+
+
+# discord.py runs "on_ready" again whenever it has to start its session over, by then the lobbies in memory are newer
+# than anything on disk and everything below is already running, so the second time round only the channels get looked
+# up again
+
+started_up = False
+
+
+@bot.event
+async def on_ready():
+
+    global started_up
+
+    # Finds every lobby channel once, from here on out they're reached through "channel_registry" rather than searching
+    # through every guild for each message
+
+    channel_registry.refresh(bot)
+
+    if started_up:
+
+        print("Reconnected to Discord, lobby channels looked up again")
+
+        return
+
+    started_up = True
+
+    # If the last run left a snapshot behind, the messages it posted are still up, so rather than starting from scratch
+    # the bot loads it back in and checks it against the one games/list call in "reconcile_lobbies()", which only
+    # edits, sends or deletes whatever changed while it was down
+
+    snapshot = load_snapshot(STATE_SNAPSHOT_PATH, STATE_SNAPSHOT_MAX_AGE)
+
+    # Messages posted in the other display mode can't be carried on from, so the channels get started over
+
+    if snapshot is not None and snapshot.get("display_mode", "messages") != DISPLAY_MODE:
+
+        print("State snapshot was saved in a different display mode, starting from scratch")
+
+        snapshot = None
+
+    if ROLE == "presenter":
+
+        # The lobbies themselves come from the ingest process as soon as "state_follower" connects, so all that's
+        # needed here is to pick the old messages back up, or clear the channels out if there's nothing to pick up
+
+        if snapshot is not None:
+
+            restore_snapshot(snapshot)
+
+        else:
+
+            await fan_out(purge_channel)
+
+        print("Start Up Successful, waiting on the ingest process for lobbies")
+
+        state_follower.start()
+
+    else:
+
+        # If SaveMGO is down right now, everything below is started anyway rather than leaving the bot doing nothing
+        # until it's restarted, the background reconcile fills the lobbies in once SaveMGO is back
+
+        try:
+
+            if snapshot is not None:
+
+                restore_snapshot(snapshot)
+
+                await reconcile_lobbies(record=False)
+
+                print("Start Up Successful, carried on from the last run")
+
+            else:
+
+                await cold_start()
+
+        except SaveMGOError as e:
+
+            print(f"Couldn't get the lobbies from SaveMGO, carrying on and catching up once it's back, error:{e}")
+
+        background_reconcile.start()
+
+        connected_player_check.start()
+
+        if event_history is not None:
+
+            event_history.start()
+
+        event_queue.start()
+
+        websocket_supervisor.start()
+
+    state_saver.start()
+
+    health_check.start()
+
+    await sync_commands()
+
+    await start_monitoring()
+
+
+metrics_server = None
+
+
+async def start_monitoring():
+    """Starts the metrics endpoint and the event loop lag monitor, only the first time "on_ready" runs"""
+
+    global metrics_server
+
+    if metrics_server is not None:
+
+        return
+
+    metrics_server = await metrics.start_http_server(METRICS_HOST, METRICS_PORT)
+
+    asyncio.ensure_future(metrics.monitor_loop_lag())
+
+    loop_watchdog.start()
+
+
+async def cold_start():
+    """Starts the lobby channels from scratch, used when there's no usable snapshot from a previous run"""
+
+    # Purges all messages from all channels the bot posts to, in order to get rid of outdated lobbies
+
+    await fan_out(purge_channel)
+
+    print("Start Up Successful")
+
+    # Does a quick API search to check if there are currently online lobbies, if the search doesn't return null,
+    # it will retrieve host results and both send lobbies to Discord channels and store the data within the lobby_info
+    # dictionary for future reference
+
+    current_lobbies = await api_client.list_games()
+
+    if not current_lobbies:
+
+        print("No active lobbies")
+
+    else:
+
+        print("Active lobbies found")
+
+        # Every player's name across every lobby is looked up in one go before anything gets posted
+
+        names = await resolve_player_names(player.user_id for game in current_lobbies for player in game.players)
+
+        for game in current_lobbies:
+
+            # This is the format of saving information relating to a game, it is saved to the global "lobby_info"
+            # dictionary and can be accessed by the using the game id in question the key
+
+            lobby_info[game.id] = lobby_from_game(game, names)
+
+            # Sends the lobby to all lobby channels set in the .env file (on the board, they all go up at once below)
+
+            if DISPLAY_MODE == "messages":
+
+                await post_lobby(game.id)
+
+    if DISPLAY_MODE == "board":
+
+        await render_board()
+
+    lobby_index.rebuild(lobby_info)
+
+    recount_players()
+
+    # Sends the message "Kept you waiting huh?" to show it has successfully completed main start up
+
+    async def announce(channel):
+
+        await channel.send("Kept you waiting huh?")
+
+    await fan_out(announce)
+
+
+# Everything the handlers below do to the lobbies is also kept in an SQLite database at HISTORY_PATH, along with
+# hourly and daily totals, see "event_history.py". Setting HISTORY_PATH to nothing turns this off
+
+HISTORY_PATH = os.environ.get("HISTORY_PATH", "event_history.sqlite3")
+
+event_history = EventHistory(HISTORY_PATH, flush_interval=float(os.environ.get("HISTORY_FLUSH_INTERVAL", 5))) \
+    if HISTORY_PATH and ROLE != "presenter" else None
+
+
+def record_event(event, game_id, **details):
+    """Adds an event that has just been handled to the history, along with how many players and lobbies there are
+    now that it has been"""
+
+    if event_history is not None:
+
+        event_history.record(event, game_id, players=player_count, lobbies=len(lobby_info), **details)
+
+
+# Every websocket event has its own handler below, registered against the event's name, "event_dispatcher" decodes each
+# message, makes sure it has the fields its handler needs and passes it on. Every handler takes the event's "data" and
+# when the message arrived (so the delay until it reaches Discord can be measured)
+
+# "event_guard" throws away events the websocket repeats and holds on to ones for games the bot doesn't have yet, either
+# until the game's "game_created" turns up or, failing that, while "refresh_game()" fetches just that game. The fetch
+# takes its turn in "event_queue" like any other event
+
+event_guard = EventGuard(known=lobby_info, refresh=lambda game_id: refresh_game(game_id),
+                         schedule=lambda call: event_queue.put_call(call),
+                         window=float(os.environ.get("EVENT_DEDUP_WINDOW", 10)),
+                         park_for=float(os.environ.get("EVENT_PARK_TIME", 2)))
+
+# Reports anything that blocks the event loop for WATCHDOG_THRESHOLD seconds, or any event handler still going after
+# SLOW_HANDLER_THRESHOLD seconds, with its stack and the event being handled to WATCHDOG_LOG, see "loop_watchdog.py"
+
+loop_watchdog = LoopWatchdog(path=os.environ.get("WATCHDOG_LOG", "slow_calls.jsonl"),
+                             threshold=float(os.environ.get("WATCHDOG_THRESHOLD", 0.25)),
+                             slow_handler=float(os.environ.get("SLOW_HANDLER_THRESHOLD", 2)))
+
+event_dispatcher = EventDispatcher(guard=event_guard, watch=loop_watchdog.watch)
+
+# Printing every raw message was a lot of console spam (and slowed the read loop down in busy periods), so it's only
+# done if LOG_WEBSOCKET_MESSAGES is set
+
+LOG_WEBSOCKET_MESSAGES = bool(os.environ.get("LOG_WEBSOCKET_MESSAGES"))
+
+
+@event_dispatcher.handler("game_created")
+async def on_game_created(data, received_at):
+
+    game_id = data["game_id"]
+
+    if game_id in lobby_info:
+
+        # Again, more a paranoia measure than an actual risk, but I added this if else because I worried that if the
+        # websocket's connection to the bot weakens, it could send the event more than once, causing issues, so now,
+        # if the GameID is already present in the "lobby_info" dictionary, it will just ignore it and wait for the
+        # next event
+
+        print(f"Oh shit lol, websocket having a stroke because {game_id}, just endure it")
+
+        return
+
+    print("New Game Created")
+
+    # Does a quick API search to gain vital information not provided in the websocket event message, such as the
+    # game's player limit or the game's description. If that fails, the game gets fetched again once the events queued
+    # up behind this one have been handled, rather than having every game fetched again
+
+    try:
+
+        response = await api_client.get_game(game_id)
+
+    except SaveMGOError as e:
+
+        print(f"Couldn't look up new game {game_id}, trying again shortly, error:{e}")
+
+        request_refresh(game_id)
+
+        return
+
+    # The websocket's message doesn't properly display unicode characters in the host's name, and converting it back
+    # mangles anything that isn't plain ASCII, so the name comes from the API like every other player's, which is
+    # already proper UTF-8. If that lookup fails, the next reconcile tries it again
+
+    host_name = await id_and_name_converter(response.user_id, "name")
+
+    lobby_info[game_id] = Lobby(game_id=game_id,
+                                name=data["name"],
+                                description=response.description.capitalize(),
+                                map=data["rules"][0]["Map"].title(),
+                                mode=data["rules"][0]["Mode"].title(),
+                                max_players=response.max_players,
+                                players=[Player(response.user_id, host_name)])
+
+    change_player_count(lobby_info[game_id].player_count)
+
+    record_event("game_created", game_id, user_id=response.user_id, map=lobby_info[game_id].map,
+                 mode=lobby_info[game_id].mode)
+
+    notify_watchers(lobby_info[game_id], "player", response.user_id,
+                    f"**{discord.utils.escape_markdown(host_name or str(response.user_id))}** is hosting "
+                    f"{lobby_link(lobby_info[game_id])}")
+
+    notify_round(lobby_info[game_id])
+
+    # A new game only needs one new message per channel, everything already posted stays put
+
+    lobby_changed(game_id, received_at)
+
+
+@event_dispatcher.handler("game_player_joined")
+async def on_game_player_joined(data, received_at):
+
+    print("Player Joined")
+
+    # Player name is not provided in websocket response, so using the "id_and_name_converter()" method, the bot will do
+    # a quick API search using the userID to quickly find the associated username
+
+    player_id = data["user_id"]
+
+    player_name = await id_and_name_converter(player_id, "name")
+
+    # Adding the player to the lobby, the "No Username Was Found" handling for blank names happens when the embed is
+    # made
+
+    # "event_guard" only lets this through for games the bot has, but one could still have been removed by a
+    # reconcile while the name was being looked up
+
+    lobby = lobby_info.get(data["game_id"])
+
+    if lobby is None:
+
+        return
+
+    before = lobby.player_count
+
+    lobby.add_player(Player(player_id, player_name))
+
+    change_player_count(lobby.player_count - before)
+
+    record_event("game_player_joined", data["game_id"], user_id=player_id)
+
+    notify_watchers(lobby, "player", player_id,
+                    f"**{discord.utils.escape_markdown(player_name or str(player_id))}** joined {lobby_link(lobby)}")
+
+    # Only the game the player joined has changed, so only its messages get edited
+
+    lobby_changed(data["game_id"], received_at)
+
+
+@event_dispatcher.handler("game_player_left")
+async def on_game_player_left(data, received_at):
+
+    print("Player Left")
+
+    # Players are kept by their UserID, so there's no need to look their name up again to find them
+
+    lobby = lobby_info.get(data["game_id"])
+
+    if lobby is None:
+
+        return
+
+    before = lobby.player_count
+
+    lobby.remove_player(data["user_id"])
+
+    change_player_count(lobby.player_count - before)
+
+    record_event("game_player_left", data["game_id"], user_id=data["user_id"])
+
+    lobby_changed(data["game_id"], received_at)
+
+
+@event_dispatcher.handler("game_new_round")
+async def on_game_new_round(data, received_at):
+
+    print("New Round")
+
+    lobby = lobby_info.get(data["game_id"])
+
+    if lobby is None:
+
+        return
+
+    # Updating game mode and map to the current settings
+
+    lobby.set_round(data["map"].title(), data["mode"].title())
+
+    record_event("game_new_round", data["game_id"], map=data["map"].title(), mode=data["mode"].title())
+
+    notify_round(lobby)
+
+    lobby_changed(data["game_id"], received_at)
+
+
+@event_dispatcher.handler("game_deleted")
+async def on_game_deleted(data, received_at):
+
+    print("Game Deleted")
+
+    # Removes all information regarding deleted host
+
+    # Deleting a game that's already gone is fine, there's just nothing to do
+
+    lobby = lobby_info.pop(data["game_id"], None)
+
+    if lobby is None:
+
+        return
+
+    change_player_count(-lobby.player_count)
+
+    record_event("game_deleted", data["game_id"])
+
+    if watchlist is not None:
+
+        watchlist.forget_game(data["game_id"])
+
+    # Deletes just the deleted game's messages, every other lobby is left alone
+
+    lobby_changed(data["game_id"], received_at)
+
+
+async def subscribe_to_game_events(on_connected):
+    """Connects to the MGO1 websocket and listens for 5 events, a game being created, a player joining a game,
+    a player leaving a game, a game moving on to a new round and a game being deleted.
+
+    This information will then be
+    used to send messages to Discord channels listed in the .env file for near live game updates.
+
+    This is run by "websocket_supervisor", which connects it again whenever it stops, "on_connected" is called once
+    the connection is up so the supervisor knows to catch up on anything missed while it was down"""
+
+    # This connects to MGO1's websocket sends an initial query to it, requesting to be informed about the events
+    # specified in "initial_query['events']"
+
+    async with websockets.connect(WEBSOCKET_URL) as websocket:
+        initial_query = {
+            "type": "mgo1_bot",
+            "events": ["EventGameCreated", "EventGamePlayerJoined", "EventGameNewRound", "EventGamePlayerLeft",
+                       "EventGameDeleted"]
+        }
+        await websocket.send(json.dumps(initial_query))
+
+        await on_connected()
+
+        # After sending initial query to websocket, it will now listen for any messages from the websocket forever
+        # (or until it crashes, whichever comes first lol). All this does is timestamp each message and hand it to
+        # "event_queue", the handlers run separately so nothing on the Discord side can hold up reading the socket
+
+        async for message in websocket:
+            received_at = time.perf_counter()
+
+            if LOG_WEBSOCKET_MESSAGES:
+
+                print("Received message:", message)
+
+            event_queue.put(message, received_at)
+
+
+async def handle_websocket_message(message, received_at):
+    """Takes in a message from "event_queue" and when it was received, then has "event_dispatcher" handle it"""
+
+    event = await event_dispatcher.dispatch(message, received_at)
+
+    if event is not None:
+
+        WEBSOCKET_MESSAGES.inc(event=event)
+
+
+def unnamed_players(lobby):
+    """The UserIDs of the players in the lobby whose names couldn't be looked up when they joined"""
+
+    return [user_id for user_id, player in lobby.players.items() if player.name is None]
+
+
+def fill_in_names(lobby, names):
+    """Takes in a Lobby and UserID -> name, then gives any player whose name couldn't be looked up before the name
+    from "names", if it was found this time"""
+
+    for user_id in unnamed_players(lobby):
+
+        if names.get(user_id) is not None:
+
+            lobby.add_player(Player(user_id, names[user_id]))
+
+
+def record_lobby_found(lobby, host_id):
+    """Records a game the bot found from the API rather than heard about from the websocket in the history, as if it
+    had just been created by "host_id" and everyone else had joined it, the same as the events it missed would have"""
+
+    record_event("game_created", lobby.game_id, user_id=host_id, map=lobby.map, mode=lobby.mode)
+
+    for user_id in lobby.players:
+
+        if user_id != host_id:
+
+            record_event("game_player_joined", lobby.game_id, user_id=user_id)
+
+
+def sync_lobby(lobby, game, names, record=True):
+    """Brings an existing Lobby in line with the same game fresh from the API, only touching what has actually changed,
+    "names" only needs to cover the players who weren't in the lobby before and the ones without a name yet. Players
+    in or out are recorded in the history unless "record" is False"""
+
+    lobby.set_round(game.current_rule.map_string.title(), game.current_rule.mode_string.title())
+
+    if (lobby.name, lobby.description, lobby.max_players) != (game.name, game.description.capitalize(),
+                                                              game.max_players):
+
+        lobby.name = game.name
+        lobby.description = game.description.capitalize()
+        lobby.max_players = game.max_players
+
+        lobby.touch()
+
+    player_ids = {player.user_id for player in game.players}
+
+    # Anyone gone from the game left (and anyone new joined) without the bot hearing about it, so the history is told
+    # here instead, otherwise sessions would be left open for good and joins and leaves wouldn't add up
+
+    for user_id in [user_id for user_id in lobby.players if user_id not in player_ids]:
+
+        lobby.remove_player(user_id)
+
+        if record:
+
+            record_event("game_player_left", lobby.game_id, user_id=user_id)
+
+    for player in game.players:
+
+        if player.user_id not in lobby.players:
+
+            lobby.add_player(Player(player.user_id, names.get(player.user_id)))
+
+            if record:
+
+                record_event("game_player_joined", lobby.game_id, user_id=player.user_id)
+
+    fill_in_names(lobby, names)
+
+
+async def refresh_game(game_id):
+    """Fetches just the one game from SaveMGO and brings its lobby in line with it, for when the bot has missed
+    something about a single game and fetching every game again would be overkill. Like the handlers, this has to run
+    in turn with them (from "event_queue") so nothing else changes the lobby halfway through"""
+
+    try:
+
+        game = await api_client.get_game(game_id)
+
+    except SaveMGOError as e:
+
+        # Most likely the game has ended since, if not, the next reconcile picks it up
+
+        print(f"Couldn't fetch game {game_id}, error:{e}")
+
+        return
+
+    lobby = lobby_info.get(game_id)
+
+    names = await resolve_player_names([player.user_id for player in game.players
+                                        if lobby is None or player.user_id not in lobby.players]
+                                       + (unnamed_players(lobby) if lobby is not None else []))
+
+    if lobby is None:
+
+        lobby = lobby_info[game_id] = lobby_from_game(game, names)
+
+        change_player_count(lobby.player_count)
+
+        record_lobby_found(lobby, game.user_id)
+
+    else:
+
+        version, before = lobby.version, lobby.player_count
+
+        sync_lobby(lobby, game, names)
+
+        if lobby.version == version:
+
+            return
+
+        change_player_count(lobby.player_count - before)
+
+    lobby_changed(game_id)
+
+
+# Totals over every reconcile so far, for "health_check()"
+
+reconcile_stats = {"runs": 0, "added": 0, "removed": 0, "changed": 0, "unchanged": 0, "skipped": 0, "named": 0}
+
+
+# GameIDs with a "refresh_game()" waiting its turn in "event_queue"
+
+refreshes_pending = set()
+
+
+def request_refresh(game_id):
+    """Has "refresh_game()" run for the game in turn with the event handlers, for anywhere that can't just await it
+    itself (the handlers can, since they already run in turn). Asking again before it has run does nothing"""
+
+    if game_id in refreshes_pending:
+
+        return
+
+    refreshes_pending.add(game_id)
+
+    async def refresh():
+
+        try:
+
+            await refresh_game(game_id)
+
+        finally:
+
+            refreshes_pending.discard(game_id)
+
+    event_queue.put_call(refresh)
+
+
+async def reconcile_lobbies(grace=0.0, record=True):
+    """Fetches the game list once and applies just the differences between it and "lobby_info" (games added or
+    removed, players in or out, a new round), so only the lobbies that actually changed get touched on Discord. Run
+    after the websocket reconnects and every RECONCILE_INTERVAL seconds in the background.
+
+    Each game is compared by its fingerprint first, so the ones that are the same (nearly all of them, normally) cost
+    one hash each. "grace" leaves alone any game an event has changed in the last that many seconds. What's found is
+    recorded in the history unless "record" is False, for when the bot is starting up, since games and players that
+    were already around before then are left out of it"""
+
+    current_lobbies = {game.id: game for game in await api_client.list_games()}
+
+    now = time.perf_counter()
+
+    recent = {game_id for game_id, at in last_event_at.items() if now - at < grace}
+
+    for game_id in [game_id for game_id, at in last_event_at.items() if now - at >= max(grace, RECONCILE_GRACE)]:
+
+        del last_event_at[game_id]
+
+    removed_ids = [game_id for game_id in lobby_info if game_id not in current_lobbies and game_id not in recent]
+
+    differing = {game_id: game for game_id, game in current_lobbies.items()
+                 if game_id not in recent
+                 and (game_id not in lobby_info or lobby_info[game_id].fingerprint() != game_fingerprint(game))}
+
+    # Players whose names couldn't be looked up when they joined get another go, even in games that are otherwise the
+    # same, since the fingerprint leaves names out
+
+    unnamed = {game_id: user_ids for game_id, lobby in lobby_info.items()
+               if game_id in current_lobbies and game_id not in recent and (user_ids := unnamed_players(lobby))}
+
+    # Only players the bot doesn't already know about need looking up, and those are all done in one batch
+
+    new_players = [player.user_id for game_id, game in differing.items() for player in game.players
+                   if game_id not in lobby_info or player.user_id not in lobby_info[game_id].players]
+
+    names = await resolve_player_names(new_players + [user_id for user_ids in unnamed.values() for user_id in user_ids])
+
+    added = changed = named = 0
+
+    for game_id in removed_ids:
+
+        del lobby_info[game_id]
+
+        # Same as in "on_game_deleted()", the history closes the game's sessions and the watchlist forgets who it has
+        # already told about the game
+
+        if record:
+
+            record_event("game_deleted", game_id)
+
+        if watchlist is not None:
+
+            watchlist.forget_game(game_id)
+
+        lobby_changed(game_id)
+
+    for game_id, game in differing.items():
+
+        lobby = lobby_info.get(game_id)
+
+        if lobby is None:
+
+            lobby = lobby_info[game_id] = lobby_from_game(game, names)
+
+            if record:
+
+                record_lobby_found(lobby, game.user_id)
+
+            lobby_changed(game_id)
+
+            added += 1
+
+            continue
+
+        version = lobby.version
+
+        sync_lobby(lobby, game, names, record)
+
+        if lobby.version != version:
+
+            lobby_changed(game_id)
+
+            changed += 1
+
+    for game_id in unnamed.keys() - differing.keys():
+
+        lobby = lobby_info[game_id]
+
+        version = lobby.version
+
+        fill_in_names(lobby, names)
+
+        if lobby.version != version:
+
+            lobby_changed(game_id)
+
+            named += 1
+
+    reconcile_stats["runs"] += 1
+    reconcile_stats["added"] += added
+    reconcile_stats["removed"] += len(removed_ids)
+    reconcile_stats["changed"] += changed
+    reconcile_stats["unchanged"] += len(current_lobbies) - len(differing) - len(recent & current_lobbies.keys())
+    reconcile_stats["skipped"] += len(recent)
+    reconcile_stats["named"] += named
+
+    # The background reconcile runs often enough that it's only worth mentioning when it actually found something
+
+    if added or removed_ids or changed or named or not grace:
+
+        print(f"Caught up, {added} lobbies added, {len(removed_ids)} removed, {changed} changed, {named} given names "
+              f"that couldn't be looked up before")
+
+    recount_players()
+
+
+# Messages wait in "event_queue" between the websocket and their handlers, up to EVENT_QUEUE_SIZE of them. If handling
+# falls that far behind, EVENT_QUEUE_OVERFLOW decides what to do, "coalesce" squashes the queued events down per game
+# (reconciling if that doesn't free up any room) and "reconcile" goes straight to reconciling. Reconciles run on the
+# same consumer as the handlers, so the two never change "lobby_info" at the same time
+
+event_queue = EventQueue(handle=handle_websocket_message, reconcile=reconcile_lobbies, parse=event_dispatcher.parse,
+                         max_size=int(os.environ.get("EVENT_QUEUE_SIZE", 1000)),
+                         overflow=os.environ.get("EVENT_QUEUE_OVERFLOW", "coalesce"))
+
+metrics.gauge("mgo1_event_queue_depth", "Websocket messages waiting to be handled", function=lambda: len(event_queue))
+
+
+async def catch_up_after_reconnect():
+
+    event_queue.request_reconcile()
+
+
+# Keeps "subscribe_to_game_events()" running, if the websocket drops it's reconnected straight away (backing off if
+# SaveMGO keeps refusing) and then "reconcile_lobbies()" catches up on whatever was missed in the meantime, once the
+# messages from before the drop have been handled
+
+websocket_supervisor = ConnectionSupervisor(listen=subscribe_to_game_events, on_reconnect=catch_up_after_reconnect)
+
+
+async def apply_state_message(message):
+    """Takes in a message from the ingest process (see "state_bus.py"), then brings "lobby_info" in line with it and
+    renders whatever changed, this is how lobbies get into "lobby_info" in the "presenter" role"""
+
+    global player_count
+
+    received_at = time.perf_counter()
+
+    if message["type"] == "snapshot":
+
+        # Sent every time the connection is made, so anything missed while disconnected is caught up on here, only
+        # the lobbies that are actually different get rendered
+
+        incoming = {lobby_snapshot[0]: lobby_snapshot for lobby_snapshot in message["lobbies"]}
+
+        for game_id in [game_id for game_id in lobby_info if game_id not in incoming]:
+
+            del lobby_info[game_id]
+
+            lobby_changed(game_id, received_at)
+
+        for lobby_snapshot in incoming.values():
+
+            apply_lobby_state(lobby_snapshot, received_at)
+
+        player_count = message["players"]
+
+        channel_namer.update(player_count)
+
+        print(f"Caught up from the ingest process, {len(lobby_info)} lobbies")
+
+    elif message["type"] == "lobby":
+
+        apply_lobby_state(message["lobby"], received_at)
+
+    elif message["type"] == "removed":
+
+        if lobby_info.pop(message["game_id"], None) is not None:
+
+            lobby_changed(message["game_id"], received_at)
+
+    elif message["type"] == "players":
+
+        player_count = message["count"]
+
+        channel_namer.update(player_count)
+
+
+def apply_lobby_state(lobby_snapshot, received_at):
+
+    current = lobby_info.get(lobby_snapshot[0])
+
+    if current is not None and current.to_snapshot() == lobby_snapshot:
+
+        return
+
+    lobby_info[lobby_snapshot[0]] = Lobby.from_snapshot(lobby_snapshot)
+
+    lobby_changed(lobby_snapshot[0], received_at)
+
+
+async def follow_ingest(on_connected):
+
+    await follow(STATE_BUS_PATH, on_connected, apply_state_message)
+
+
+# Keeps a presenter connected to the ingest process, every connection starts with a full snapshot, so there's nothing
+# extra to do after a reconnect
+
+state_follower = ConnectionSupervisor(listen=follow_ingest, on_reconnect=None, name="State bus")
+
+
+async def run_ingest():
+    """Runs the "ingest" role, everything to do with SaveMGO and nothing to do with Discord, the lobbies are built
+    exactly as they would be for posting, then published to the presenters instead"""
+
+    global started_up
+
+    await state_broker.start()
+
+    snapshot = load_snapshot(STATE_SNAPSHOT_PATH, STATE_SNAPSHOT_MAX_AGE)
+
+    if snapshot is not None:
+
+        restore_snapshot(snapshot)
+
+    # Starting from nothing, this just fetches and adds every game, if SaveMGO is down the background reconcile does it
+    # once it's back
+
+    try:
+
+        await reconcile_lobbies(record=False)
+
+    except SaveMGOError as e:
+
+        print(f"Couldn't get the lobbies from SaveMGO, carrying on and catching up once it's back, error:{e}")
+
+    print("Ingest Start Up Successful")
+
+    started_up = True
+
+    background_reconcile.start()
+
+    connected_player_check.start()
+
+    if event_history is not None:
+
+        event_history.start()
+
+    state_saver.start()
+
+    event_queue.start()
+
+    websocket_supervisor.start()
+
+    health_check.start()
+
+    await start_monitoring()
+
+    try:
+
+        await asyncio.Event().wait()
+
+    finally:
+
+        await api_client.close()
+
+
+@tasks.loop(minutes=5)
+async def health_check():
+    """Every five minutes, prints how the websocket connection and the Discord side of the bot are getting on"""
+
+    print(f"Websocket: {websocket_supervisor.stats()}, events: {event_queue.stats()}, "
+          f"renders: {render_scheduler.stats()}, embeds: {embed_renderer.stats()}, board: {lobby_board.stats()}, "
+          f"channel names: {channel_namer.stats()}, outbound: {outbound.stats()}")
+
+    if state_broker is not None:
+
+        print(f"State bus: {state_broker.stats()}")
+
+    if event_history is not None:
+
+        print(f"Event history: {event_history.stats()}")
+
+    if ROLE != "presenter":
+
+        print(f"Event guard: {event_guard.stats()}, reconciles: {reconcile_stats}")
+
+    print(f"Event loop watchdog: {loop_watchdog.stats()}")
+
+    if watchlist is not None:
+
+        print(f"Watchlist: {len(watchlist)} subscriptions, notifications: {notification_batcher.stats()}")
+
+
+# Only runs the bot when started directly, so the benchmarks can import this file and drive it against fakes
+
+if __name__ == "__main__":
+
+    # Deploys stop the bot with SIGTERM, which is treated like Ctrl+C so it shuts down properly
+
+    def stop(signum, frame):
+
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+
+        if ROLE == "ingest":
+
+            asyncio.run(run_ingest())
+
+        else:
+
+            bot.run(BOT_TOKEN)
+
+    except KeyboardInterrupt:
+
+        pass
+
+    finally:
+
+        # However the bot stopped, whatever it posted since the last save is saved now too, as long as it got far enough
+        # to have anything worth saving (a bad token shouldn't wipe out the last run's snapshot)
+
+        if started_up:
+
+            save_state()
+
+        # The history only gets written every HISTORY_FLUSH_INTERVAL seconds, so whatever's recorded since then is
+        # written now, the bot's own event loop is gone by this point so this gets one of its own
 
+        if event_history is not None:
 
-bot.run(BOT_TOKEN)
+            asyncio.run(event_history.flush())
@@ -0,0 +1,58 @@
+# Keeps track of which Discord message is showing which lobby in which channel, so when something happens in a game
+# the bot can edit (or delete) just that one message rather than purging the whole channel and posting every lobby
+# again
+
+
+class MessageRegistry:
+    """Maps (GameID, ChannelID) to the MessageID of the embed showing that game in that channel"""
+
+    def __init__(self):
+
+        # GameID -> {ChannelID: MessageID}, grouped by game since a game's messages are usually all needed at once
+
+        self._messages = {}
+
+        # Goes up whenever a message is added, replaced or forgotten, so the bot can tell when it needs saving again
+
+        self.changes = 0
+
+    def __len__(self):
+
+        return sum(len(channels) for channels in self._messages.values())
+
+    def get(self, game_id, channel_id):
+
+        return self._messages.get(game_id, {}).get(channel_id)
+
+    def set(self, game_id, channel_id, message_id):
+
+        channels = self._messages.setdefault(game_id, {})
+
+        if channels.get(channel_id) != message_id:
+
+            channels[channel_id] = message_id
+
+            self.changes += 1
+
+    def pop_game(self, game_id):
+        """Forgets every message belonging to the game and returns them as a dictionary of ChannelID -> MessageID"""
+
+        messages = self._messages.pop(game_id, {})
+
+        if messages:
+
+            self.changes += 1
+
+        return messages
+
+    def to_snapshot(self):
+        """Returns the registry as a JSON-friendly list of [GameID, ChannelID, MessageID]"""
+
+        return [[game_id, channel_id, message_id] for game_id, channels in self._messages.items()
+                for channel_id, message_id in channels.items()]
+
+    def load_snapshot(self, snapshot):
+
+        for game_id, channel_id, message_id in snapshot:
+
+            self.set(game_id, channel_id, message_id)
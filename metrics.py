@@ -0,0 +1,221 @@
+import asyncio, bisect, math
+
+from aiohttp import web
+
+# A small set of Prometheus style metrics (counters, gauges and histograms) that the rest of the bot records into, and
+# a local HTTP endpoint that serves them all in Prometheus' text format at /metrics. Every module defines the metrics it
+# needs at the top with "counter()", "gauge()" or "histogram()", which all go into the one shared registry here
+
+# Default histogram buckets, in seconds, going from "basically instant" up to "Discord is rate limiting us"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value):
+
+    if value == math.inf:
+
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=()):
+
+    pairs = list(zip(names, values)) + list(extra)
+
+    if not pairs:
+
+        return ""
+
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+
+    type = None
+
+    def __init__(self, name, documentation, labels=(), function=None):
+
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+        # An unlabelled metric can be given a function instead, which is called for its value whenever it's scraped,
+        # handy for numbers that are already being counted somewhere else
+
+        self.function = function
+
+        self._values = {}
+
+    def _key(self, labels):
+
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+
+        if self.function is not None:
+
+            yield self.name, "", self.function()
+
+            return
+
+        for key, value in sorted(self._values.items()):
+
+            yield self.name, _format_labels(self.labels, key), value
+
+    def render(self):
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+        for name, labels, value in self.samples():
+
+            lines.append(f"{name}{labels} {_format_value(value)}")
+
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+
+        key = self._key(labels)
+
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+
+    type = "gauge"
+
+    def set(self, value, **labels):
+
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+
+        super().__init__(name, documentation, labels)
+
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+
+        key = self._key(labels)
+
+        state = self._values.get(key)
+
+        if state is None:
+
+            # [count per bucket (non-cumulative, the last one being +Inf), sum, count]
+
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def samples(self):
+
+        for key, (bucket_counts, total, count) in sorted(self._values.items()):
+
+            cumulative = 0
+
+            for bound, bucket_count in zip(self.buckets + (math.inf,), bucket_counts):
+
+                cumulative += bucket_count
+
+                yield f"{self.name}_bucket", _format_labels(self.labels, key, [("le", _format_value(bound))]), \
+                    cumulative
+
+            yield f"{self.name}_sum", _format_labels(self.labels, key), total
+            yield f"{self.name}_count", _format_labels(self.labels, key), count
+
+
+class Registry:
+
+    def __init__(self):
+
+        self._metrics = {}
+
+    def _register(self, metric):
+
+        if metric.name in self._metrics:
+
+            raise ValueError(f"Metric {metric.name} is already registered")
+
+        self._metrics[metric.name] = metric
+
+        return metric
+
+    def counter(self, name, documentation, labels=(), function=None):
+
+        return self._register(Counter(name, documentation, labels, function))
+
+    def gauge(self, name, documentation, labels=(), function=None):
+
+        return self._register(Gauge(name, documentation, labels, function))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+# How far behind the event loop is running, a blocking call anywhere in the bot shows up here straight away
+
+LOOP_LAG = histogram("mgo1_event_loop_lag_seconds", "How late the event loop woke up from a timed sleep",
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+
+
+async def monitor_loop_lag(interval=0.5):
+    """Sleeps for "interval" over and over, and records how much longer than that each sleep actually took"""
+
+    loop = asyncio.get_running_loop()
+
+    while True:
+
+        started = loop.time()
+
+        await asyncio.sleep(interval)
+
+        LOOP_LAG.observe(max(0.0, loop.time() - started - interval))
+
+
+async def start_http_server(host, port):
+    """Serves every metric at http://host:port/metrics, returns the runner so it can be cleaned up"""
+
+    async def handle_metrics(request):
+
+        return web.Response(body=REGISTRY.render().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+
+    runner = web.AppRunner(app, access_log=None)
+
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+
+    return runner
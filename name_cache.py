@@ -0,0 +1,240 @@
+import asyncio, json, os, time
+from collections import OrderedDict
+
+from snapshot import write_json
+
+# The bot needs a player's display name every time they join or leave a lobby, and the same few hundred regulars get
+# looked up over and over, so this sits in front of the API and remembers names for a while. It's an LRU (oldest
+# untouched names get dropped first once it's full), entries expire after a TTL so renames eventually show up, lookups
+# that failed are remembered for a short while so a broken profile doesn't get hammered, and if several lookups of the
+# same UserID happen at once, they all wait on the one API call instead of doing one each
+
+
+class NameCache:
+    """Bounded LRU cache of UserID -> display name with TTL expiry, negative caching, request coalescing and a JSON
+    snapshot on disk so a restart starts warm"""
+
+    def __init__(self, fetch, max_size=5000, ttl=6 * 60 * 60, negative_ttl=60, snapshot_path=None):
+
+        # "fetch" is a coroutine function that takes a UserID and returns the display name, it's only called on a miss
+
+        self.fetch = fetch
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.snapshot_path = snapshot_path
+
+        # UserID -> (name, expires_at), a name of None means the lookup failed and is being negatively cached
+
+        self._entries = OrderedDict()
+        self._in_flight = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.negative_hits = 0
+        self.errors = 0
+
+    def __len__(self):
+
+        return len(self._entries)
+
+    def _lookup(self, user_id):
+        """Returns the cached entry for the UserID if there is one that hasn't expired, bumping it to the most recently
+        used end of the LRU"""
+
+        entry = self._entries.get(user_id)
+
+        if entry is None:
+
+            return None
+
+        if entry[1] <= time.time():
+
+            del self._entries[user_id]
+
+            return None
+
+        self._entries.move_to_end(user_id)
+
+        return entry
+
+    def _store(self, user_id, name, ttl):
+
+        self._entries[user_id] = (name, time.time() + ttl)
+        self._entries.move_to_end(user_id)
+
+        while len(self._entries) > self.max_size:
+
+            self._entries.popitem(last=False)
+
+    def put(self, user_id, name):
+        """Stores a name that was learnt some other way (e.g. a bulk lookup) without going to the API"""
+
+        self._store(user_id, name, self.ttl)
+
+    def invalidate(self, user_id):
+
+        self._entries.pop(user_id, None)
+
+    async def get(self, user_id):
+        """Returns the display name for the UserID, or None if the API lookup failed"""
+
+        entry = self._lookup(user_id)
+
+        if entry is not None:
+
+            if entry[0] is None:
+
+                self.negative_hits += 1
+
+            else:
+
+                self.hits += 1
+
+            return entry[0]
+
+        # If someone else is already fetching this UserID, piggyback on their request rather than sending another
+
+        task = self._in_flight.get(user_id)
+
+        if task is None:
+
+            self.misses += 1
+
+            task = asyncio.ensure_future(self._fetch_and_store(user_id))
+
+            self._in_flight[user_id] = task
+
+            task.add_done_callback(lambda _: self._in_flight.pop(user_id, None))
+
+        else:
+
+            self.coalesced += 1
+
+        # Shielded so that one waiter being cancelled doesn't cancel the lookup everyone else is waiting on
+
+        return await asyncio.shield(task)
+
+    async def get_many(self, user_ids, concurrency=10):
+        """Looks up a whole batch of UserIDs at once and returns a dictionary of UserID -> name (None for failures).
+
+        Duplicates are only looked up once, names already cached are answered straight away, and the rest are fetched
+        concurrently, at most "concurrency" at a time, so the batch takes about as long as its slowest lookup rather
+        than all of them added together"""
+
+        names = {}
+        missing = []
+
+        for user_id in dict.fromkeys(user_ids):
+
+            entry = self._lookup(user_id)
+
+            if entry is None:
+
+                missing.append(user_id)
+
+            else:
+
+                if entry[0] is None:
+
+                    self.negative_hits += 1
+
+                else:
+
+                    self.hits += 1
+
+                names[user_id] = entry[0]
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def lookup(user_id):
+
+            async with semaphore:
+
+                return await self.get(user_id)
+
+        for user_id, name in zip(missing, await asyncio.gather(*(lookup(user_id) for user_id in missing))):
+
+            names[user_id] = name
+
+        return names
+
+    async def _fetch_and_store(self, user_id):
+
+        try:
+
+            name = await self.fetch(user_id)
+
+        except Exception as e:
+
+            print(f"Couldn't look up the name of {user_id}, error:{e}")
+
+            self.errors += 1
+
+            self._store(user_id, None, self.negative_ttl)
+
+            return None
+
+        self._store(user_id, name, self.ttl)
+
+        return name
+
+    def stats(self):
+        """Returns the hit/miss counters, "misses" is the number of API calls the cache actually let through"""
+
+        lookups = self.hits + self.negative_hits + self.misses + self.coalesced
+
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "coalesced": self.coalesced,
+                "negative_hits": self.negative_hits, "errors": self.errors,
+                "hit_rate": (lookups - self.misses) / lookups if lookups else 0.0}
+
+    def to_snapshot(self):
+        """Returns the cache contents as plain JSON-friendly data, failed lookups are left out on purpose since they're
+        only meant to be remembered for a short while"""
+
+        now = time.time()
+
+        return {str(user_id): [name, expires_at] for user_id, (name, expires_at) in self._entries.items()
+                if name is not None and expires_at > now}
+
+    def load_snapshot(self, snapshot):
+        """Fills the cache from data made by "to_snapshot()", skipping anything that has expired since"""
+
+        now = time.time()
+
+        for user_id, (name, expires_at) in snapshot.items():
+
+            if expires_at > now:
+
+                self._entries[int(user_id) if user_id.isdigit() else user_id] = (name, expires_at)
+
+        while len(self._entries) > self.max_size:
+
+            self._entries.popitem(last=False)
+
+    def save(self):
+        """Writes the cache to "snapshot_path" """
+
+        if not self.snapshot_path:
+
+            return
+
+        write_json(self.snapshot_path, self.to_snapshot())
+
+    def load(self):
+        """Loads the snapshot written by "save()" if there is one, a missing or broken file just means starting cold"""
+
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+
+            return
+
+        try:
+
+            with open(self.snapshot_path, encoding="utf-8") as file:
+
+                self.load_snapshot(json.load(file))
+
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+
+            print(f"Name cache snapshot couldn't be loaded, starting cold, error:{e}")
@@ -0,0 +1,272 @@
+import asyncio, time
+from collections import deque
+
+import metrics
+
+# Everything the bot sends to Discord goes through the "OutboundDispatcher" in here, rather than looping over the
+# channels one at a time. It runs a handful of workers so every channel gets its update at roughly the same time, keeps
+# its own count of how many calls have gone to each of Discord's rate limit buckets so a busy channel waits on its own
+# without holding up the rest, and if a newer update for the same message turns up while an older one is still queued,
+# the older one is thrown away since it'd just be overwritten anyway
+
+# Discord's limits per bucket as (number of calls, per how many seconds), message sends/edits/deletes in a channel
+# share one bucket, channel renames are far stricter at two every ten minutes. DMs all go through the one bucket so a
+# burst of watchlist notifications gets spread out rather than sent all at once
+
+DEFAULT_ROUTE_LIMITS = {"messages": (5, 5.0), "channel_edit": (2, 600.0), "dm": (5, 1.0)}
+
+DISCORD_CALLS = metrics.counter("mgo1_discord_calls_total", "Calls made to Discord", ["route", "action"])
+DISCORD_ERRORS = metrics.counter("mgo1_discord_errors_total", "Calls to Discord that failed", ["route", "action"])
+DISCORD_LATENCY = metrics.histogram("mgo1_discord_call_seconds", "How long each call to Discord took",
+                                    ["route", "action"])
+DISCORD_SUPERSEDED = metrics.counter("mgo1_discord_superseded_total",
+                                     "Queued Discord calls replaced by a newer one before they were sent")
+
+
+class RateLimitBucket:
+    """Sliding window of the calls made to one Discord rate limit bucket"""
+
+    def __init__(self, limit, period):
+
+        self.limit = limit
+        self.period = period
+
+        self._calls = deque()
+        self._blocked_until = 0.0
+
+    def _prune(self, now):
+
+        while self._calls and self._calls[0] <= now - self.period:
+
+            self._calls.popleft()
+
+    def delay(self):
+        """Returns how many seconds until a call can be made to this bucket, 0 if one can be made right now"""
+
+        now = asyncio.get_running_loop().time()
+
+        self._prune(now)
+
+        wait = self._blocked_until - now
+
+        if len(self._calls) >= self.limit:
+
+            wait = max(wait, self._calls[0] + self.period - now)
+
+        return max(wait, 0.0)
+
+    def take(self):
+        """Takes a slot in the bucket and returns 0 if it has room, otherwise takes nothing and returns how many seconds
+        until it will"""
+
+        wait = self.delay()
+
+        if wait <= 0:
+
+            self._calls.append(asyncio.get_running_loop().time())
+
+        return wait
+
+    def block(self, retry_after):
+        """Called when Discord tells us we've been rate limited anyway, nothing goes to this bucket until it's over"""
+
+        self._blocked_until = max(self._blocked_until, asyncio.get_running_loop().time() + retry_after)
+
+
+class _Job:
+
+    __slots__ = ("bucket", "call", "future", "action")
+
+    def __init__(self, bucket, call, future, action):
+
+        self.bucket = bucket
+        self.call = call
+        self.future = future
+        self.action = action
+
+
+class OutboundDispatcher:
+    """Runs Discord calls concurrently with bounded parallelism, per bucket rate limiting and superseding of stale
+    queued updates"""
+
+    def __init__(self, concurrency=8, route_limits=None):
+
+        self.concurrency = concurrency
+        self.route_limits = dict(DEFAULT_ROUTE_LIMITS, **(route_limits or {}))
+
+        self._buckets = {}
+        self._pending = {}
+        self._running = set()
+        self._queue = None
+        self._workers = []
+
+        self.submitted = 0
+        self.superseded = 0
+        self.completed = 0
+        self.failed = 0
+        self.calls_by_route = {}
+
+    def start(self):
+        """Starts the workers, has to be called from inside the running event loop, calling it again does nothing"""
+
+        if self._workers:
+
+            return
+
+        self._queue = asyncio.Queue()
+
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+
+        for worker in self._workers:
+
+            worker.cancel()
+
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+        self._workers = []
+
+    def _bucket(self, bucket_key):
+
+        bucket = self._buckets.get(bucket_key)
+
+        if bucket is None:
+
+            limit, period = self.route_limits[bucket_key[0]]
+
+            bucket = self._buckets[bucket_key] = RateLimitBucket(limit, period)
+
+        return bucket
+
+    def delay(self, bucket_key):
+        """How many seconds until a call to the (route, ID) bucket could go out, 0 if one could right now"""
+
+        return self._bucket(bucket_key).delay()
+
+    def submit(self, call, bucket_key, key=None, action="call"):
+        """Queues "call" (a coroutine function taking no arguments) to run once the (route, ID) bucket allows it.
+
+        "key" names what the call updates, e.g. a particular message, if a call with the same key is still waiting in
+        the queue, it gets replaced by this one and both callers are handed the same future. "action" is just a name
+        for the metrics. Returns a future with the call's result"""
+
+        self.start()
+
+        self.submitted += 1
+
+        key = key if key is not None else object()
+
+        job = self._pending.get(key)
+
+        if job is not None:
+
+            self.superseded += 1
+
+            DISCORD_SUPERSEDED.inc()
+
+            job.bucket = bucket_key
+            job.call = call
+            job.action = action
+
+            return job.future
+
+        job = self._pending[key] = _Job(bucket_key, call, asyncio.get_running_loop().create_future(), action)
+
+        # If an older call for the same key is running right now, this one gets queued when that finishes instead, so
+        # updates to the same message can never overtake each other
+
+        if key not in self._running:
+
+            self._queue.put_nowait(key)
+
+        return job.future
+
+    def _requeue(self, key):
+
+        if key in self._pending and key not in self._running:
+
+            self._queue.put_nowait(key)
+
+    async def _worker(self):
+
+        while True:
+
+            key = await self._queue.get()
+
+            # A job is only handed to a worker once its bucket has room. Otherwise it's put back in the queue for when
+            # the bucket will have, rather than a worker sitting on it, so a busy channel (or a pile of DMs) can't tie
+            # up the workers every other channel needs. The job is left in "_pending" in the meantime, so anything
+            # newer that's submitted for the same key still replaces it, which is exactly when superseding matters most
+
+            wait = self._bucket(self._pending[key].bucket).take()
+
+            if wait > 0:
+
+                asyncio.get_running_loop().call_later(wait, self._requeue, key)
+
+                continue
+
+            self._running.add(key)
+
+            job = self._pending.pop(key)
+
+            self.calls_by_route[job.bucket[0]] = self.calls_by_route.get(job.bucket[0], 0) + 1
+
+            DISCORD_CALLS.inc(route=job.bucket[0], action=job.action)
+
+            started = time.perf_counter()
+
+            try:
+
+                try:
+
+                    result = await job.call()
+
+                finally:
+
+                    DISCORD_LATENCY.observe(time.perf_counter() - started, route=job.bucket[0], action=job.action)
+
+            except asyncio.CancelledError:
+
+                job.future.cancel()
+
+                raise
+
+            except Exception as e:
+
+                self.failed += 1
+
+                DISCORD_ERRORS.inc(route=job.bucket[0], action=job.action)
+
+                # Discord's 429 errors carry how long to back off for, so the bucket can respect that
+
+                if getattr(e, "status", None) == 429 or hasattr(e, "retry_after"):
+
+                    self._bucket(job.bucket).block(getattr(e, "retry_after", None) or 1.0)
+
+                if not job.future.done():
+
+                    job.future.set_exception(e)
+
+            else:
+
+                self.completed += 1
+
+                if not job.future.done():
+
+                    job.future.set_result(result)
+
+            finally:
+
+                self._running.discard(key)
+
+                if key in self._pending:
+
+                    self._queue.put_nowait(key)
+
+    def stats(self):
+
+        return {"submitted": self.submitted, "superseded": self.superseded, "completed": self.completed,
+                "failed": self.failed, "queued": len(self._pending), "running": len(self._running),
+                "calls_by_route": dict(self.calls_by_route)}
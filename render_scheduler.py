@@ -0,0 +1,116 @@
+import asyncio, time
+
+import metrics
+
+# When a match ends, SaveMGO sends a whole flurry of leaves, a new round and joins for the same game within about a
+# second, so rather than updating Discord for every single one, the events just change "lobby_info" straight away and
+# ask this to render the game. The render itself waits for a short window first, so however many events land in that
+# window, the game only gets the one Discord update showing the end result
+
+
+EVENTS_RECEIVED = metrics.counter("mgo1_render_events_total", "Lobby changes handed to the render scheduler")
+RENDERS_EMITTED = metrics.counter("mgo1_renders_total", "Lobby renders actually carried out")
+DELIVERY_LATENCY = metrics.histogram("mgo1_event_to_discord_seconds",
+                                     "Time from the oldest websocket event a render covers arriving to the render "
+                                     "reaching Discord")
+
+
+class RenderScheduler:
+    """Debounces lobby renders per game, "render" is a coroutine function taking a GameID that brings that game's
+    Discord messages in line with its current state.
+
+    "key" can map a GameID to what actually gets rendered instead, e.g. everything to one key when all the lobbies are
+    shown together, so that "render" is called with that key and events for any game share the one render"""
+
+    def __init__(self, render, window=1.0, key=None):
+
+        self.render = render
+        self.window = window
+        self.key = key
+
+        # GameID -> the task that's waiting to render it, and the GameIDs that had events come in while their render
+        # was already in progress, which means they need rendering once more afterwards
+
+        self._tasks = {}
+        self._dirty = set()
+
+        # GameID -> when the oldest event not yet covered by a render arrived, for the delivery latency
+
+        self._received = {}
+
+        self.events_received = 0
+        self.renders_emitted = 0
+
+    def schedule(self, game_id, received_at=None):
+        """Marks the game as needing a render, if one is already waiting for this game, the event just rides along
+        with it. "received_at" is when the event behind this arrived (time.perf_counter()), if it's left out, it's
+        taken to be now"""
+
+        self.events_received += 1
+
+        EVENTS_RECEIVED.inc()
+
+        if self.key is not None:
+
+            game_id = self.key(game_id)
+
+        self._received.setdefault(game_id, received_at if received_at is not None else time.perf_counter())
+
+        if game_id in self._tasks:
+
+            self._dirty.add(game_id)
+
+        else:
+
+            self._tasks[game_id] = asyncio.ensure_future(self._render_later(game_id))
+
+    async def _render_later(self, game_id):
+
+        try:
+
+            while True:
+
+                await asyncio.sleep(self.window)
+
+                # Anything that came in during the wait is covered by this render
+
+                self._dirty.discard(game_id)
+
+                received_at = self._received.pop(game_id, None)
+
+                self.renders_emitted += 1
+
+                RENDERS_EMITTED.inc()
+
+                try:
+
+                    await self.render(game_id)
+
+                except Exception as e:
+
+                    print(f"Couldn't render {game_id}, error:{e}")
+
+                else:
+
+                    if received_at is not None:
+
+                        DELIVERY_LATENCY.observe(time.perf_counter() - received_at)
+
+                # If more events arrived while the render was talking to Discord, go round again
+
+                if game_id not in self._dirty:
+
+                    break
+
+        finally:
+
+            # Nothing else starts a task for the game while this one is in "_tasks", so it's always this one's to remove
+
+            del self._tasks[game_id]
+            self._dirty.discard(game_id)
+            self._received.pop(game_id, None)
+
+    def stats(self):
+
+        return {"events_received": self.events_received, "renders_emitted": self.renders_emitted,
+                "pending": len(self._tasks)}
@@ -0,0 +1,237 @@
+import asyncio, random, time, urllib.parse
+from dataclasses import dataclass, field
+
+import aiohttp
+
+import metrics
+
+# Every call the bot makes to the SaveMGO API goes through the one "SaveMGOClient" in here, it keeps a single aiohttp
+# session open for the lifetime of the bot so that lookups reuse warm keep-alive connections instead of doing a fresh
+# TCP/TLS handshake every time, and since it's all async, a slow API no longer freezes the Discord heartbeat
+
+DEFAULT_API_URL = "https://api.mgo1.savemgo.com/api/v1"
+
+API_REQUESTS = metrics.counter("mgo1_savemgo_api_requests_total", "SaveMGO API requests sent, retries included",
+                               ["route"])
+API_ERRORS = metrics.counter("mgo1_savemgo_api_errors_total", "SaveMGO API requests that failed", ["route"])
+API_LATENCY = metrics.histogram("mgo1_savemgo_api_request_seconds", "How long each SaveMGO API request took",
+                                ["route"])
+
+
+class SaveMGOError(Exception):
+    """Raised when the SaveMGO API either can't be reached after all retries or gives back something unusable"""
+
+
+@dataclass
+class UserInfo:
+    id: int
+    display_name: str
+
+
+@dataclass
+class GameRule:
+    map_string: str
+    mode_string: str
+
+
+@dataclass
+class GamePlayer:
+    user_id: int
+
+
+@dataclass
+class GameInfo:
+    id: int
+    user_id: int
+    name: str
+    description: str
+    max_players: int
+    current_round: int
+    rules: list = field(default_factory=list)
+    players: list = field(default_factory=list)
+
+    @property
+    def current_rule(self):
+        """Returns the rule (map and mode) of the round the game is currently on"""
+
+        return self.rules[self.current_round]
+
+    @classmethod
+    def from_json(cls, data):
+        """Builds a GameInfo out of the "data" section of either a games/list entry or a games/{id} response"""
+
+        options = data["options"]
+
+        return cls(id=data["id"],
+                   user_id=data.get("user_id"),
+                   name=options["name"],
+                   description=options["description"],
+                   max_players=options["max_players"],
+                   current_round=data.get("current_round", 0),
+                   rules=[GameRule(map_string=rule["map_string"], mode_string=rule["mode_string"])
+                          for rule in options["rules"]],
+                   players=[GamePlayer(user_id=player["user_id"]) for player in data.get("players") or []])
+
+
+@dataclass
+class LobbyServer:
+    name: str
+    players: int
+
+
+class SaveMGOClient:
+    """Pooled async client for the SaveMGO API, with a timeout on every request and retries with exponential backoff
+    for connection errors, timeouts and 5xx/429 responses"""
+
+    def __init__(self, base_url=DEFAULT_API_URL, timeout=10, retries=3, backoff=0.5, pool_size=20):
+
+        self.base_url = base_url.rstrip("/")
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+
+        self._session = None
+
+    def _get_session(self):
+        """Creates the shared session the first time it's needed, this has to happen inside the running event loop,
+        which is why it isn't done in __init__"""
+
+        if self._session is None or self._session.closed:
+
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60, ttl_dns_cache=300)
+
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout,
+                                                  headers={"User-Agent": "MGO1-Lobbies-Bot"})
+
+        return self._session
+
+    async def close(self):
+
+        if self._session is not None and not self._session.closed:
+
+            await self._session.close()
+
+    async def _get_json(self, path, route):
+        """Does a GET on the given API path and returns the decoded JSON body, retrying with jittered exponential
+        backoff when the request fails for a reason that might fix itself. "route" is the path with the IDs left out,
+        for the metrics"""
+
+        url = f"{self.base_url}/{path.lstrip('/')}"
+
+        for attempt in range(self.retries + 1):
+
+            API_REQUESTS.inc(route=route)
+
+            started = time.perf_counter()
+
+            try:
+
+                async with self._get_session().get(url) as response:
+
+                    # 429 and 5xx are worth another go, anything else in the 4xx range is our fault and retrying
+                    # won't change the answer
+
+                    if response.status == 429 or response.status >= 500:
+
+                        raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                          status=response.status, message=response.reason)
+
+                    if response.status >= 400:
+
+                        API_ERRORS.inc(route=route)
+
+                        raise SaveMGOError(f"GET {url} returned {response.status}")
+
+                    try:
+
+                        data = await response.json(content_type=None)
+
+                    except ValueError as e:
+
+                        API_ERRORS.inc(route=route)
+
+                        raise SaveMGOError(f"GET {url} returned something that isn't JSON: {e}") from e
+
+                    API_LATENCY.observe(time.perf_counter() - started, route=route)
+
+                    return data
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+
+                API_ERRORS.inc(route=route)
+
+                API_LATENCY.observe(time.perf_counter() - started, route=route)
+
+                if attempt == self.retries:
+
+                    raise SaveMGOError(f"GET {url} failed after {attempt + 1} attempts: {e}") from e
+
+                await asyncio.sleep(self.backoff * (2 ** attempt) + random.uniform(0, self.backoff))
+
+    async def _get_data(self, path, route, parse):
+        """Does "_get_json()" and returns "parse" of the "data" section of the body. The API isn't ours, so if the body
+        isn't the shape expected (no "data", a null where there should be an object, a field missing) that's turned
+        into a SaveMGOError like any other failure, rather than whatever Python raises about it"""
+
+        body = await self._get_json(path, route)
+
+        try:
+
+            return parse(body["data"])
+
+        except (KeyError, IndexError, TypeError, AttributeError, ValueError) as e:
+
+            API_ERRORS.inc(route=route)
+
+            raise SaveMGOError(f"GET {path} returned something unexpected, error:{e!r}") from e
+
+    async def get_user(self, user_id):
+        """Looks up a user by their UserID"""
+
+        def user(data):
+
+            return UserInfo(id=data.get("id", user_id), display_name=data["display_name"])
+
+        return await self._get_data(f"user/{user_id}", "user/{id}", user)
+
+    async def search_user(self, name):
+        """Searches for a user by name and returns the first match"""
+
+        # The name is whatever someone typed into "/watch player", so it's escaped to stay one path segment, otherwise
+        # a "/", "?" or ".." in it would change which endpoint gets called. Escaping leaves dots alone, and a segment
+        # that's only "." or ".." gets resolved away by the URL, so those can't be searched for at all
+
+        if name.strip(".") == "":
+
+            raise SaveMGOError(f"No user found named {name}")
+
+        def first_match(results):
+
+            if not results:
+
+                raise SaveMGOError(f"No user found named {name}")
+
+            return UserInfo(id=results[0]["id"], display_name=results[0].get("display_name", name))
+
+        return await self._get_data(f"user/search/{urllib.parse.quote(name, safe='')}", "user/search/{name}",
+                                    first_match)
+
+    async def list_games(self):
+        """Returns every game currently being hosted"""
+
+        return await self._get_data("games/list", "games/list",
+                                    lambda data: [GameInfo.from_json(game) for game in data or []])
+
+    async def get_game(self, game_id):
+        """Returns a single game by its GameID"""
+
+        return await self._get_data(f"games/{game_id}", "games/{id}",
+                                    lambda data: GameInfo.from_json({"id": game_id, **data}))
+
+    async def list_lobbies(self):
+        """Returns the lobby servers along with how many players are connected to each"""
+
+        return await self._get_data("lobby/list", "lobby/list",
+                                    lambda data: [LobbyServer(name=lobby.get("name", ""), players=lobby["players"])
+                                                  for lobby in data or []])
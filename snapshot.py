@@ -0,0 +1,68 @@
+import json, os, time
+
+# Every so often the bot saves what it knows about the lobbies and which messages are showing them to a file, so when
+# it's restarted (e.g. for a deploy) it can pick up from there, check it against a single games/list call and just fix
+# up whatever changed while it was down, rather than purging every channel and rebuilding everything from scratch
+
+SNAPSHOT_FORMAT = 1
+
+
+def write_json(path, data):
+    """Writes "data" to "path" as JSON, via a temporary file and a rename so the file on disk is always either the old
+    version or the new one, never half of one. Everything the bot saves to disk goes through this"""
+
+    temp_path = f"{path}.tmp"
+
+    with open(temp_path, "w", encoding="utf-8") as file:
+
+        json.dump(data, file, separators=(",", ":"), ensure_ascii=False)
+
+    os.replace(temp_path, path)
+
+
+def save_snapshot(path, lobby_info, lobby_messages, lobby_board=None, display_mode="messages"):
+    """Writes the lobbies, message registry and board pages to "path" """
+
+    snapshot = {"format": SNAPSHOT_FORMAT,
+                "saved_at": time.time(),
+                "display_mode": display_mode,
+                "lobbies": [lobby.to_snapshot() for lobby in lobby_info.values()],
+                "messages": lobby_messages.to_snapshot(),
+                "board": lobby_board.to_snapshot() if lobby_board is not None else []}
+
+    write_json(path, snapshot)
+
+
+def load_snapshot(path, max_age):
+    """Returns the snapshot saved at "path", or None if there isn't one, it's unreadable, it was written by a different
+    version of the format or it's older than "max_age" seconds"""
+
+    if not os.path.exists(path):
+
+        return None
+
+    try:
+
+        with open(path, encoding="utf-8") as file:
+
+            snapshot = json.load(file)
+
+    except (OSError, ValueError) as e:
+
+        print(f"State snapshot couldn't be read, starting from scratch, error:{e}")
+
+        return None
+
+    if not isinstance(snapshot, dict) or snapshot.get("format") != SNAPSHOT_FORMAT:
+
+        print("State snapshot is from a different version of the bot, starting from scratch")
+
+        return None
+
+    if time.time() - snapshot.get("saved_at", 0) > max_age:
+
+        print("State snapshot is too old to be worth using, starting from scratch")
+
+        return None
+
+    return snapshot
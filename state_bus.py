@@ -0,0 +1,162 @@
+import asyncio, json, os
+
+import metrics
+
+# For running the bot split over several processes. One "ingest" process holds the SaveMGO websocket and the real lobby
+# state, and publishes every change to it over a Unix socket, any number of "presenter" processes connect to that
+# socket and each post the lobbies to their own share of the Discord guilds. Messages are one compact JSON object per
+# line:
+#
+#   {"type": "snapshot", "lobbies": [...], "players": N}  - everything, sent first to every presenter that connects
+#   {"type": "lobby", "lobby": [...]}                      - a lobby was created or changed (Lobby.to_snapshot() form)
+#   {"type": "removed", "game_id": N}                      - a lobby is gone
+#   {"type": "players", "count": N}                        - the number of players in games changed
+#
+# Since every presenter starts from a snapshot, one that falls behind or loses its connection can just be cut off, it
+# catches up completely as soon as it reconnects
+
+# Presenters can take a while to read a big snapshot, but if this much is waiting to be sent to one, it's not keeping up
+
+DEFAULT_MAX_BUFFER = 16 * 1024 * 1024
+
+# Longest line a presenter will read, the snapshot is the only one that gets anywhere near this
+
+READ_LIMIT = 64 * 1024 * 1024
+
+BUS_MESSAGES = metrics.counter("mgo1_state_bus_messages_total", "State changes published to presenters", ["type"])
+BUS_DROPPED = metrics.counter("mgo1_state_bus_presenters_dropped_total",
+                              "Presenters cut off for falling too far behind")
+
+
+def encode(message):
+
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+class StateBroker:
+    """The ingest side, serves "snapshot()" to every presenter that connects at "path", then everything "publish()"
+    is given"""
+
+    def __init__(self, path, snapshot, max_buffer=DEFAULT_MAX_BUFFER):
+
+        self.path = path
+        self.snapshot = snapshot
+        self.max_buffer = max_buffer
+
+        self._writers = set()
+        self._server = None
+
+        self.published = 0
+        self.dropped = 0
+
+    async def start(self):
+
+        # A socket file left behind by a previous run would stop the server from starting
+
+        if os.path.exists(self.path):
+
+            os.unlink(self.path)
+
+        self._server = await asyncio.start_unix_server(self._connected, path=self.path)
+
+        print(f"Publishing lobby state on {self.path}")
+
+    async def stop(self):
+
+        for writer in list(self._writers):
+
+            writer.close()
+
+        self._writers.clear()
+
+        if self._server is not None:
+
+            self._server.close()
+
+            await self._server.wait_closed()
+
+    async def _connected(self, reader, writer):
+
+        # Everything up to now goes in the snapshot, and since nothing else runs in between, everything after it goes
+        # out as a change, so nothing can be missed or doubled up
+
+        writer.write(encode(dict(self.snapshot(), type="snapshot")))
+
+        self._writers.add(writer)
+
+        print(f"Presenter connected, {len(self._writers)} connected")
+
+        try:
+
+            # Presenters never send anything, this just waits for them to hang up
+
+            await reader.read()
+
+        finally:
+
+            self._writers.discard(writer)
+
+            writer.close()
+
+            print(f"Presenter disconnected, {len(self._writers)} connected")
+
+    def publish(self, message):
+        """Sends a change to every connected presenter, this never waits, a presenter too far behind is cut off"""
+
+        self.published += 1
+
+        BUS_MESSAGES.inc(type=message["type"])
+
+        if not self._writers:
+
+            return
+
+        line = encode(message)
+
+        for writer in list(self._writers):
+
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+
+                self.dropped += 1
+
+                BUS_DROPPED.inc()
+
+                print("Presenter isn't keeping up, cutting it off so it reconnects and catches up")
+
+                self._writers.discard(writer)
+
+                writer.close()
+
+                continue
+
+            writer.write(line)
+
+    def stats(self):
+
+        return {"presenters": len(self._writers), "published": self.published, "dropped": self.dropped}
+
+
+async def follow(path, on_connected, handle):
+    """The presenter side, connects to the broker at "path", calls the "on_connected" coroutine function once it's
+    connected, then passes every message to "handle" until the connection ends. Made to be run by a
+    "ConnectionSupervisor" so it reconnects by itself"""
+
+    reader, writer = await asyncio.open_unix_connection(path, limit=READ_LIMIT)
+
+    try:
+
+        await on_connected()
+
+        while True:
+
+            line = await reader.readline()
+
+            if not line:
+
+                return
+
+            await handle(json.loads(line))
+
+    finally:
+
+        writer.close()
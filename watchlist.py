@@ -0,0 +1,220 @@
+import asyncio, json, os
+
+import metrics
+from snapshot import write_json
+
+# Lets people ask to be DMed when a particular player hosts or joins a game, or when a lobby starts a round on a
+# particular map or in a particular mode. Subscriptions are kept in inverted indexes, (kind, key) -> the Discord users
+# watching it, so an event only looks up the handful of keys it involves rather than going through everyone's
+# watchlist. Notifications are collected per person for a short while and sent as one DM, and each person only hears
+# about a given game once for each thing they're watching
+
+KINDS = ("player", "map", "mode")
+
+NOTIFICATIONS = metrics.counter("mgo1_watchlist_notifications_total", "Watchlist matches, by what was being watched",
+                                ["kind"])
+DMS_SENT = metrics.counter("mgo1_watchlist_dms_total", "Watchlist DMs handed over to be sent")
+
+
+class Watchlist:
+    """Subscriptions from Discord users to players (by SaveMGO UserID), maps and modes, saved to "path" as they
+    change"""
+
+    def __init__(self, path):
+
+        self.path = path
+
+        # kind -> {key: {Discord UserID: label}}, the label being how the subscription is shown back to them
+
+        self._watchers = {kind: {} for kind in KINDS}
+
+        # Discord UserID -> {(kind, key)}, for listing or removing someone's subscriptions
+
+        self._by_subscriber = {}
+
+        # GameID -> {(Discord UserID, kind, key)} already notified, so nobody hears about the same thing twice
+
+        self._notified = {}
+
+    def __len__(self):
+
+        return sum(len(subscriptions) for subscriptions in self._by_subscriber.values())
+
+    @staticmethod
+    def normalise(kind, key):
+
+        return key if kind == "player" else str(key).strip().lower()
+
+    def add(self, subscriber, kind, key, label):
+        """Returns False if they were already watching it"""
+
+        key = self.normalise(kind, key)
+
+        watchers = self._watchers[kind].setdefault(key, {})
+
+        if subscriber in watchers:
+
+            return False
+
+        watchers[subscriber] = label
+
+        self._by_subscriber.setdefault(subscriber, set()).add((kind, key))
+
+        self.save()
+
+        return True
+
+    def remove(self, subscriber, kind, key):
+        """Returns False if they weren't watching it"""
+
+        key = self.normalise(kind, key)
+
+        watchers = self._watchers[kind].get(key, {})
+
+        if watchers.pop(subscriber, None) is None:
+
+            return False
+
+        if not watchers:
+
+            del self._watchers[kind][key]
+
+        subscriptions = self._by_subscriber[subscriber]
+
+        subscriptions.discard((kind, key))
+
+        if not subscriptions:
+
+            del self._by_subscriber[subscriber]
+
+        self.save()
+
+        return True
+
+    def subscriptions(self, subscriber):
+        """Returns [(kind, key, label)] for everything the Discord user is watching"""
+
+        return sorted((kind, key, self._watchers[kind][key][subscriber])
+                      for kind, key in self._by_subscriber.get(subscriber, ()))
+
+    def match(self, game_id, kind, key):
+        """Returns the Discord users watching (kind, key) who haven't been told about it in this game yet, and marks
+        them as told"""
+
+        key = self.normalise(kind, key)
+
+        watchers = self._watchers[kind].get(key)
+
+        if not watchers:
+
+            return []
+
+        notified = self._notified.setdefault(game_id, set())
+
+        matches = []
+
+        for subscriber in watchers:
+
+            if (subscriber, kind, key) not in notified:
+
+                notified.add((subscriber, kind, key))
+
+                matches.append(subscriber)
+
+        NOTIFICATIONS.inc(len(matches), kind=kind)
+
+        return matches
+
+    def forget_game(self, game_id):
+
+        self._notified.pop(game_id, None)
+
+    # Saving and loading
+
+    def to_snapshot(self):
+
+        return [[subscriber, kind, key, label] for kind, keys in self._watchers.items()
+                for key, watchers in keys.items() for subscriber, label in watchers.items()]
+
+    def save(self):
+        """Writes the watchlist to "path". It's saved every time a subscription changes, so if that fails the change is
+        still kept in memory and goes to disk with the next one that works"""
+
+        if not self.path:
+
+            return
+
+        try:
+
+            write_json(self.path, self.to_snapshot())
+
+        except OSError as e:
+
+            print(f"Couldn't save the watchlist, error:{e}")
+
+    def load(self):
+
+        if not self.path or not os.path.exists(self.path):
+
+            return
+
+        try:
+
+            with open(self.path, encoding="utf-8") as file:
+
+                snapshot = json.load(file)
+
+        except (OSError, ValueError) as e:
+
+            print(f"Watchlist couldn't be loaded, error:{e}")
+
+            return
+
+        for subscriber, kind, key, label in snapshot:
+
+            self._watchers[kind].setdefault(key, {})[subscriber] = label
+
+            self._by_subscriber.setdefault(subscriber, set()).add((kind, key))
+
+        print(f"Loaded {len(self)} watchlist subscriptions")
+
+
+class NotificationBatcher:
+    """Collects notification lines per Discord user for "window" seconds, then hands each user's lines to "deliver"
+    (a function taking the Discord UserID and the list of lines) all at once"""
+
+    def __init__(self, deliver, window=10.0):
+
+        self.deliver = deliver
+        self.window = window
+
+        self._pending = {}
+        self._task = None
+
+        self.batches = 0
+
+    def add(self, subscriber, line):
+
+        self._pending.setdefault(subscriber, []).append(line)
+
+        if self._task is None or self._task.done():
+
+            self._task = asyncio.ensure_future(self._deliver_later())
+
+    async def _deliver_later(self):
+
+        await asyncio.sleep(self.window)
+
+        pending, self._pending = self._pending, {}
+
+        for subscriber, lines in pending.items():
+
+            self.batches += 1
+
+            DMS_SENT.inc()
+
+            self.deliver(subscriber, lines)
+
+    def stats(self):
+
+        return {"waiting": len(self._pending), "batches": self.batches}